@@ -20,8 +20,11 @@
 ########################################################################################
 
 from functools import total_ordering
+from array import array
+from collections import OrderedDict
 
 import sys
+import datetime
 import resolver
 
 class BddException(Exception):
@@ -137,12 +140,14 @@ class Node:
 class LeafNode(Node):
     value = None # 0 or 1
     inferValue = None # Number of unit clause asserting its value
+    handle = None # Position in manager's node store
 
     def __init__(self, value):
         id = resolver.tautologyId if value == 1 else -resolver.tautologyId        
         Node.__init__(self, id, Variable(Variable.leafLevel, "Leaf"))
         self.value = value
         self.inferValue = self.id
+        self.handle = value
 
     def isLeaf(self):
         return True
@@ -160,59 +165,40 @@ class LeafNode(Node):
         return "leaf-%d" % self.value
 
 
+# Nonleaf nodes are stored by the manager in parallel arrays indexed by integer handles.
+# A VariableNode is a lightweight view of one entry in the node store.
+# Views are created on demand, and so two views of the same node
+# are equal but need not be identical
 class VariableNode(Node):
     # Defining clause types
     (HU, LU, HD, LD) = range(4)
-    high = None
-    low = None
-    # Identity of clauses generated from node
-    definingClauseBase = 0
-    
-    def __init__(self, id, variable, high, low, prover):
-        Node.__init__(self, id, variable)
-        self.high = high
-        self.low = low
-        vid = self.variable.id
-        hid = self.high.id
-        lid = self.low.id
-        # id should be first literal in clause for some proof checkers
-        label = "node %s = ITE(%s,%s,%s)"  % (self.label(), str(self.variable), self.high.label(), self.low.label())
-            
-        antecedents = []
-        comment = "ITE assertions for %s" % label
-        if prover.verbLevel >= 3:
-            comment = "ITE assertion for %s: HU" % label
-        huid = prover.createClause(self.clauseHU(), [], comment, alreadyClean = True)
-        if huid != resolver.tautologyId:
-            comment = None
-            antecedents.append(-huid)
-            if self.definingClauseBase == 0:
-                self.definingClauseBase = huid - self.HU
-        
-        if prover.verbLevel >= 3:
-            comment = "ITE assertion for %s: LU" % label
-        luid = prover.createClause(self.clauseLU(), [], comment, alreadyClean = True)
-        if luid != resolver.tautologyId:
-            comment = None
-            antecedents.append(-luid)
-            if self.definingClauseBase == 0:
-                self.definingClauseBase = luid - self.LU
+    manager = None
+    handle = 0
 
-        if prover.verbLevel >= 3:
-            comment = "ITE assertion for %s: HD" % label
-        hdid = prover.createClause(self.clauseHD(), antecedents, comment, alreadyClean = True)
-        if hdid != resolver.tautologyId:
-            comment = None
-            if self.definingClauseBase == 0:
-                self.definingClauseBase = hdid - self.HD
+    def __init__(self, manager, handle):
+        self.manager = manager
+        self.handle = handle
 
-        if prover.verbLevel >= 3:
-            comment = "ITE assertion for %s: LD" % label
-        ldid = prover.createClause(self.clauseLD(), antecedents, comment, alreadyClean = True)
-        if ldid != resolver.tautologyId:
-            comment = None
-            if self.definingClauseBase == 0:
-                self.definingClauseBase = ldid - self.LD
+    @property
+    def id(self):
+        return self.manager.nodeId[self.handle]
+
+    @property
+    def variable(self):
+        return self.manager.handleVariable(self.handle)
+
+    @property
+    def high(self):
+        return self.manager.getNode(self.manager.nodeHigh[self.handle])
+
+    @property
+    def low(self):
+        return self.manager.getNode(self.manager.nodeLow[self.handle])
+
+    # Identity of clauses generated from node
+    @property
+    def definingClauseBase(self):
+        return self.manager.nodeClauseBase[self.handle]
     
     def isLeaf(self):
         return False
@@ -246,16 +232,16 @@ class VariableNode(Node):
         return resolver.cleanClause([-id, vid, lid])
 
     def idHU(self):
-        return resolver.tautologyId if self.high.isZero() else self.definingClauseBase + self.HU
+        return self.manager.idHU(self.handle)
 
     def idLU(self):
-        return resolver.tautologyId if self.low.isZero() else self.definingClauseBase + self.LU
+        return self.manager.idLU(self.handle)
 
     def idHD(self):
-        return resolver.tautologyId if self.high.isOne() else self.definingClauseBase + self.HD
+        return self.manager.idHD(self.handle)
 
     def idLD(self):
-        return resolver.tautologyId if self.low.isOne() else self.definingClauseBase + self.LD
+        return self.manager.idLD(self.handle)
 
     def branchHigh(self, variable):
         if self.variable < variable:
@@ -297,6 +283,110 @@ class VariableNode(Node):
     def __str__(self):
         return "%d:%s->%s,%s" % (self.id, str(self.variable), self.high.label(), self.low.label())
 
+# Computed table for one operation.
+# Maps tuple of operand handles to pair (result, justification)
+# With a nonzero capacity, holds at most that many entries,
+# evicting the least recently used entry when full
+class ComputedTable:
+    name = ""
+    # 0 = unbounded
+    capacity = 0
+    entries = {}
+    # With reference counting GC, flags indicating which handles denote live nodes.
+    # Entries whose results have been reclaimed are dropped when encountered
+    liveFlags = None
+    # Entries dropped during lookup, whose clauses have yet to be deleted
+    staleEntries = []
+    # Statistics
+    hits = 0
+    misses = 0
+    evictions = 0
+
+    def __init__(self, name, capacity = 0):
+        self.name = name
+        self.capacity = capacity
+        self.entries = OrderedDict() if capacity > 0 else {}
+        self.liveFlags = None
+        self.staleEntries = []
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    # Return entry, or None if not found
+    def lookup(self, key):
+        entry = self.entries.get(key)
+        if entry is not None and self.liveFlags is not None:
+            # Results of implication tests are Booleans, not handles
+            value = entry[0]
+            if type(value) is int and not self.liveFlags[value]:
+                del self.entries[key]
+                self.staleEntries.append(entry)
+                entry = None
+        if entry is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            if self.capacity > 0:
+                self.entries.move_to_end(key)
+        return entry
+
+    # Add entry.  Return list of entries evicted to make room
+    def insert(self, key, entry):
+        self.entries[key] = entry
+        if self.capacity > 0 and len(self.entries) > self.capacity:
+            self.evictions += 1
+            return [self.entries.popitem(last = False)[1]]
+        return []
+
+    def remove(self, key):
+        del self.entries[key]
+
+    # Change capacity.  Return list of entries evicted
+    def setCapacity(self, capacity):
+        self.capacity = capacity
+        victims = []
+        if capacity > 0:
+            self.entries = OrderedDict(self.entries)
+            while len(self.entries) > capacity:
+                self.evictions += 1
+                victims.append(self.entries.popitem(last = False)[1])
+        else:
+            self.entries = dict(self.entries)
+        return victims
+
+    def summarize(self, writer):
+        limit = "unbounded" if self.capacity == 0 else str(self.capacity)
+        writer.write("    Cache '%s' (%s): %d entries, %d hits, %d misses, %d evictions\n" %
+                     (self.name, limit, len(self.entries), self.hits, self.misses, self.evictions))
+
+# Parse specification of cache limits.
+# Either a single number, applying to all operations,
+# or comma-separated list of entries of form OP=NUMBER.
+# Each number must be at least 1.  Operations without a limit are unbounded
+def parseCacheLimits(spec):
+    limits = {}
+    for field in spec.split(','):
+        parts = field.split('=')
+        name = "all" if len(parts) == 1 else parts[0]
+        if len(parts) > 2 or (name != "all" and name not in Manager.operationNames):
+            raise BddException("Invalid cache limit '%s'" % field)
+        try:
+            limits[name] = int(parts[-1])
+        except ValueError:
+            raise BddException("Invalid cache limit '%s'" % field)
+        if limits[name] < 1:
+            raise BddException("Invalid cache limit '%s'.  Limit must be at least 1" % field)
+    return limits
+
+# Garbage collection methods.
+# marksweep: Mark nodes reachable from the roots and sweep the unique table and the caches
+# refcount: Count references to each node from other nodes.  Reclaim the unreferenced nodes
+#   that are not roots, plus the nodes that become unreferenced as a result
+gcModes = ["marksweep", "refcount"]
+
 class Manager:
     prover = None
     writer = None
@@ -306,23 +396,65 @@ class Manager:
     # Leaf nodes
     leaf0 = None
     leaf1 = None
-    # Mapping from (variable, high, low) to node
+    # Node store.  Parallel arrays indexed by node handle.
+    # Handles 0 and 1 are reserved for leaf0 and leaf1
+    nodeLevel = None
+    nodeHigh = None
+    nodeLow = None
+    nodeId = None
+    nodeClauseBase = None
+    # Handles of nodes reclaimed by GC, available for reuse
+    freeHandles = []
+    # Level recorded for leaves in the node store.  Greater than any variable level
+    leafLevelKey = (1 << 31) - 1
+    # Mapping from (level, high handle, low handle), packed into single integer, to node handle
     uniqueTable = {}
     # Operation cache
-    # Key = (opName, operand1 ...) to (node, justification)
+    # Mapping from operation name to its computed table
+    # Table keys are tuples of operand handles, mapping to (handle, justification)
     # Hack: justification is negative when preceding clause was generated as intermediate step
+    operationNames = ["and", "orj", "imply", "andimply", "andexists", "andmany", "andmanyimply", "andnj", "or", "not", "equant"]
     operationCache = {}
+    # Proof clauses from evicted cache entries, to be deleted at next GC check
+    evictedClauses = []
     verbLevel = 1
     resolver = None
     # GC support
     # Callback function from driver that will collect accessible roots for GC
     rootGenerator = None
+    # Optional callback function from driver that returns roots it has released since the last GC,
+    # but that would have been retained without liveness analysis.
+    # Used to estimate the effect of the analysis on the number of live nodes
+    deadRootGenerator = None
+    # Number of collected nodes that would have been retained without liveness analysis
+    reclaimedEarlyCount = 0
+    # Estimated maximum number of live nodes without liveness analysis
+    maxRetainedCount = 0
     # Estimate of number of dead nodes (possibly overestimates)
     deadNodeCount = 0
     # How many dead nodes as fraction of live nodes to trigger GC
     gcFraction = 0.20
     # Minimum number of nodes before trigger GC
     gcMin = 10000
+    # Garbage collection method.  See gcModes
+    gcMode = "marksweep"
+    refCounting = False
+    # Reference counting support.  Parallel to node store.
+    # Number of live nodes having each node as a child
+    nodeRefs = None
+    # Whether each handle denotes a live node.  Shared with the computed tables
+    nodeLive = None
+    # Live nodes without parents.  Those that are not roots are garbage
+    orphanSet = set([])
+    # Handles of reclaimed nodes.  Held back from reuse until cache entries referring to them are purged
+    pendingHandles = []
+    # Number of orphans remaining after the last collection.  These are roots
+    retainedOrphanCount = 0
+    # Memoized node attributes, indexed by handle.  Entries removed when nodes are reclaimed
+    # Mapping from handle to number of nodes in its DAG
+    sizeCache = {}
+    # Mapping from handle to bit vector indicating support levels
+    supportCache = {}
     # Dictionary mapping variables to their IDs
     quantifiedVariableSet = None
     # Statistics
@@ -335,8 +467,11 @@ class Manager:
     cacheRemoved = 0
     nodesRemoved = 0
     gcCount = 0
+    gcSeconds = 0.0
+    gcMaxSeconds = 0.0
+    cachePurgeCount = 0
 
-    def __init__(self, prover = None, rootGenerator = None, nextNodeId = 0, verbLevel = 1):
+    def __init__(self, prover = None, rootGenerator = None, nextNodeId = 0, verbLevel = 1, cacheLimits = None, gcMode = "marksweep"):
 
         self.verbLevel = verbLevel
         self.prover = DummyProver() if prover is None else prover
@@ -345,9 +480,32 @@ class Manager:
         self.variables = []
         self.leaf0 = LeafNode(0)
         self.leaf1 = LeafNode(1)
+        self.nodeLevel = array('i', [self.leafLevelKey, self.leafLevelKey])
+        self.nodeHigh = array('i', [0, 1])
+        self.nodeLow = array('i', [0, 1])
+        self.nodeId = array('q', [self.leaf0.id, self.leaf1.id])
+        self.nodeClauseBase = array('q', [0, 0])
+        self.freeHandles = []
         self.nextNodeId = nextNodeId
         self.uniqueTable = {}
-        self.operationCache = {}
+        self.operationCache = { name : ComputedTable(name) for name in self.operationNames }
+        self.evictedClauses = []
+        if cacheLimits is not None:
+            self.setCacheLimits(cacheLimits)
+        if gcMode not in gcModes:
+            raise BddException("Unknown GC mode '%s'" % gcMode)
+        self.gcMode = gcMode
+        self.refCounting = gcMode == "refcount"
+        self.nodeRefs = array('i', [0, 0])
+        self.nodeLive = bytearray([1, 1])
+        self.orphanSet = set([])
+        self.pendingHandles = []
+        self.retainedOrphanCount = 0
+        self.sizeCache = {}
+        self.supportCache = {}
+        if self.refCounting:
+            for table in self.operationCache.values():
+                table.liveFlags = self.nodeLive
         self.vresolver = resolver.VResolver(self.prover)
         self.quantifiedVariableSet = set([])
         self.deadNodeCount = 0
@@ -356,10 +514,16 @@ class Manager:
         self.applyCount = 0
         self.nodeCount = 0
         self.maxLiveCount = 0
+        self.deadRootGenerator = None
+        self.reclaimedEarlyCount = 0
+        self.maxRetainedCount = 0
         self.variableCount = 0
         self.cacheRemoved = 0
         self.nodesRemoved = 0
         self.gcCount = 0
+        self.gcSeconds = 0.0
+        self.gcMaxSeconds = 0.0
+        self.cachePurgeCount = 0
 
     def newVariable(self, name, id = None):
         level = len(self.variables) + 1
@@ -367,18 +531,159 @@ class Manager:
         self.variables.append(var)
         self.variableCount += 1
         return var
-        
-    def findOrMake(self, variable, high, low):
-        key = (variable.level, high.id, low.id)
-        if key in self.uniqueTable:
-            return self.uniqueTable[key]
+
+    # Get node (view) for handle
+    def getNode(self, handle):
+        if handle == 0:
+            return self.leaf0
+        if handle == 1:
+            return self.leaf1
+        return VariableNode(self, handle)
+
+    def handleVariable(self, handle):
+        level = self.nodeLevel[handle]
+        if level == self.leafLevelKey:
+            return self.leaf0.variable
+        return self.variables[level-1]
+
+    def handleLabel(self, handle):
+        if handle < 2:
+            return "C%d" % handle
+        return "N%d" % self.nodeId[handle]
+
+    # Defining clause Ids for node with given handle
+    def idHU(self, handle):
+        return resolver.tautologyId if self.nodeHigh[handle] == 0 else self.nodeClauseBase[handle] + VariableNode.HU
+
+    def idLU(self, handle):
+        return resolver.tautologyId if self.nodeLow[handle] == 0 else self.nodeClauseBase[handle] + VariableNode.LU
+
+    def idHD(self, handle):
+        return resolver.tautologyId if self.nodeHigh[handle] == 1 else self.nodeClauseBase[handle] + VariableNode.HD
+
+    def idLD(self, handle):
+        return resolver.tautologyId if self.nodeLow[handle] == 1 else self.nodeClauseBase[handle] + VariableNode.LD
+
+    # Generate the defining clauses for newly created node.
+    # Return base for the clause Ids
+    def defineNode(self, handle):
+        prover = self.prover
+        ids = self.nodeId
+        id = ids[handle]
+        vid = self.variables[self.nodeLevel[handle]-1].id
+        hid = ids[self.nodeHigh[handle]]
+        lid = ids[self.nodeLow[handle]]
+        clauseBase = 0
+        if prover.verbLevel >= 2:
+            label = "node %s = ITE(%s,%s,%s)"  % (self.handleLabel(handle), str(self.handleVariable(handle)),
+                                                  self.handleLabel(self.nodeHigh[handle]), self.handleLabel(self.nodeLow[handle]))
+            comment = "ITE assertions for %s" % label
         else:
-            node = VariableNode(self.nextNodeId, variable, high, low, self.prover)
+            label = None
+            comment = None
+        antecedents = []
+        # id should be first literal in clause for some proof checkers
+        if prover.verbLevel >= 3:
+            comment = "ITE assertion for %s: HU" % label
+        huid = prover.createClause(resolver.cleanClause([id, -vid, -hid]), [], comment, alreadyClean = True)
+        if huid != resolver.tautologyId:
+            comment = None
+            antecedents.append(-huid)
+            if clauseBase == 0:
+                clauseBase = huid - VariableNode.HU
+
+        if prover.verbLevel >= 3:
+            comment = "ITE assertion for %s: LU" % label
+        luid = prover.createClause(resolver.cleanClause([id, vid, -lid]), [], comment, alreadyClean = True)
+        if luid != resolver.tautologyId:
+            comment = None
+            antecedents.append(-luid)
+            if clauseBase == 0:
+                clauseBase = luid - VariableNode.LU
+
+        if prover.verbLevel >= 3:
+            comment = "ITE assertion for %s: HD" % label
+        hdid = prover.createClause(resolver.cleanClause([-id, -vid, hid]), antecedents, comment, alreadyClean = True)
+        if hdid != resolver.tautologyId:
+            comment = None
+            if clauseBase == 0:
+                clauseBase = hdid - VariableNode.HD
+
+        if prover.verbLevel >= 3:
+            comment = "ITE assertion for %s: LD" % label
+        ldid = prover.createClause(resolver.cleanClause([-id, vid, lid]), antecedents, comment, alreadyClean = True)
+        if ldid != resolver.tautologyId:
+            comment = None
+            if clauseBase == 0:
+                clauseBase = ldid - VariableNode.LD
+        return clauseBase
+
+    # Allocate entry in node store and generate its defining clauses.
+    # With id given, the node and its defining clauses (starting at clauseBase) have been created elsewhere
+    def newHandle(self, level, high, low, id = None, clauseBase = None):
+        if id is None:
+            id = self.nextNodeId
             self.nextNodeId += 1
-            self.uniqueTable[key] = node
-            self.nodeCount += 1
-            self.maxLiveCount = max(self.maxLiveCount, len(self.uniqueTable))
-            return node
+        if len(self.freeHandles) > 0:
+            handle = self.freeHandles.pop()
+            self.nodeLevel[handle] = level
+            self.nodeHigh[handle] = high
+            self.nodeLow[handle] = low
+            self.nodeId[handle] = id
+        else:
+            handle = len(self.nodeLevel)
+            self.nodeLevel.append(level)
+            self.nodeHigh.append(high)
+            self.nodeLow.append(low)
+            self.nodeId.append(id)
+            self.nodeClauseBase.append(0)
+        self.nodeClauseBase[handle] = self.defineNode(handle) if clauseBase is None else clauseBase
+        return handle
+
+    # Return handle of node with given level and children, or None if there is none
+    def findHandle(self, level, high, low):
+        return self.uniqueTable.get((level << 64) | (high << 32) | low)
+
+    def findOrMakeHandle(self, level, high, low):
+        key = (level << 64) | (high << 32) | low
+        handle = self.uniqueTable.get(key)
+        if handle is None:
+            handle = self.newHandle(level, high, low)
+            self.addHandle(key, handle)
+        return handle
+
+    # Enter node whose defining clauses were generated by another prover, as for a proof fragment.
+    # There must not already be a node with the same level and children
+    def adoptHandle(self, level, high, low, id, clauseBase):
+        handle = self.newHandle(level, high, low, id, clauseBase)
+        self.addHandle((level << 64) | (high << 32) | low, handle)
+        return handle
+
+    def addHandle(self, key, handle):
+        self.uniqueTable[key] = handle
+        self.nodeCount += 1
+        self.maxLiveCount = max(self.maxLiveCount, len(self.uniqueTable))
+        if self.refCounting:
+            self.addReferences(handle)
+
+    # Record references by new node to its children
+    def addReferences(self, handle):
+        refs = self.nodeRefs
+        if handle == len(refs):
+            refs.append(0)
+            self.nodeLive.append(1)
+        else:
+            refs[handle] = 0
+            self.nodeLive[handle] = 1
+        for child in (self.nodeHigh[handle], self.nodeLow[handle]):
+            if child >= 2:
+                if refs[child] == 0:
+                    self.orphanSet.discard(child)
+                refs[child] += 1
+        self.orphanSet.add(handle)
+
+    def findOrMake(self, variable, high, low):
+        return self.getNode(self.findOrMakeHandle(variable.level, high.handle, low.handle))
   
     def literal(self, variable, phase):
         if phase == 1:
@@ -489,38 +794,78 @@ class Manager:
             sofarDict = self.buildInformation(node.high, nodeFunction, sofarDict)
             return self.buildInformation(node.low, nodeFunction, sofarDict)
         
+    # Support of function with given handle, as bit vector indexed by level.
+    # Computed from those of the children, and memoized
+    def supportBits(self, handle):
+        cache = self.supportCache
+        bits = cache.get(handle)
+        if bits is not None:
+            return bits
+        stack = [handle]
+        while len(stack) > 0:
+            h = stack[-1]
+            if h in cache:
+                stack.pop()
+                continue
+            high = self.nodeHigh[h]
+            low = self.nodeLow[h]
+            hbits = 0 if high < 2 else cache.get(high)
+            if hbits is None:
+                stack.append(high)
+                continue
+            lbits = 0 if low < 2 else cache.get(low)
+            if lbits is None:
+                stack.append(low)
+                continue
+            stack.pop()
+            cache[h] = hbits | lbits | (1 << self.nodeLevel[h])
+        return cache[handle]
+
+    # Levels of support variables, in ascending order
+    def getSupportLevels(self, node):
+        if node.isLeaf():
+            return []
+        bits = self.supportBits(node.handle)
+        ilist = []
+        while bits != 0:
+            lowBit = bits & -bits
+            ilist.append(lowBit.bit_length() - 1)
+            bits ^= lowBit
+        return ilist
+
     # Find support for function rooted by node.  Return as clause
     def getSupport(self, node):
-        varDict = self.buildInformation(node, lambda n: n.variable, {})
-        fullList = sorted(varDict.values())
-        vlist = []
-        for v in fullList:
-            if (len(vlist) == 0 or vlist[-1] != v) and v.level != Variable.leafLevel:
-                vlist.append(v)
+        vlist = [self.variables[level-1] for level in self.getSupportLevels(node)]
         lits = [self.literal(v, 1) for v in  vlist]
         return self.buildClause(lits)
 
     def getSupportIds(self, node):
-        varDict = self.buildInformation(node, lambda n: n.variable.id, {})
-        fullList = sorted(varDict.values())
-        ilist = []
-        for id in fullList:
-            if (len(ilist) == 0 or ilist[-1] != id) and id > 0:
-                ilist.append(id)
-        return ilist
-
-    def getSupportLevels(self, node):
-        varDict = self.buildInformation(node, lambda n: n.variable.level, {})
-        fullList = sorted(varDict.values())
-        ilist = []
-        for id in fullList:
-            if (len(ilist) == 0 or ilist[-1] != id) and id > 0:
-                ilist.append(id)
-        return ilist
+        return sorted([self.variables[level-1].id for level in self.getSupportLevels(node)])
 
+    # Number of nodes, including leaves, in DAG rooted by node.  Memoized
     def getSize(self, node):
-        oneDict = self.buildInformation(node, lambda n: 1, {})
-        return len(oneDict)
+        if node.isLeaf():
+            return 1
+        size = self.sizeCache.get(node.handle)
+        if size is None:
+            markedSet = set([node.handle])
+            frontier = [node.handle]
+            while len(frontier) > 0:
+                handle = frontier.pop()
+                if handle < 2:
+                    continue
+                for child in (self.nodeHigh[handle], self.nodeLow[handle]):
+                    if child not in markedSet:
+                        markedSet.add(child)
+                        frontier.append(child)
+            size = len(markedSet)
+            self.sizeCache[node.handle] = size
+        return size
+
+    # Remove memoized information for reclaimed node
+    def forgetHandle(self, handle):
+        self.sizeCache.pop(handle, None)
+        self.supportCache.pop(handle, None)
 
     def showLiteral(self, lit):
         positive = lit.high == self.leaf1
@@ -596,214 +941,361 @@ class Manager:
                 break
         return stringList
 
+    # Set limits on cache sizes.
+    # Mapping from operation name (or "all") to maximum number of entries (0 = unbounded)
+    def setCacheLimits(self, limits):
+        for name in self.operationNames:
+            if name in limits or "all" in limits:
+                capacity = limits[name] if name in limits else limits["all"]
+                for entry in self.operationCache[name].setCapacity(capacity):
+                    self.evictedClauses += self.entryClauses(entry)
+
+    # Proof clauses held by cache entry
+    def entryClauses(self, entry):
+        cid = entry[1]
+        if abs(cid) == resolver.tautologyId:
+            return []
+        return [cid] if cid > 0 else [-cid-1, -cid]
+
+    # Add entry to cache.  Clauses justifying evicted entries
+    # are held until the next GC check, since they may still be in use as hints
+    def operationStore(self, table, key, entry):
+        for victim in table.insert(key, entry):
+            self.evictedClauses += self.entryClauses(victim)
+
     # Retrieve item from cache.  Return None if not found
-    def operationRetrieve(self, key):
-        if key in self.operationCache:
-            entry = self.operationCache[key]
+    def operationRetrieve(self, name, key):
+        entry = self.operationCache[name].lookup(key)
+        if entry is not None:
             return (entry[0], abs(entry[1]))
         return None
      
 
+    # The apply operations below are implemented iteratively, with an explicit stack of frames
+    # in place of recursion.  Each frame records the operands of a pending call
+    # plus the result of its high branch, once that has been computed.
+    # Calls are processed in the same order as with a recursive implementation,
+    # and so nodes, cache entries, and proof clauses are generated in the same sequence.
+
     # Return node + id of clause justifying that nodeA & NodeB ==> result
     # Justification is None if it would be tautology
     def applyAndJustify(self, nodeA, nodeB):
-        self.applyCount += 1
-        # Constant cases.
-        # No justifications required, since all return one of the arguments
-        if nodeA == self.leaf0 or nodeB == self.leaf0:
-            return (self.leaf0, resolver.tautologyId)
-        if nodeA == self.leaf1:
-            return (nodeB, resolver.tautologyId)
-        if nodeB == self.leaf1:
-            return (nodeA, resolver.tautologyId)
-        if nodeA == nodeB:
-            return (nodeA, resolver.tautologyId)
-
-        if nodeA.id > nodeB.id:
-            nodeA, nodeB = nodeB, nodeA
-        key = ("and", nodeA.id, nodeB.id)
-        lookup = self.operationRetrieve(key)
-        if lookup is not None:
-            return lookup
-
-        # Mapping from rule names to pair (clause id, clause)
-        hints = {}
-        # Mapping from variable names to variable numbers
-        splitVar = min(nodeA.variable, nodeB.variable)
-        highA = nodeA.branchHigh(splitVar)
-        lowA =  nodeA.branchLow(splitVar)
-        highB = nodeB.branchHigh(splitVar) 
-        lowB =  nodeB.branchLow(splitVar)
-
-        if highA != lowA:
-            hints["UHD"] = (nodeA.idHD(), resolver.cleanClause([-splitVar.id, -nodeA.id, highA.id]))
-            hints["ULD"] = (nodeA.idLD(), resolver.cleanClause([ splitVar.id, -nodeA.id, lowA.id]))
-        if highB != lowB:
-            hints["VHD"] = (nodeB.idHD(), resolver.cleanClause([-splitVar.id, -nodeB.id, highB.id]))
-            hints["VLD"] = (nodeB.idLD(), resolver.cleanClause([ splitVar.id, -nodeB.id, lowB.id]))
-
-        (newHigh, andHigh) = self.applyAndJustify(highA, highB)
-        hints["OPH"] = (andHigh, resolver.cleanClause([-highA.id, -highB.id, newHigh.id]))
-            
-        (newLow, andLow) = self.applyAndJustify(lowA, lowB)
-        hints["OPL"] = (andLow, resolver.cleanClause([-lowA.id, -lowB.id, newLow.id]))
-
-        if newHigh == newLow:
-            newNode = newHigh
-        else:
-            newNode = self.findOrMake(splitVar, newHigh, newLow)
-            hints["WHU"] = (newNode.idHU(), resolver.cleanClause([-splitVar.id, newNode.id, -newHigh.id]))
-            hints["WLU"] = (newNode.idLU(), resolver.cleanClause([ splitVar.id, newNode.id, -newLow.id]))
+        handle, justification = self.applyAndJustifyHandle(nodeA.handle, nodeB.handle)
+        return (self.getNode(handle), justification)
+
+    def applyAndJustifyHandle(self, nodeA, nodeB):
+        taut = resolver.tautologyId
+        cleanClause = resolver.cleanClause
+        comments = self.prover.verbLevel >= 2
+        ids = self.nodeId
+        levels = self.nodeLevel
+        highs = self.nodeHigh
+        lows = self.nodeLow
+        cache = self.operationCache["and"]
+        # Frame: [key, A, B, splitLevel, highA, lowA, highB, lowB, high result]
+        stack = []
+        result = None
+        a = nodeA
+        b = nodeB
+        call = True
+        while True:
+            if call:
+                self.applyCount += 1
+                # Constant cases.
+                # No justifications required, since all return one of the arguments
+                if a == 0 or b == 0:
+                    result = (0, taut)
+                elif a == 1:
+                    result = (b, taut)
+                elif b == 1 or a == b:
+                    result = (a, taut)
+                else:
+                    if ids[a] > ids[b]:
+                        a, b = b, a
+                    key = (a, b)
+                    entry = cache.lookup(key)
+                    if entry is not None:
+                        result = (entry[0], abs(entry[1]))
+                    else:
+                        splitLevel = min(levels[a], levels[b])
+                        highA, lowA = (highs[a], lows[a]) if levels[a] == splitLevel else (a, a)
+                        highB, lowB = (highs[b], lows[b]) if levels[b] == splitLevel else (b, b)
+                        stack.append([key, a, b, splitLevel, highA, lowA, highB, lowB, None])
+                        a = highA
+                        b = highB
+                        continue
+            if len(stack) == 0:
+                return result
+            frame = stack[-1]
+            if frame[8] is None:
+                # High branch complete.  Start on low branch
+                frame[8] = result
+                a = frame[5]
+                b = frame[7]
+                call = True
+                continue
+            stack.pop()
+            call = False
+            key, nA, nB, splitLevel, highA, lowA, highB, lowB, highResult = frame
+            (newHigh, andHigh) = highResult
+            (newLow, andLow) = result
+            splitId = self.variables[splitLevel-1].id
+            # Mapping from rule names to pair (clause id, clause)
+            hints = {}
+            if highA != lowA:
+                hints["UHD"] = (self.idHD(nA), cleanClause([-splitId, -ids[nA], ids[highA]]))
+                hints["ULD"] = (self.idLD(nA), cleanClause([ splitId, -ids[nA], ids[lowA]]))
+            if highB != lowB:
+                hints["VHD"] = (self.idHD(nB), cleanClause([-splitId, -ids[nB], ids[highB]]))
+                hints["VLD"] = (self.idLD(nB), cleanClause([ splitId, -ids[nB], ids[lowB]]))
+            hints["OPH"] = (andHigh, cleanClause([-ids[highA], -ids[highB], ids[newHigh]]))
+            hints["OPL"] = (andLow, cleanClause([-ids[lowA], -ids[lowB], ids[newLow]]))
+
+            if newHigh == newLow:
+                newNode = newHigh
+            else:
+                newNode = self.findOrMakeHandle(splitLevel, newHigh, newLow)
+                hints["WHU"] = (self.idHU(newNode), cleanClause([-splitId, ids[newNode], -ids[newHigh]]))
+                hints["WLU"] = (self.idLU(newNode), cleanClause([ splitId, ids[newNode], -ids[newLow]]))
 
-        targetClause = resolver.cleanClause([-nodeA.id, -nodeB.id, newNode.id])
-        if targetClause == resolver.tautologyId:
-            justification = resolver.tautologyId
-        else:
-            comment = "Justification that %s & %s ==> %s" % (nodeA.label(), nodeB.label(), newNode.label())
-            justification = self.vresolver.run(targetClause, splitVar.id, hints, comment)
-        self.operationCache[key] = (newNode, justification)
-        self.cacheJustifyAdded += 1
-        return (newNode, abs(justification))
+            targetClause = cleanClause([-ids[nA], -ids[nB], ids[newNode]])
+            if targetClause == taut:
+                justification = taut
+            else:
+                comment = "Justification that %s & %s ==> %s" % (self.handleLabel(nA), self.handleLabel(nB), self.handleLabel(newNode)) if comments else None
+                justification = self.vresolver.run(targetClause, splitId, hints, comment)
+            self.operationStore(cache, key, (newNode, justification))
+            self.cacheJustifyAdded += 1
+            result = (newNode, abs(justification))
 
     # Return node + id of clause justifying that result ==> nodeA | NodeB
     def applyOrJustify(self, nodeA, nodeB):
-        self.applyCount += 1
-        # Constant cases.
-        # No justifications required, since all return one of the arguments
-        if nodeA == self.leaf1 or nodeB == self.leaf1:
-            return (self.leaf1, resolver.tautologyId)
-        if nodeA == self.leaf0:
-            return (nodeB, resolver.tautologyId)
-        if nodeB == self.leaf0:
-            return (nodeA, resolver.tautologyId)
-        if nodeA == nodeB:
-            return (nodeA, resolver.tautologyId)
-
-        if nodeA.id > nodeB.id:
-            nodeA, nodeB = nodeB, nodeA
-        key = ("orj", nodeA.id, nodeB.id)
-        lookup = self.operationRetrieve(key)
-        if lookup is not None:
-            return lookup
-
-        # Mapping from rule names to clause numbers
-        hints = {}
-        # Mapping from variable names to variable numbers
-        splitVar = min(nodeA.variable, nodeB.variable)
-        highA = nodeA.branchHigh(splitVar)
-        lowA =  nodeA.branchLow(splitVar)
-        highB = nodeB.branchHigh(splitVar) 
-        lowB =  nodeB.branchLow(splitVar)
-
-        if highA != lowA:
-            hints["UHU"] = (nodeA.idHU(), resolver.cleanClause([-splitVar.id, nodeA.id, -highA.id]))
-            hints["ULU"] = (nodeA.idLU(), resolver.cleanClause([ splitVar.id, nodeA.id, -lowA.id]))
-        if highB != lowB:
-            hints["VHU"] = (nodeB.idHU(), resolver.cleanClause([-splitVar.id, nodeB.id, -highB.id]))
-            hints["VLU"] = (nodeB.idLU(), resolver.cleanClause([ splitVar.id, nodeB.id, -lowB.id]))
-
-        (newHigh, orHigh) = self.applyOrJustify(highA, highB)
-        hints["OPH"] = (orHigh, resolver.cleanClause([highA.id, highB.id, -newHigh.id]))
-            
-        (newLow, orLow) = self.applyOrJustify(lowA, lowB)
-        hints["OPL"] = (orLow, resolver.cleanClause([lowA.id, lowB.id, -newLow.id]))
-
-        if newHigh == newLow:
-            newNode = newHigh
-        else:
-            newNode = self.findOrMake(splitVar, newHigh, newLow)
-            hints["WHD"] = (newNode.idHD(), resolver.cleanClause([-splitVar.id, -newNode.id, newHigh.id]))
-            hints["WLD"] = (newNode.idLD(), resolver.cleanClause([ splitVar.id, -newNode.id, newLow.id]))
+        handle, justification = self.applyOrJustifyHandle(nodeA.handle, nodeB.handle)
+        return (self.getNode(handle), justification)
+
+    def applyOrJustifyHandle(self, nodeA, nodeB):
+        taut = resolver.tautologyId
+        cleanClause = resolver.cleanClause
+        comments = self.prover.verbLevel >= 2
+        ids = self.nodeId
+        levels = self.nodeLevel
+        highs = self.nodeHigh
+        lows = self.nodeLow
+        cache = self.operationCache["orj"]
+        # Frame: [key, A, B, splitLevel, highA, lowA, highB, lowB, high result]
+        stack = []
+        result = None
+        a = nodeA
+        b = nodeB
+        call = True
+        while True:
+            if call:
+                self.applyCount += 1
+                # Constant cases.
+                # No justifications required, since all return one of the arguments
+                if a == 1 or b == 1:
+                    result = (1, taut)
+                elif a == 0:
+                    result = (b, taut)
+                elif b == 0 or a == b:
+                    result = (a, taut)
+                else:
+                    if ids[a] > ids[b]:
+                        a, b = b, a
+                    key = (a, b)
+                    entry = cache.lookup(key)
+                    if entry is not None:
+                        result = (entry[0], abs(entry[1]))
+                    else:
+                        splitLevel = min(levels[a], levels[b])
+                        highA, lowA = (highs[a], lows[a]) if levels[a] == splitLevel else (a, a)
+                        highB, lowB = (highs[b], lows[b]) if levels[b] == splitLevel else (b, b)
+                        stack.append([key, a, b, splitLevel, highA, lowA, highB, lowB, None])
+                        a = highA
+                        b = highB
+                        continue
+            if len(stack) == 0:
+                return result
+            frame = stack[-1]
+            if frame[8] is None:
+                # High branch complete.  Start on low branch
+                frame[8] = result
+                a = frame[5]
+                b = frame[7]
+                call = True
+                continue
+            stack.pop()
+            call = False
+            key, nA, nB, splitLevel, highA, lowA, highB, lowB, highResult = frame
+            (newHigh, orHigh) = highResult
+            (newLow, orLow) = result
+            splitId = self.variables[splitLevel-1].id
+            # Mapping from rule names to clause numbers
+            hints = {}
+            if highA != lowA:
+                hints["UHU"] = (self.idHU(nA), cleanClause([-splitId, ids[nA], -ids[highA]]))
+                hints["ULU"] = (self.idLU(nA), cleanClause([ splitId, ids[nA], -ids[lowA]]))
+            if highB != lowB:
+                hints["VHU"] = (self.idHU(nB), cleanClause([-splitId, ids[nB], -ids[highB]]))
+                hints["VLU"] = (self.idLU(nB), cleanClause([ splitId, ids[nB], -ids[lowB]]))
+            hints["OPH"] = (orHigh, cleanClause([ids[highA], ids[highB], -ids[newHigh]]))
+            hints["OPL"] = (orLow, cleanClause([ids[lowA], ids[lowB], -ids[newLow]]))
+
+            if newHigh == newLow:
+                newNode = newHigh
+            else:
+                newNode = self.findOrMakeHandle(splitLevel, newHigh, newLow)
+                hints["WHD"] = (self.idHD(newNode), cleanClause([-splitId, -ids[newNode], ids[newHigh]]))
+                hints["WLD"] = (self.idLD(newNode), cleanClause([ splitId, -ids[newNode], ids[newLow]]))
 
-        targetClause = resolver.cleanClause([-newNode.id, nodeA.id, nodeB.id])
-        if targetClause == resolver.tautologyId:
-            justification = resolver.tautologyId
-        else:
-            comment = "Justification that %s ==> %s | %s" % (newNode.label(), nodeA.label(), nodeB.label())
-            justification = self.vresolver.run(targetClause, splitVar.id, hints, comment)
-        self.operationCache[key] = (newNode, justification)
-        self.cacheJustifyAdded += 1
-        return (newNode, justification)
+            targetClause = cleanClause([-ids[newNode], ids[nA], ids[nB]])
+            if targetClause == taut:
+                justification = taut
+            else:
+                comment = "Justification that %s ==> %s | %s" % (self.handleLabel(newNode), self.handleLabel(nA), self.handleLabel(nB)) if comments else None
+                justification = self.vresolver.run(targetClause, splitId, hints, comment)
+            self.operationStore(cache, key, (newNode, justification))
+            self.cacheJustifyAdded += 1
+            result = (newNode, abs(justification))
 
     def applyNot(self, node):
-        # Constant case
-        if node == self.leaf1:
-            return self.leaf0
-        if node == self.leaf0:
-            return self.leaf1
-        key = ("not", node.id)
-        if key in self.operationCache:
-            return self.operationCache[key][0]
-        var = node.variable
-        high = node.high
-        low = node.low
-        newHigh = self.applyNot(high)
-        newLow = self.applyNot(low)
-        newNode = self.findOrMake(var, newHigh, newLow)
-        self.operationCache[key] = (newNode, resolver.tautologyId)
-        return (newNode, resolver.TautologyId)
+        return self.getNode(self.applyNotHandle(node.handle))
+
+    def applyNotHandle(self, node):
+        levels = self.nodeLevel
+        highs = self.nodeHigh
+        lows = self.nodeLow
+        cache = self.operationCache["not"]
+        # Frame: [key, node, high result]
+        stack = []
+        result = None
+        n = node
+        call = True
+        while True:
+            if call:
+                # Constant cases
+                if n == 1:
+                    result = 0
+                elif n == 0:
+                    result = 1
+                else:
+                    key = (n,)
+                    entry = cache.lookup(key)
+                    if entry is not None:
+                        result = entry[0]
+                    else:
+                        stack.append([key, n, None])
+                        n = highs[n]
+                        continue
+            if len(stack) == 0:
+                return result
+            frame = stack[-1]
+            if frame[2] is None:
+                # High branch complete.  Start on low branch
+                frame[2] = result
+                n = lows[frame[1]]
+                call = True
+                continue
+            stack.pop()
+            call = False
+            key, fn, newHigh = frame
+            newLow = result
+            newNode = self.findOrMakeHandle(levels[fn], newHigh, newLow)
+            self.operationStore(cache, key, (newNode, resolver.tautologyId))
+            result = newNode
 
     def justifyImply(self, nodeA, nodeB):
-        self.applyCount += 1
-
-        # Special cases
-        if nodeA == nodeB:
-            return (True, resolver.tautologyId)
-        if nodeA == self.leaf0:
-            return (True, resolver.tautologyId)
-        if nodeB == self.leaf1:
-            return (True, resolver.tautologyId)
-        # It would be an error if implication fails
-        if nodeA == self.leaf1:
-            return (False, resolver.tautologyId)
-        if nodeB == self.leaf0:
-            return (False, resolver.tautologyId)
-
-        key = ("imply", nodeA.id, nodeB.id)
-        lookup = self.operationRetrieve(key)
-        if lookup is not None:
-            return lookup
-
-        # Mapping from rule names to pair (clause id, clause)
-        hints = {}
-        splitVar = min(nodeA.variable, nodeB.variable)  
-        highA = nodeA.branchHigh(splitVar)
-        lowA =  nodeA.branchLow(splitVar)
-        highB = nodeB.branchHigh(splitVar) 
-        lowB =  nodeB.branchLow(splitVar)
-
-        if highA != lowA:
-            hints["UHD"] = (nodeA.idHD(), resolver.cleanClause([-splitVar.id, -nodeA.id, highA.id]))
-            hints["ULD"] = (nodeA.idLD(), resolver.cleanClause([ splitVar.id, -nodeA.id, lowA.id]))
-        if highB != lowB:
-            hints["WHU"] = (nodeB.idHU(), resolver.cleanClause([-splitVar.id, nodeB.id, -highB.id]))
-            hints["WLU"] = (nodeB.idLU(), resolver.cleanClause([ splitVar.id, nodeB.id, -lowB.id]))
-
-        (check, implyHigh) = self.justifyImply(highA, highB)
-        if implyHigh != resolver.tautologyId:
-            hints["OPH"] = (implyHigh, resolver.cleanClause([-highA.id, highB.id]))
-
-        if check:
-            (check, implyLow) = self.justifyImply(lowA, lowB)
-            if implyLow != resolver.tautologyId:
-                hints["OPL"] = (implyLow, resolver.cleanClause([-lowA.id, lowB.id]))
-
-        if check:
-            targetClause = resolver.cleanClause([-nodeA.id, nodeB.id])
-            comment = "Justification that %s ==> %s" % (nodeA.label(), nodeB.label())
-            justification = self.vresolver.run(targetClause, splitVar.id, hints, comment)
-        else:
-            justification = resolver.tautologyId
+        return self.justifyImplyHandle(nodeA.handle, nodeB.handle)
+
+    def justifyImplyHandle(self, nodeA, nodeB):
+        taut = resolver.tautologyId
+        cleanClause = resolver.cleanClause
+        comments = self.prover.verbLevel >= 2
+        ids = self.nodeId
+        levels = self.nodeLevel
+        highs = self.nodeHigh
+        lows = self.nodeLow
+        cache = self.operationCache["imply"]
+        # Frame: [key, A, B, splitLevel, highA, lowA, highB, lowB, high result]
+        stack = []
+        result = None
+        a = nodeA
+        b = nodeB
+        call = True
+        while True:
+            if call:
+                self.applyCount += 1
+                # Special cases
+                if a == b or a == 0 or b == 1:
+                    result = (True, taut)
+                # It would be an error if implication fails
+                elif a == 1 or b == 0:
+                    result = (False, taut)
+                else:
+                    key = (a, b)
+                    entry = cache.lookup(key)
+                    if entry is not None:
+                        result = (entry[0], abs(entry[1]))
+                    else:
+                        splitLevel = min(levels[a], levels[b])
+                        highA, lowA = (highs[a], lows[a]) if levels[a] == splitLevel else (a, a)
+                        highB, lowB = (highs[b], lows[b]) if levels[b] == splitLevel else (b, b)
+                        stack.append([key, a, b, splitLevel, highA, lowA, highB, lowB, None])
+                        a = highA
+                        b = highB
+                        continue
+            if len(stack) == 0:
+                return result
+            frame = stack[-1]
+            if frame[8] is None and result[0]:
+                # High branch holds.  Start on low branch
+                frame[8] = result
+                a = frame[5]
+                b = frame[7]
+                call = True
+                continue
+            stack.pop()
+            call = False
+            key, nA, nB, splitLevel, highA, lowA, highB, lowB, highResult = frame
+            if highResult is None:
+                # Implication failed for high branch
+                highResult = result
+                lowResult = None
+            else:
+                lowResult = result
+            (check, implyHigh) = highResult
+            splitId = self.variables[splitLevel-1].id
+            # Mapping from rule names to pair (clause id, clause)
+            hints = {}
+            if highA != lowA:
+                hints["UHD"] = (self.idHD(nA), cleanClause([-splitId, -ids[nA], ids[highA]]))
+                hints["ULD"] = (self.idLD(nA), cleanClause([ splitId, -ids[nA], ids[lowA]]))
+            if highB != lowB:
+                hints["WHU"] = (self.idHU(nB), cleanClause([-splitId, ids[nB], -ids[highB]]))
+                hints["WLU"] = (self.idLU(nB), cleanClause([ splitId, ids[nB], -ids[lowB]]))
+            if implyHigh != taut:
+                hints["OPH"] = (implyHigh, cleanClause([-ids[highA], ids[highB]]))
+            if lowResult is not None:
+                (check, implyLow) = lowResult
+                if implyLow != taut:
+                    hints["OPL"] = (implyLow, cleanClause([-ids[lowA], ids[lowB]]))
+
+            if check:
+                targetClause = cleanClause([-ids[nA], ids[nB]])
+                comment = "Justification that %s ==> %s" % (self.handleLabel(nA), self.handleLabel(nB)) if comments else None
+                justification = self.vresolver.run(targetClause, splitId, hints, comment)
+            else:
+                justification = taut
 
-        self.operationCache[key] = (check, justification)
-        if justification != resolver.tautologyId:
-            self.cacheJustifyAdded += 1
-        else:
-            self.cacheNoJustifyAdded += 1
-        return (check, abs(justification))
+            self.operationStore(cache, key, (check, justification))
+            if justification != taut:
+                self.cacheJustifyAdded += 1
+            else:
+                self.cacheNoJustifyAdded += 1
+            result = (check, abs(justification))
 
     def checkImply(self, nodeA, nodeB):
-        check, justification = justifyImply(nodeA, nodeB)
+        check, justification = self.justifyImply(nodeA, nodeB)
         return check
 
 
@@ -811,146 +1303,487 @@ class Manager:
     # that result implies nodeC.
     # Return check + proof step
     def applyAndJustifyImply(self, nodeA, nodeB, nodeC):
-        self.applyCount += 1
-        # Terminal cases.
-        if nodeA == self.leaf0 or nodeB == self.leaf0:
-            # 0 implies everything
-            return (True, resolver.tautologyId)
-        if nodeA == self.leaf1:
-            return self.justifyImply(nodeB, nodeC)
-        if nodeB == self.leaf1:
-            return self.justifyImply(nodeA, nodeC)
-        if nodeA == nodeB:
-            return self.justifyImply(nodeA, nodeC)
-        if nodeC == self.leaf1:
-            return (True, resolver.tautologyId)
-
-        if nodeA.id > nodeB.id:
-            # Commute arguments
-            nodeA, nodeB = nodeB, nodeA
-        key = ("andimply", nodeA.id, nodeB.id, nodeC.id)
-        lookup = self.operationRetrieve(key)
-        if lookup is not None:
-            return lookup
-
-        # Mapping from rule names to pair (clause id, clause)
-        hints = {}
-        # Mapping from variable names to variable numbers
-        splitVar = min(nodeA.variable, nodeB.variable)
-        if nodeC != self.leaf0:
-            splitVar = min(splitVar, nodeC.variable)
-        highA = nodeA.branchHigh(splitVar)
-        lowA =  nodeA.branchLow(splitVar)
-        highB = nodeB.branchHigh(splitVar) 
-        lowB =  nodeB.branchLow(splitVar)
-        highC = nodeC if nodeC == self.leaf0 else nodeC.branchHigh(splitVar)
-        lowC =  nodeC if nodeC == self.leaf0 else nodeC.branchLow(splitVar)
-
-        if highA != lowA:
-            hints["UHD"] = (nodeA.idHD(), resolver.cleanClause([-splitVar.id, -nodeA.id, highA.id]))
-            hints["ULD"] = (nodeA.idLD(), resolver.cleanClause([ splitVar.id, -nodeA.id, lowA.id]))
-        if highB != lowB:
-            hints["VHD"] = (nodeB.idHD(), resolver.cleanClause([-splitVar.id, -nodeB.id, highB.id]))
-            hints["VLD"] = (nodeB.idLD(), resolver.cleanClause([ splitVar.id, -nodeB.id, lowB.id]))
-        if highC != lowC:
-            hints["WHU"] = (nodeC.idHU(), resolver.cleanClause([-splitVar.id, nodeC.id, -highC.id]))
-            hints["WLU"] = (nodeC.idLU(), resolver.cleanClause([ splitVar.id, nodeC.id, -lowC.id]))
-
-        (check, implyHigh) = self.applyAndJustifyImply(highA, highB, highC)
-        if implyHigh != resolver.tautologyId:
-            hints["OPH"] = (implyHigh, resolver.cleanClause([-highA.id, -highB.id, highC.id]))
-
-        if check:
-            (check, implyLow) = self.applyAndJustifyImply(lowA, lowB, lowC)
-            if implyLow != resolver.tautologyId:
-                hints["OPL"] = (implyLow, resolver.cleanClause([-lowA.id, -lowB.id, lowC.id]))
-
-        if check:
-            targetClause = resolver.cleanClause([-nodeA.id, -nodeB.id, nodeC.id])
-            if targetClause == resolver.tautologyId:
-                justification = resolver.tautologyId
+        return self.applyAndJustifyImplyHandle(nodeA.handle, nodeB.handle, nodeC.handle)
+
+    def applyAndJustifyImplyHandle(self, nodeA, nodeB, nodeC):
+        taut = resolver.tautologyId
+        cleanClause = resolver.cleanClause
+        comments = self.prover.verbLevel >= 2
+        ids = self.nodeId
+        levels = self.nodeLevel
+        highs = self.nodeHigh
+        lows = self.nodeLow
+        cache = self.operationCache["andimply"]
+        # Frame: [key, A, B, C, splitLevel, highA, lowA, highB, lowB, highC, lowC, high result]
+        stack = []
+        result = None
+        a = nodeA
+        b = nodeB
+        c = nodeC
+        call = True
+        while True:
+            if call:
+                self.applyCount += 1
+                # Terminal cases.
+                if a == 0 or b == 0:
+                    # 0 implies everything
+                    result = (True, taut)
+                elif a == 1:
+                    result = self.justifyImplyHandle(b, c)
+                elif b == 1 or a == b:
+                    result = self.justifyImplyHandle(a, c)
+                elif c == 1:
+                    result = (True, taut)
+                else:
+                    if ids[a] > ids[b]:
+                        # Commute arguments
+                        a, b = b, a
+                    key = (a, b, c)
+                    entry = cache.lookup(key)
+                    if entry is not None:
+                        result = (entry[0], abs(entry[1]))
+                    else:
+                        splitLevel = min(levels[a], levels[b], levels[c])
+                        highA, lowA = (highs[a], lows[a]) if levels[a] == splitLevel else (a, a)
+                        highB, lowB = (highs[b], lows[b]) if levels[b] == splitLevel else (b, b)
+                        highC, lowC = (highs[c], lows[c]) if levels[c] == splitLevel else (c, c)
+                        stack.append([key, a, b, c, splitLevel, highA, lowA, highB, lowB, highC, lowC, None])
+                        a = highA
+                        b = highB
+                        c = highC
+                        continue
+            if len(stack) == 0:
+                return result
+            frame = stack[-1]
+            if frame[11] is None and result[0]:
+                # High branch holds.  Start on low branch
+                frame[11] = result
+                a = frame[6]
+                b = frame[8]
+                c = frame[10]
+                call = True
+                continue
+            stack.pop()
+            call = False
+            key, nA, nB, nC, splitLevel, highA, lowA, highB, lowB, highC, lowC, highResult = frame
+            if highResult is None:
+                # Implication failed for high branch
+                highResult = result
+                lowResult = None
             else:
-                comment = "Justification that %s & %s ==> %s" % (nodeA.label(), nodeB.label(), nodeC.label())
-                justification = self.vresolver.run(targetClause, splitVar.id, hints, comment)
-        else:
-            justification = resolver.tautologyId
+                lowResult = result
+            (check, implyHigh) = highResult
+            splitId = self.variables[splitLevel-1].id
+            # Mapping from rule names to pair (clause id, clause)
+            hints = {}
+            if highA != lowA:
+                hints["UHD"] = (self.idHD(nA), cleanClause([-splitId, -ids[nA], ids[highA]]))
+                hints["ULD"] = (self.idLD(nA), cleanClause([ splitId, -ids[nA], ids[lowA]]))
+            if highB != lowB:
+                hints["VHD"] = (self.idHD(nB), cleanClause([-splitId, -ids[nB], ids[highB]]))
+                hints["VLD"] = (self.idLD(nB), cleanClause([ splitId, -ids[nB], ids[lowB]]))
+            if highC != lowC:
+                hints["WHU"] = (self.idHU(nC), cleanClause([-splitId, ids[nC], -ids[highC]]))
+                hints["WLU"] = (self.idLU(nC), cleanClause([ splitId, ids[nC], -ids[lowC]]))
+            if implyHigh != taut:
+                hints["OPH"] = (implyHigh, cleanClause([-ids[highA], -ids[highB], ids[highC]]))
+            if lowResult is not None:
+                (check, implyLow) = lowResult
+                if implyLow != taut:
+                    hints["OPL"] = (implyLow, cleanClause([-ids[lowA], -ids[lowB], ids[lowC]]))
+
+            if check:
+                targetClause = cleanClause([-ids[nA], -ids[nB], ids[nC]])
+                if targetClause == taut:
+                    justification = taut
+                else:
+                    comment = "Justification that %s & %s ==> %s" % (self.handleLabel(nA), self.handleLabel(nB), self.handleLabel(nC)) if comments else None
+                    justification = self.vresolver.run(targetClause, splitId, hints, comment)
+            else:
+                justification = taut
 
-        self.operationCache[key] = (check, justification)
-        if justification != resolver.tautologyId:
-            self.cacheJustifyAdded += 1
-        else:
-            self.cacheNoJustifyAdded += 1
-        return (check, abs(justification))
+            self.operationStore(cache, key, (check, justification))
+            if justification != taut:
+                self.cacheJustifyAdded += 1
+            else:
+                self.cacheNoJustifyAdded += 1
+            result = (check, abs(justification))
+
+
+    # Compute conjunction of list of nodes in single multi-way apply.
+    # Without target, return node + id of clause justifying that the conjunction of the nodes ==> result.
+    # With target, check that conjunction implies target and return check + proof step
+    def applyAndManyJustify(self, rootList, target = None):
+        handles = [root.handle for root in rootList]
+        if target is None:
+            handle, justification = self.applyAndManyJustifyHandle(handles)
+            return (self.getNode(handle), justification)
+        return self.applyAndManyJustifyHandle(handles, target.handle)
+
+    def applyAndManyJustifyHandle(self, nodes, target = None):
+        taut = resolver.tautologyId
+        cleanClause = resolver.cleanClause
+        comments = self.prover.verbLevel >= 2
+        ids = self.nodeId
+        levels = self.nodeLevel
+        highs = self.nodeHigh
+        lows = self.nodeLow
+        imply = target is not None
+        cache = self.operationCache["andmanyimply" if imply else "andmany"]
+        # Frame: [key, operands, target, splitLevel, high operands, low operands, highT, lowT, high result]
+        stack = []
+        result = None
+        ops = nodes
+        t = target
+        call = True
+        while True:
+            if call:
+                self.applyCount += 1
+                # Canonical form of operands: no duplicates or constant 1, ordered by node Id
+                zero = 0 in ops
+                ops = sorted(set([u for u in ops if u != 1]), key = lambda u : ids[u])
+                # Terminal cases.  Use binary operations when possible
+                if imply:
+                    if zero or t == 1 or t in ops:
+                        result = (True, taut)
+                    elif len(ops) == 0:
+                        result = self.justifyImplyHandle(1, t)
+                    elif len(ops) == 1:
+                        result = self.justifyImplyHandle(ops[0], t)
+                    elif len(ops) == 2:
+                        result = self.applyAndJustifyImplyHandle(ops[0], ops[1], t)
+                else:
+                    if zero:
+                        result = (0, taut)
+                    elif len(ops) == 0:
+                        result = (1, taut)
+                    elif len(ops) == 1:
+                        result = (ops[0], taut)
+                    elif len(ops) == 2:
+                        result = self.applyAndJustifyHandle(ops[0], ops[1])
+                if result is None:
+                    key = tuple(ops + [t]) if imply else tuple(ops)
+                    entry = cache.lookup(key)
+                    if entry is not None:
+                        result = (entry[0], abs(entry[1]))
+                    else:
+                        splitLevel = min([levels[u] for u in ops] + ([levels[t]] if imply else []))
+                        highOps = [highs[u] if levels[u] == splitLevel else u for u in ops]
+                        lowOps = [lows[u] if levels[u] == splitLevel else u for u in ops]
+                        highT, lowT = (highs[t], lows[t]) if imply and levels[t] == splitLevel else (t, t)
+                        stack.append([key, ops, t, splitLevel, highOps, lowOps, highT, lowT, None])
+                        ops = highOps
+                        t = highT
+                        continue
+            if len(stack) == 0:
+                return result
+            frame = stack[-1]
+            if frame[8] is None and (not imply or result[0]):
+                # High branch complete.  Start on low branch
+                frame[8] = result
+                ops = frame[5]
+                t = frame[7]
+                result = None
+                call = True
+                continue
+            stack.pop()
+            call = False
+            key, nops, nt, splitLevel, highOps, lowOps, highT, lowT, highResult = frame
+            if highResult is None:
+                # Implication failed for high branch
+                highResult = result
+                lowResult = None
+            else:
+                lowResult = result
+            splitId = self.variables[splitLevel-1].id
+            # Hints for each branch, in order of propagation
+            highHints = [(self.idHD(u), cleanClause([-splitId, -ids[u], ids[highs[u]]])) for u in nops if levels[u] == splitLevel]
+            lowHints = [(self.idLD(u), cleanClause([ splitId, -ids[u], ids[lows[u]]])) for u in nops if levels[u] == splitLevel]
+            if imply:
+                (check, implyHigh) = highResult
+                highHints.append((implyHigh, cleanClause([-ids[u] for u in highOps] + [ids[highT]])))
+                if lowResult is not None:
+                    (check, implyLow) = lowResult
+                    lowHints.append((implyLow, cleanClause([-ids[u] for u in lowOps] + [ids[lowT]])))
+                if levels[nt] == splitLevel:
+                    highHints.append((self.idHU(nt), cleanClause([-splitId, ids[nt], -ids[highT]])))
+                    lowHints.append((self.idLU(nt), cleanClause([ splitId, ids[nt], -ids[lowT]])))
+                newNode = nt
+            else:
+                (newHigh, andHigh) = highResult
+                (newLow, andLow) = lowResult
+                check = True
+                highHints.append((andHigh, cleanClause([-ids[u] for u in highOps] + [ids[newHigh]])))
+                lowHints.append((andLow, cleanClause([-ids[u] for u in lowOps] + [ids[newLow]])))
+                if newHigh == newLow:
+                    newNode = newHigh
+                else:
+                    newNode = self.findOrMakeHandle(splitLevel, newHigh, newLow)
+                    highHints.append((self.idHU(newNode), cleanClause([-splitId, ids[newNode], -ids[newHigh]])))
+                    lowHints.append((self.idLU(newNode), cleanClause([ splitId, ids[newNode], -ids[newLow]])))
+
+            targetClause = cleanClause([-ids[u] for u in nops] + [ids[newNode]])
+            if not check or targetClause == taut:
+                justification = taut
+            else:
+                comment = "Justification that %s ==> %s" % (" & ".join([self.handleLabel(u) for u in nops]), self.handleLabel(newNode)) if comments else None
+                justification = self.vresolver.runSplit(targetClause, splitId, highHints, lowHints, comment)
+            if imply:
+                self.operationStore(cache, key, (check, justification))
+                result = (check, abs(justification))
+            else:
+                self.operationStore(cache, key, (newNode, justification))
+                result = (newNode, abs(justification))
+            if justification != taut:
+                self.cacheJustifyAdded += 1
+            else:
+                self.cacheNoJustifyAdded += 1
+
+    # Compute existential quantification of nodeA & nodeB over the variables in clause (relational product),
+    # without constructing the full conjunction.
+    # Return node + id of clause justifying that nodeA & nodeB ==> result
+    def andExistsJustify(self, nodeA, nodeB, clause):
+        nextc = clause
+        while not nextc.isLeaf():
+            self.quantifiedVariableSet.add(nextc.variable)
+            nextc = nextc.low
+        handle, justification = self.andExistsJustifyHandle(nodeA.handle, nodeB.handle, clause.handle)
+        return (self.getNode(handle), justification)
+
+    def andExistsJustifyHandle(self, nodeA, nodeB, clause):
+        taut = resolver.tautologyId
+        cleanClause = resolver.cleanClause
+        comments = self.prover.verbLevel >= 2
+        ids = self.nodeId
+        levels = self.nodeLevel
+        highs = self.nodeHigh
+        lows = self.nodeLow
+        cache = self.operationCache["andexists"]
+        # Frame: [key, A, B, C, splitLevel, quantified, highA, lowA, highB, lowB, high result]
+        stack = []
+        result = None
+        a = nodeA
+        b = nodeB
+        c = clause
+        call = True
+        while True:
+            if call:
+                self.applyCount += 1
+                # Terminal cases
+                if a == 0 or b == 0:
+                    result = (0, taut)
+                elif a == 1 and b == 1:
+                    result = (1, taut)
+                elif a == 1 or b == 1 or a == b:
+                    # Quantify single argument.  Justify that it implies result
+                    n = a if b == 1 else b
+                    newNode = self.equantHandle(n, c)
+                    result = self.justifyImplyHandle(n, newNode)
+                    result = (newNode, result[1])
+                else:
+                    if ids[a] > ids[b]:
+                        a, b = b, a
+                    splitLevel = min(levels[a], levels[b])
+                    # Skip variables that cannot occur in either argument
+                    while c >= 2 and levels[c] < splitLevel:
+                        c = lows[c]
+                    if c < 2:
+                        # Nothing left to quantify
+                        result = self.applyAndJustifyHandle(a, b)
+                    else:
+                        key = (a, b, c)
+                        entry = cache.lookup(key)
+                        if entry is not None:
+                            result = (entry[0], abs(entry[1]))
+                        else:
+                            quantified = levels[c] == splitLevel
+                            highA, lowA = (highs[a], lows[a]) if levels[a] == splitLevel else (a, a)
+                            highB, lowB = (highs[b], lows[b]) if levels[b] == splitLevel else (b, b)
+                            stack.append([key, a, b, c, splitLevel, quantified, highA, lowA, highB, lowB, None])
+                            a = highA
+                            b = highB
+                            if quantified:
+                                c = lows[c]
+                            continue
+            if len(stack) == 0:
+                return result
+            frame = stack[-1]
+            # When quantifying, a true high branch makes the low branch irrelevant
+            if frame[10] is None and not (frame[5] and result[0] == 1):
+                # High branch complete.  Start on low branch
+                frame[10] = result
+                a = frame[7]
+                b = frame[9]
+                c = lows[frame[3]] if frame[5] else frame[3]
+                call = True
+                continue
+            stack.pop()
+            call = False
+            key, nA, nB, nC, splitLevel, quantified, highA, lowA, highB, lowB, highResult = frame
+            if highResult is None:
+                # Only high branch evaluated
+                self.operationStore(cache, key, (1, taut))
+                self.cacheNoJustifyAdded += 1
+                result = (1, taut)
+                continue
+            (newHigh, andHigh) = highResult
+            (newLow, andLow) = result
+            splitId = self.variables[splitLevel-1].id
+            # Mapping from rule names to pair (clause id, clause)
+            hints = {}
+            if highA != lowA:
+                hints["UHD"] = (self.idHD(nA), cleanClause([-splitId, -ids[nA], ids[highA]]))
+                hints["ULD"] = (self.idLD(nA), cleanClause([ splitId, -ids[nA], ids[lowA]]))
+            if highB != lowB:
+                hints["VHD"] = (self.idHD(nB), cleanClause([-splitId, -ids[nB], ids[highB]]))
+                hints["VLD"] = (self.idLD(nB), cleanClause([ splitId, -ids[nB], ids[lowB]]))
+            hints["OPH"] = (andHigh, cleanClause([-ids[highA], -ids[highB], ids[newHigh]]))
+            hints["OPL"] = (andLow, cleanClause([-ids[lowA], -ids[lowB], ids[newLow]]))
+
+            if newHigh == newLow:
+                newNode = newHigh
+            elif quantified:
+                # Result is disjunction of branch results.  Each implies it
+                newNode = self.applyOrHandle(newHigh, newLow)
+                check, implyHigh = self.justifyImplyHandle(newHigh, newNode)
+                check, implyLow = self.justifyImplyHandle(newLow, newNode)
+                hints["WHU"] = (implyHigh, cleanClause([ids[newNode], -ids[newHigh]]))
+                hints["WLU"] = (implyLow, cleanClause([ids[newNode], -ids[newLow]]))
+            else:
+                newNode = self.findOrMakeHandle(splitLevel, newHigh, newLow)
+                hints["WHU"] = (self.idHU(newNode), cleanClause([-splitId, ids[newNode], -ids[newHigh]]))
+                hints["WLU"] = (self.idLU(newNode), cleanClause([ splitId, ids[newNode], -ids[newLow]]))
 
+            targetClause = cleanClause([-ids[nA], -ids[nB], ids[newNode]])
+            if targetClause == taut:
+                justification = taut
+            else:
+                comment = "Justification that %s & %s ==> EQuant %s" % (self.handleLabel(nA), self.handleLabel(nB), self.handleLabel(newNode)) if comments else None
+                justification = self.vresolver.run(targetClause, splitId, hints, comment)
+            self.operationStore(cache, key, (newNode, justification))
+            self.cacheJustifyAdded += 1
+            result = (newNode, abs(justification))
       
     # Version that runs without generating justification
     def applyAnd(self, nodeA, nodeB):
-        self.applyCount += 1
-        # Constant cases.
-        if nodeA == self.leaf0 or nodeB == self.leaf0:
-            return self.leaf0
-        if nodeA == self.leaf1:
-            return nodeB
-        if nodeB == self.leaf1:
-            return nodeA
-        if nodeA == nodeB:
-            return nodeA
-
-        if nodeA.id > nodeB.id:
-            nodeA, nodeB = nodeB, nodeA
-        key = ("andnj", nodeA.id, nodeB.id)
-        if key in self.operationCache:
-            return self.operationCache[key][0]
-
-        # Mapping from variable names to variable numbers
-        splitVar = min(nodeA.variable, nodeB.variable)
-        highA = nodeA.branchHigh(splitVar)
-        lowA =  nodeA.branchLow(splitVar)
-        highB = nodeB.branchHigh(splitVar) 
-        lowB =  nodeB.branchLow(splitVar)
-
-        newHigh = self.applyAnd(highA, highB)
-        newLow  = self.applyAnd(lowA, lowB)
-
-        if newHigh == newLow:
-            newNode = newHigh
-        else:
-            newNode = self.findOrMake(splitVar, newHigh, newLow)
-
-        self.operationCache[key] = (newNode,resolver.tautologyId)
-        return newNode
+        return self.getNode(self.applyAndHandle(nodeA.handle, nodeB.handle))
+
+    def applyAndHandle(self, nodeA, nodeB):
+        ids = self.nodeId
+        levels = self.nodeLevel
+        highs = self.nodeHigh
+        lows = self.nodeLow
+        cache = self.operationCache["andnj"]
+        # Frame: [key, splitLevel, lowA, lowB, high result]
+        stack = []
+        result = None
+        a = nodeA
+        b = nodeB
+        call = True
+        while True:
+            if call:
+                self.applyCount += 1
+                # Constant cases.
+                if a == 0 or b == 0:
+                    result = 0
+                elif a == 1:
+                    result = b
+                elif b == 1 or a == b:
+                    result = a
+                else:
+                    if ids[a] > ids[b]:
+                        a, b = b, a
+                    key = (a, b)
+                    entry = cache.lookup(key)
+                    if entry is not None:
+                        result = entry[0]
+                    else:
+                        splitLevel = min(levels[a], levels[b])
+                        highA, lowA = (highs[a], lows[a]) if levels[a] == splitLevel else (a, a)
+                        highB, lowB = (highs[b], lows[b]) if levels[b] == splitLevel else (b, b)
+                        stack.append([key, splitLevel, lowA, lowB, None])
+                        a = highA
+                        b = highB
+                        continue
+            if len(stack) == 0:
+                return result
+            frame = stack[-1]
+            if frame[4] is None:
+                # High branch complete.  Start on low branch
+                frame[4] = result
+                a = frame[2]
+                b = frame[3]
+                call = True
+                continue
+            stack.pop()
+            call = False
+            key, splitLevel, lowA, lowB, newHigh = frame
+            newLow = result
+            if newHigh == newLow:
+                newNode = newHigh
+            else:
+                newNode = self.findOrMakeHandle(splitLevel, newHigh, newLow)
+            self.operationStore(cache, key, (newNode,resolver.tautologyId))
+            result = newNode
 
 
     def applyOr(self, nodeA, nodeB):
-        # Constant cases
-        if nodeA == self.leaf1:
-            return self.leaf1
-        if nodeB == self.leaf1:
-            return self.leaf1
-        if nodeA == self.leaf0:
-            return nodeB
-        if nodeB == self.leaf0:
-            return nodeA
-        if nodeA == nodeB:
-            return nodeA
-        if nodeA.id > nodeB.id:
-            nodeA, nodeB = nodeB, nodeA
-        key = ("or", nodeA.id, nodeB.id)
-        if key in self.operationCache:
-            return self.operationCache[key][0]
-
-        splitVar = min(nodeA.variable, nodeB.variable)  
-        highA = nodeA.branchHigh(splitVar)
-        lowA =  nodeA.branchLow(splitVar)
-        highB = nodeB.branchHigh(splitVar) 
-        lowB =  nodeB.branchLow(splitVar)
-
-        newHigh = self.applyOr(highA, highB)
-        newLow = self.applyOr(lowA, lowB)
-        newNode = newHigh if newHigh == newLow else self.findOrMake(splitVar, newHigh, newLow)
-        self.operationCache[key] = (newNode,resolver.tautologyId)
-        self.cacheNoJustifyAdded += 1
-        return newNode
+        return self.getNode(self.applyOrHandle(nodeA.handle, nodeB.handle))
+
+    def applyOrHandle(self, nodeA, nodeB):
+        ids = self.nodeId
+        levels = self.nodeLevel
+        highs = self.nodeHigh
+        lows = self.nodeLow
+        cache = self.operationCache["or"]
+        # Frame: [key, splitLevel, lowA, lowB, high result]
+        stack = []
+        result = None
+        a = nodeA
+        b = nodeB
+        call = True
+        while True:
+            if call:
+                # Constant cases
+                if a == 1 or b == 1:
+                    result = 1
+                elif a == 0:
+                    result = b
+                elif b == 0 or a == b:
+                    result = a
+                else:
+                    if ids[a] > ids[b]:
+                        a, b = b, a
+                    key = (a, b)
+                    entry = cache.lookup(key)
+                    if entry is not None:
+                        result = entry[0]
+                    else:
+                        splitLevel = min(levels[a], levels[b])
+                        highA, lowA = (highs[a], lows[a]) if levels[a] == splitLevel else (a, a)
+                        highB, lowB = (highs[b], lows[b]) if levels[b] == splitLevel else (b, b)
+                        stack.append([key, splitLevel, lowA, lowB, None])
+                        a = highA
+                        b = highB
+                        continue
+            if len(stack) == 0:
+                return result
+            frame = stack[-1]
+            if frame[4] is None:
+                # High branch complete.  Start on low branch
+                frame[4] = result
+                a = frame[2]
+                b = frame[3]
+                call = True
+                continue
+            stack.pop()
+            call = False
+            key, splitLevel, lowA, lowB, newHigh = frame
+            newLow = result
+            newNode = newHigh if newHigh == newLow else self.findOrMakeHandle(splitLevel, newHigh, newLow)
+            self.operationStore(cache, key, (newNode,resolver.tautologyId))
+            self.cacheNoJustifyAdded += 1
+            result = newNode
 
 
     # Given list of nodes, perform reduction operator (and, or, xor)
@@ -967,27 +1800,57 @@ class Manager:
             while not nextc.isLeaf():
                 self.quantifiedVariableSet.add(nextc.variable)
                 nextc = nextc.low
-        if node.isLeaf():
-            return node
-        while not clause.isLeaf() and node.variable > clause.variable:
-            clause = clause.low
-        if clause.isLeaf():
-            return node
-        key = ("equant", node.id, clause.id)
-        
-        if key in self.operationCache:
-            return self.operationCache[key][0]
-
-        newHigh = self.equant(node.high, clause, topLevel = False)
-        newLow = self.equant(node.low, clause, topLevel = False)
-        if newHigh == newLow:
-            newNode = newHigh
-        else:
-            quant = node.variable == clause.variable
-            newNode = self.applyOr(newHigh, newLow) if quant else self.findOrMake(node.variable, newHigh, newLow)
-        self.operationCache[key] = (newNode, resolver.tautologyId)
-        self.cacheNoJustifyAdded += 1
-        return newNode
+        return self.getNode(self.equantHandle(node.handle, clause.handle))
+
+    def equantHandle(self, node, clause):
+        levels = self.nodeLevel
+        highs = self.nodeHigh
+        lows = self.nodeLow
+        cache = self.operationCache["equant"]
+        # Frame: [key, node, clause, high result]
+        stack = []
+        result = None
+        n = node
+        c = clause
+        call = True
+        while True:
+            if call:
+                if n >= 2:
+                    while c >= 2 and levels[n] > levels[c]:
+                        c = lows[c]
+                if n < 2 or c < 2:
+                    result = n
+                else:
+                    key = (n, c)
+                    entry = cache.lookup(key)
+                    if entry is not None:
+                        result = entry[0]
+                    else:
+                        stack.append([key, n, c, None])
+                        n = highs[n]
+                        continue
+            if len(stack) == 0:
+                return result
+            frame = stack[-1]
+            if frame[3] is None:
+                # High branch complete.  Start on low branch
+                frame[3] = result
+                n = lows[frame[1]]
+                c = frame[2]
+                call = True
+                continue
+            stack.pop()
+            call = False
+            key, fn, fc, newHigh = frame
+            newLow = result
+            if newHigh == newLow:
+                newNode = newHigh
+            else:
+                quant = levels[fn] == levels[fc]
+                newNode = self.applyOrHandle(newHigh, newLow) if quant else self.findOrMakeHandle(levels[fn], newHigh, newLow)
+            self.operationStore(cache, key, (newNode, resolver.tautologyId))
+            self.cacheNoJustifyAdded += 1
+            result = newNode
             
     # Generate list of all nodes from root.
     # Order according to postorder traversal of graph
@@ -1026,81 +1889,214 @@ class Manager:
 
 
     # Should a GC be triggered?
+    # With mark-sweep, based on the caller's estimate of the number of dead nodes.
+    # With reference counting, based on the number of orphans that have arisen since the last collection.
+    # Each collection requires generating the roots, and so a fraction of the retained orphans must accumulate
     def checkGC(self, newDeadCount):
-        self.deadNodeCount += newDeadCount
         liveNodeCount = len(self.uniqueTable)
-        df = float(self.deadNodeCount) / liveNodeCount
-        if liveNodeCount >= self.gcMin and df >= self.gcFraction:
+        if self.refCounting:
+            newOrphanCount = len(self.orphanSet) - self.retainedOrphanCount
+            trigger = newOrphanCount > 0 and newOrphanCount >= self.gcFraction * self.retainedOrphanCount
+        else:
+            self.deadNodeCount += newDeadCount
+            trigger = float(self.deadNodeCount) / liveNodeCount >= self.gcFraction
+        if liveNodeCount >= self.gcMin and trigger:
             # Turn off trigger for garbage collection
             self.deadNodeCount = 0
-            return self.collectGarbage()
-        return []
+            clauseList = self.collectGarbage()
+        else:
+            clauseList = []
+        # Release clauses from entries evicted since last check
+        clauseList = self.evictedClauses + clauseList
+        self.evictedClauses = []
+        if self.refCounting:
+            clauseList += self.staleClauses()
+        return clauseList
 
-    # Create set nodes that should not be collected
+    # Create set of handles that should not be collected
     # Maintain frontier of marked nonleaf nodes
-    def doMarking(self, frontier):
+    # Optionally skip nodes already in excludeSet
+    def doMarking(self, frontier, excludeSet = None):
         markedSet = set([])
+        if excludeSet is None:
+            excludeSet = markedSet
         while len(frontier) > 0:
-            node = frontier[0]
-            frontier = frontier[1:]
-            if node in markedSet:
+            handle = frontier.pop()
+            if handle in markedSet or handle in excludeSet:
                 continue
-            markedSet.add(node)
-            if not node.high.isLeaf():
-                frontier.append(node.high)
-            if not node.low.isLeaf():
-                frontier.append(node.low)
+            markedSet.add(handle)
+            high = self.nodeHigh[handle]
+            low = self.nodeLow[handle]
+            if high >= 2:
+                frontier.append(high)
+            if low >= 2:
+                frontier.append(low)
         return markedSet
 
     def cleanCache(self, markedSet):
         clauseList = []
-        markedIds = set([node.id for node in markedSet])
-        klist = list(self.operationCache.keys())
-        for k in klist:
-            kill = self.operationCache[k][0] not in markedSet
-            # Skip over operation name
-            for id in k[1:]:
-                kill = kill or id not in markedIds
-            if kill:
-                cid = self.operationCache[k][1]
-                if abs(cid) != resolver.tautologyId:
-                    clist = [cid] if cid > 0 else [-cid-1, -cid]
-                    clauseList += clist
-                self.cacheRemoved += 1
-                del self.operationCache[k]
+        for table in self.operationCache.values():
+            klist = list(table.entries.keys())
+            for k in klist:
+                entry = table.entries[k]
+                # Results of implication tests are Booleans, and so never marked
+                value = entry[0]
+                kill = type(value) is bool or value not in markedSet
+                for h in k:
+                    kill = kill or h not in markedSet
+                if kill:
+                    clauseList += self.entryClauses(entry)
+                    self.cacheRemoved += 1
+                    table.remove(k)
         return clauseList
         
     def cleanNodes(self, markedSet):
         clauseList = []
-        klist = list(self.uniqueTable.keys())
-        for k in klist:
-            node = self.uniqueTable[k]
+        klist = list(self.uniqueTable.items())
+        for k, handle in klist:
             # If node is marked, then its children will be, too
-            if node not in markedSet:
-                clist = [node.idHU(), node.idLU(), node.idHD(), node.idLD()]
+            if handle not in markedSet:
+                clist = [self.idHU(handle), self.idLU(handle), self.idHD(handle), self.idLD(handle)]
                 clist = [c for c in clist if c != resolver.tautologyId]
                 clauseList += clist
                 self.nodesRemoved += 1
                 del self.uniqueTable[k]
+                self.forgetHandle(handle)
+                self.freeHandles.append(handle)
         return clauseList
 
 
+    # Handles of nonleaf roots supplied by callback function
+    def rootHandles(self, generator):
+        if generator is None:
+            return []
+        return [r.handle for r in generator() if (r is not None and not r.isLeaf())]
+
     # Start garbage collection.
     # Provided with partial list of accessible roots
     def collectGarbage(self):
+        start = datetime.datetime.now()
         oldCount = len(self.uniqueTable)
-        frontier = []
-        if self.rootGenerator is not None:
-            frontier += self.rootGenerator()
-        frontier = [r for r in frontier if (r is not None and not r.isLeaf())]
+        if self.refCounting:
+            clauseList = self.reclaimOrphans(oldCount)
+        else:
+            clauseList = self.markAndSweep(oldCount)
+        self.gcCount += 1
+        newCount = len(self.uniqueTable)
+        delta = datetime.datetime.now() - start
+        seconds = delta.seconds + 1e-6 * delta.microseconds
+        self.gcSeconds += seconds
+        self.gcMaxSeconds = max(self.gcMaxSeconds, seconds)
+        if self.verbLevel >= 3:
+            self.writer.write("GC #%d %d --> %d nodes (%.3f seconds)\n" % (self.gcCount, oldCount, newCount, seconds))
+        return clauseList
+
+    def markAndSweep(self, oldCount):
+        frontier = self.rootHandles(self.rootGenerator)
         # Marking phase
         markedSet = self.doMarking(frontier)
+        if self.deadRootGenerator is not None:
+            self.maxRetainedCount = max(self.maxRetainedCount, oldCount + self.reclaimedEarlyCount)
+            deadFrontier = self.rootHandles(self.deadRootGenerator)
+            self.reclaimedEarlyCount += len(self.doMarking(deadFrontier, markedSet))
         clauseList = self.cleanCache(markedSet)
         clauseList += self.cleanNodes(markedSet)
-        self.gcCount += 1
-        newCount = len(self.uniqueTable)
-        if self.verbLevel >= 3:
-            self.writer.write("GC #%d %d --> %d nodes\n" % (self.gcCount, oldCount, newCount))
+        return clauseList
+
+    # Reference counting collection.  Work is proportional to the number of roots
+    # and orphans plus the number of nodes reclaimed, rather than to the number of live nodes.
+    # Cache entries referring to reclaimed nodes are purged, deleting their clauses, once gcMin handles
+    # have been reclaimed.  Until then, those with reclaimed results are dropped upon lookup
+    def reclaimOrphans(self, oldCount):
+        rootSet = set(self.rootHandles(self.rootGenerator))
+        refs = self.nodeRefs
+        live = self.nodeLive
+        bases = self.nodeClauseBase
+        clauseList = []
+        freed = []
+        # Sorted, so that the order of clause deletions does not depend on the layout of the set
+        work = sorted([handle for handle in self.orphanSet if handle not in rootSet])
+        while len(work) > 0:
+            handle = work.pop()
+            self.orphanSet.discard(handle)
+            level = self.nodeLevel[handle]
+            high = self.nodeHigh[handle]
+            low = self.nodeLow[handle]
+            del self.uniqueTable[(level << 64) | (high << 32) | low]
+            live[handle] = 0
+            self.forgetHandle(handle)
+            # Defining clauses, as given by idHU, idLU, idHD, and idLD
+            base = bases[handle]
+            if high != 0:
+                clauseList.append(base + VariableNode.HU)
+            if low != 0:
+                clauseList.append(base + VariableNode.LU)
+            if high != 1:
+                clauseList.append(base + VariableNode.HD)
+            if low != 1:
+                clauseList.append(base + VariableNode.LD)
+            freed.append(handle)
+            for child in (high, low):
+                if child >= 2:
+                    refs[child] -= 1
+                    if refs[child] == 0:
+                        if child in rootSet:
+                            self.orphanSet.add(child)
+                        else:
+                            work.append(child)
+        if self.deadRootGenerator is not None:
+            self.maxRetainedCount = max(self.maxRetainedCount, oldCount + self.reclaimedEarlyCount)
+            # Count reclaimed nodes reachable from the dead roots
+            freedSet = set(freed)
+            markedSet = set([])
+            frontier = self.rootHandles(self.deadRootGenerator)
+            while len(frontier) > 0:
+                handle = frontier.pop()
+                if handle in markedSet or handle not in freedSet:
+                    continue
+                markedSet.add(handle)
+                frontier.append(self.nodeHigh[handle])
+                frontier.append(self.nodeLow[handle])
+            self.reclaimedEarlyCount += len(markedSet)
+        self.nodesRemoved += len(freed)
+        self.pendingHandles += freed
+        self.retainedOrphanCount = len(self.orphanSet)
+        # Purging requires a pass over the caches, and so wait until enough handles have accumulated.
+        # The bound is fixed, so that the clauses of the purged entries are deleted promptly however large the caches grow
+        if len(self.pendingHandles) >= self.gcMin:
+            clauseList += self.recycleHandles()
+        return clauseList
+
+    # Purge cache entries that refer to reclaimed nodes,
+    # and then make the handles of those nodes available for reuse
+    def recycleHandles(self):
+        live = self.nodeLive
+        clauseList = []
+        for table in self.operationCache.values():
+            klist = list(table.entries.keys())
+            for k in klist:
+                entry = table.entries[k]
+                value = entry[0]
+                kill = type(value) is int and not live[value]
+                for h in k:
+                    kill = kill or not live[h]
+                if kill:
+                    clauseList += self.entryClauses(entry)
+                    self.cacheRemoved += 1
+                    table.remove(k)
+        self.freeHandles += self.pendingHandles
+        self.pendingHandles = []
+        self.cachePurgeCount += 1
+        return clauseList
+
+    # Proof clauses from cache entries dropped during lookup
+    def staleClauses(self):
+        clauseList = []
+        for table in self.operationCache.values():
+            for entry in table.staleEntries:
+                clauseList += self.entryClauses(entry)
+            self.cacheRemoved += len(table.staleEntries)
+            table.staleEntries = []
         return clauseList
 
     # Summarize activity
@@ -1113,12 +2109,22 @@ class Manager:
             if self.verbLevel >= 2:
                 self.writer.write("  Total nodes removed by gc: %d\n" % self.nodesRemoved)
             self.writer.write("  Maximum live nodes: %d\n" % self.maxLiveCount)
+            if self.deadRootGenerator is not None:
+                maxRetained = max(self.maxRetainedCount, len(self.uniqueTable) + self.reclaimedEarlyCount)
+                self.writer.write("  Maximum live nodes without liveness analysis (estimated): %d\n" % maxRetained)
+                self.writer.write("  Nodes reclaimed due to liveness analysis: %d\n" % self.reclaimedEarlyCount)
             self.writer.write("  Total apply operations: %d\n" % self.applyCount)            
             if self.verbLevel >= 2:
                 self.writer.write("  Total cached results not requiring proofs: %d\n" % self.cacheNoJustifyAdded)
                 self.writer.write("  Total cached results requiring proofs: %d\n" % self.cacheJustifyAdded)
                 self.writer.write("  Total cache entries removed: %d\n" % self.cacheRemoved)
+                for name in self.operationNames:
+                    self.operationCache[name].summarize(self.writer)
             self.writer.write("  Total GCs performed: %d\n" % self.gcCount)
+            if self.gcCount > 0:
+                self.writer.write("  GC pause seconds: %.3f total, %.3f maximum\n" % (self.gcSeconds, self.gcMaxSeconds))
+            if self.refCounting and self.verbLevel >= 2:
+                self.writer.write("  Cache purges for handle reuse: %d\n" % self.cachePurgeCount)
         if self.verbLevel >= 2:
             self.writer.write("  Results from resolver:\n")
             self.vresolver.summarize()
@@ -3,14 +3,31 @@
 # via a sequence of implication steps
 # The tool pbip_check.py converts a PBIP proof into a clausal proof in LRAT format
 # The tool pbip_cnf.py generates a CNF file containing clausal representation of the input PB constraints
+# The tool pbip_binary.py converts a PBIP proof into the binary format FILE.pbipb
 # The tool pbip_order.py generates a permutation of the CNF file to ensure that all
 # problem variables occur first in the file.
 
 
+import os
+import sys
+import re
+import itertools
+import heapq
+import collections
+import datetime
+import json
+import pickle
+import tempfile
+import shutil
+import signal
+import concurrent.futures
+from array import array
+
 import solver
 import bdd
 import pseudoboolean
 import resolver
+import stream
 
 
 def trim(s):
@@ -102,6 +119,9 @@ def pairlists(s):
                 ls.append([head, lit])
     return msg, ls
 
+# Pattern for extracting variable numbers from OPB constraint
+variablePattern = re.compile(r'x(\d+)')
+
 # Return list of constraints from line of OPB
 class PbipException(Exception):
     form = ""
@@ -179,46 +199,455 @@ def parseOpb(line):
     tups = [(v,c) for v,c in zip(vars, coeffs)]
     tups.sort(key = lambda t : abs(t[0]))
     nz = { v : c for v,c in tups }
+    return makeConstraints(nz, cval, rel == '=')
+
+# Generate constraint(s) from normalized >= form
+def makeConstraints(nz, cval, isEquation):
     con1 = pseudoboolean.Constraint(len(nz), cval)
     con1.setNz(nz)
-    if rel == '>=':
+    if not isEquation:
         return (con1,)
     else:
-        cval = -cval
-        tups = [(t[0],-t[1]) for t in tups]
-        nz = { v : c for v,c in tups }
-        con2 = pseudoboolean.Constraint(len(nz), cval)
+        nz = { v : -c for v,c in nz.items() }
+        con2 = pseudoboolean.Constraint(len(nz), -cval)
         con2.setNz(nz)
         return (con1, con2)
+
+#### Binary PBIP format
+# File consists of header line, followed by sequence of records.
+# Each record consists of one byte giving the command ('*' for a comment),
+# the payload length in bytes, and the payload.
+# All integers are encoded in the zig-zag varint representation of stream.CompressArray.
+# Comment payload is the UTF-8 comment text.
+# Step payload consists of the length in bytes of the constraint part,
+# the constraint part, and the hint part.
+# Constraint part is list of integers REL CVAL N V1 C1 ... VN CN,
+# where REL = 1 for equation and 0 for >=, and (CVAL, Vi, Ci) give the normalized
+# constraint, with the variables delta-encoded in ascending order.
+# For commands i, a, and s, hint part is the list of hints, delta-encoded.
+# For commands u and k, hint part is a list of hint tuples, each given as K H1 ... HK
+
+binaryHeader = b"PBIPB 1\n"
+binarySuffix = ".pbipb"
+
+def isBinaryName(fname):
+    return fname.endswith(binarySuffix)
+
+# Decoded values of single-byte integers
+zigzagTable = [u//2 if u & 0x1 == 0 else -(u//2) for u in range(128)]
+# Integers requiring multiple bytes
+multiBytePattern = re.compile(rb'[\x80-\xff]+[\x00-\x7f]')
+
+# Decode list of integers from byte sequence
+# Runs of single-byte values are decoded by table lookup
+def decompress(bytes):
+    result = []
+    pos = 0
+    for match in multiBytePattern.finditer(bytes):
+        start = match.start()
+        result += map(zigzagTable.__getitem__, bytes[pos:start])
+        ca = stream.CompressArray()
+        ca.bytes = match.group()
+        result += ca.toList()
+        pos = match.end()
+    result += map(zigzagTable.__getitem__, bytes[pos:])
+    return result
+
+# Read single varint from file.  Return None at end of file
+def readVarint(infile):
+    u = 0
+    weight = 0
+    while True:
+        b = infile.read(1)
+        if len(b) == 0:
+            if weight == 0:
+                return None
+            raise PbipException("", "Truncated integer")
+        b = b[0]
+        u += (b & 0x7F) << weight
+        if b < 128:
+            return u//2 if u & 0x1 == 0 else -(u//2)
+        weight += 7
+
+# Read record from binary file.  Return (command, payload), or None at end of file
+def readRecord(infile):
+    cbyte = infile.read(1)
+    if len(cbyte) == 0:
+        return None
+    length = readVarint(infile)
+    if length is None or length < 0:
+        raise PbipException("", "Invalid record length")
+    payload = infile.read(length)
+    if len(payload) != length:
+        raise PbipException("", "Truncated record")
+    return (chr(cbyte[0]), payload)
+
+def encodeRecord(command, payload):
+    return bytes([ord(command)]) + stream.CompressArray([len(payload)]).bytes + payload
+
+def encodeComment(comment):
+    return encodeRecord('*', comment.encode())
+
+def encodeStep(command, clist, hlist):
+    con = clist[0]
+    vars = sorted(con.nz.keys())
+    ilist = [1 if len(clist) == 2 else 0, con.cval, len(vars)]
+    lastVar = 0
+    for var in vars:
+        ilist += [var - lastVar, con.nz[var]]
+        lastVar = var
+    cbytes = stream.CompressArray(ilist).bytes
+    ilist = []
+    if command in "uk":
+        for hint in hlist:
+            ilist += [len(hint)] + hint
+    else:
+        lastHint = 0
+        for hint in hlist:
+            ilist.append(hint - lastHint)
+            lastHint = hint
+    hbytes = stream.CompressArray(ilist).bytes
+    return encodeRecord(command, stream.CompressArray([len(cbytes)]).bytes + cbytes + hbytes)
+
+# Split step payload into constraint and hint parts
+def splitStep(payload):
+    pos = 0
+    while payload[pos] >= 128:
+        pos += 1
+    clength = decompress(payload[:pos+1])[0]
+    return (payload[pos+1:pos+1+clength], payload[pos+1+clength:])
+
+# Decode constraint part of step.  Return list of PB constraints
+def decodeConstraints(cbytes):
+    ilist = decompress(cbytes)
+    isEquation = ilist[0] == 1
+    cval = ilist[1]
+    n = ilist[2]
+    nz = {}
+    var = 0
+    pos = 3
+    for i in range(n):
+        var += ilist[pos]
+        nz[var] = ilist[pos+1]
+        pos += 2
+    return makeConstraints(nz, cval, isEquation)
+
+# Decode hint part of step.  Return list of hints
+def decodeHints(command, hbytes):
+    ilist = decompress(hbytes)
+    if command in "uk":
+        pos = 0
+        hlist = []
+        while pos < len(ilist):
+            k = ilist[pos]
+            hlist.append(ilist[pos+1:pos+1+k])
+            pos += 1+k
+    else:
+        hlist = list(itertools.accumulate(ilist))
+    return hlist
+
+# Decode step payload.  Return (list of PB constraints, list of hints)
+def decodeStep(command, payload):
+    cbytes, hbytes = splitStep(payload)
+    return (decodeConstraints(cbytes), decodeHints(command, hbytes))
     
 class PbipReader:
     fname = ""
     lineCount = 0
     infile = None
     verbLevel = 1
+    # Indexed mode.  Index built in single pass over file, and cached in file FILE.pbip.idx
+    indexed = False
+    indexName = ""
+    # Step index.  Arrays indexed by step number (offset by 1)
+    # Byte offset of first line following previous step
+    stepOffsets = None
+    # Line number of first line following previous step
+    stepLines = None
+    # Command character for step
+    stepKinds = None
+    # Last step that makes use of step as hint (0 = unused)
+    stepLastUses = None
+    # Mappings from input clause Id to first and last input steps using the clause as a hint
+    clauseFirstUses = None
+    clauseLastUses = None
+    # Variable statistics
+    maxInputVariable = 0
+    maxVariable = 0
+    # Next step to read in indexed mode
+    nextStep = 1
+    # Binary format (file FILE.pbipb).  lineCount then counts records
+    binary = False
+    # Byte position in file when saved to a checkpoint
+    fileOffset = 0
     
-    def __init__(self, fname, verbLevel):
+    def __init__(self, fname, verbLevel, indexed = False):
         self.fname = fname
-        self.start()
         self.verbLevel = verbLevel
+        self.indexed = indexed
+        self.binary = isBinaryName(fname)
+        self.stepOffsets = None
+        if indexed:
+            self.indexName = fname + ".idx"
+            if not self.loadIndex():
+                self.buildIndex()
+                self.saveIndex()
+        self.start()
 
     def start(self):
         try:
-            self.infile = open(self.fname, 'r')            
+            self.infile = open(self.fname, 'rb' if self.indexed or self.binary else 'r')
         except:
             print("Can't open input file %s" % self.fname)
             raise PbipException("", "Invalid input file")
+        if self.binary and self.infile.readline() != binaryHeader:
+            raise PbipException("", "File %s: Not a binary PBIP file" % self.fname)
         self.lineCount = 0
+        self.nextStep = 1
+
+    # Saving to a checkpoint records the file position.
+    # Positions are not available when iterating over the lines of a text file,
+    # but then the line count suffices
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["infile"] = None
+        state["fileOffset"] = self.infile.tell() if self.binary and not self.indexed else 0
+        return state
+
+    # Reopen file after loading from checkpoint and restore its position
+    def resume(self):
+        lineCount = self.lineCount
+        nextStep = self.nextStep
+        self.start()
+        self.lineCount = lineCount
+        self.nextStep = nextStep
+        if self.indexed:
+            # Each step is read from its recorded offset
+            pass
+        elif self.binary:
+            self.infile.seek(self.fileOffset)
+        else:
+            for i in range(lineCount):
+                self.infile.readline()
 
     def finish(self):
         if self.infile is not None:
             self.infile.close()
             self.infile = None
+
+    def stepCount(self):
+        return len(self.stepOffsets) if self.indexed else None
+
+    # Identifying information for input file.  Index is valid only when this matches
+    def fileSignature(self):
+        try:
+            stat = os.stat(self.fname)
+        except:
+            print("Can't open input file %s" % self.fname)
+            raise PbipException("", "Invalid input file")
+        return "%d %d" % (stat.st_size, stat.st_mtime_ns)
+
+    # Build index in single pass over file
+    def buildIndex(self):
+        self.stepOffsets = array('q')
+        self.stepLines = array('q')
+        self.stepKinds = bytearray()
+        self.stepLastUses = array('q')
+        self.clauseFirstUses = {}
+        self.clauseLastUses = {}
+        self.maxInputVariable = 0
+        self.maxVariable = 0
+        try:
+            infile = open(self.fname, 'rb')
+        except:
+            print("Can't open input file %s" % self.fname)
+            raise PbipException("", "Invalid input file")
+        if self.binary:
+            self.buildBinaryIndex(infile)
+        else:
+            self.buildTextIndex(infile)
+        infile.close()
+        if self.verbLevel >= 2:
+            counts = { kind : 0 for kind in "iauks" }
+            for kind in self.stepKinds:
+                counts[chr(kind)] += 1
+            clist = ["%s:%d" % (kind, counts[kind]) for kind in "iauks" if counts[kind] > 0]
+            print("PBIP: Indexed %d steps from file %s (%s).  Maximum variable = %d" %
+                  (len(self.stepOffsets), self.fname, ", ".join(clist), self.maxVariable))
+
+    def buildTextIndex(self, infile):
+        offset = 0
+        lineCount = 0
+        startOffset = 0
+        startLine = 1
+        for bline in infile:
+            lineCount += 1
+            offset += len(bline)
+            line = trim(bline.decode())
+            if len(line) == 0 or line[0] == '*':
+                continue
+            command = line[0]
+            if command not in "iauks":
+                raise PbipException("", "File %s Line %d: Invalid command '%s'" % (self.fname, lineCount, command))
+            pid = len(self.stepOffsets) + 1
+            self.stepOffsets.append(startOffset)
+            self.stepLines.append(startLine)
+            self.stepKinds.append(ord(command))
+            self.stepLastUses.append(0)
+            startOffset = offset
+            startLine = lineCount + 1
+            pos = line.find(';')
+            if pos < 0:
+                raise PbipException("", "File %s Line %d: No semicolon found" % (self.fname, lineCount))
+            vlist = [int(v) for v in variablePattern.findall(line, 1, pos)]
+            if len(vlist) > 0:
+                vmax = max(vlist)
+                self.maxVariable = max(self.maxVariable, vmax)
+                if command == 'i':
+                    self.maxInputVariable = max(self.maxInputVariable, vmax)
+            if command == 'i':
+                try:
+                    hlist = [int(f) for f in line[pos+1:].split()]
+                except:
+                    raise PbipException("", "File %s Line %d: Couldn't parse hint list '%s'" % (self.fname, lineCount, line[pos+1:]))
+                self.recordClauseUses(pid, hlist)
+                continue
+            for hid in self.hintSteps(command, line[pos+1:], lineCount):
+                if hid >= 1 and hid < pid:
+                    self.stepLastUses[hid-1] = pid
+
+    def recordClauseUses(self, pid, hlist):
+        firstUses = self.clauseFirstUses
+        lastUses = self.clauseLastUses
+        for hid in hlist:
+            if hid not in firstUses:
+                firstUses[hid] = pid
+            lastUses[hid] = pid
+
+    def buildBinaryIndex(self, infile):
+        if infile.readline() != binaryHeader:
+            raise PbipException("", "File %s: Not a binary PBIP file" % self.fname)
+        recordCount = 0
+        startOffset = infile.tell()
+        startRecord = 1
+        while True:
+            try:
+                record = readRecord(infile)
+            except PbipException as ex:
+                raise PbipException("", "File %s Record %d: %s" % (self.fname, recordCount+1, ex.msg))
+            if record is None:
+                break
+            recordCount += 1
+            command, payload = record
+            if command == '*':
+                continue
+            if command not in "iauks":
+                raise PbipException("", "File %s Record %d: Invalid command '%s'" % (self.fname, recordCount, command))
+            pid = len(self.stepOffsets) + 1
+            self.stepOffsets.append(startOffset)
+            self.stepLines.append(startRecord)
+            self.stepKinds.append(ord(command))
+            self.stepLastUses.append(0)
+            startOffset = infile.tell()
+            startRecord = recordCount + 1
+            try:
+                cbytes, hbytes = splitStep(payload)
+                clist = decodeConstraints(cbytes)
+                hlist = decodeHints(command, hbytes) if command in "iauk" else []
+            except IndexError:
+                raise PbipException("", "File %s Record %d: Invalid step encoding" % (self.fname, recordCount))
+            if len(clist[0].nz) > 0:
+                vmax = max(clist[0].nz.keys())
+                self.maxVariable = max(self.maxVariable, vmax)
+                if command == 'i':
+                    self.maxInputVariable = max(self.maxInputVariable, vmax)
+            if command == 'i':
+                self.recordClauseUses(pid, hlist)
+                continue
+            if command in "uk":
+                hids = [abs(hint[0]) for hint in hlist]
+            else:
+                hids = hlist
+            for hid in hids:
+                if hid >= 1 and hid < pid:
+                    self.stepLastUses[hid-1] = pid
+
+    # Index file consists of header line, followed by binary arrays.
+    # Written to temporary file and then renamed, so that an interrupted write
+    # never leaves a truncated index in place
+    def saveIndex(self):
+        tmpName = self.indexName + ".tmp"
+        try:
+            outfile = open(tmpName, 'wb')
+        except:
+            if self.verbLevel >= 2:
+                print("PBIP: Couldn't write index file %s" % tmpName)
+            return
+        header = "PBIPINDEX %s %s %d %d %d %d\n" % (sys.byteorder, self.fileSignature(), len(self.stepOffsets),
+                                                   self.maxInputVariable, self.maxVariable, len(self.clauseFirstUses))
+        clauseIds = sorted(self.clauseFirstUses.keys())
+        try:
+            outfile.write(header.encode())
+            self.stepOffsets.tofile(outfile)
+            self.stepLines.tofile(outfile)
+            self.stepLastUses.tofile(outfile)
+            outfile.write(self.stepKinds)
+            array('q', clauseIds).tofile(outfile)
+            array('q', [self.clauseFirstUses[hid] for hid in clauseIds]).tofile(outfile)
+            array('q', [self.clauseLastUses[hid] for hid in clauseIds]).tofile(outfile)
+            outfile.close()
+            os.replace(tmpName, self.indexName)
+        except OSError:
+            outfile.close()
+            if os.path.exists(tmpName):
+                os.remove(tmpName)
+            if self.verbLevel >= 2:
+                print("PBIP: Couldn't write index file %s" % self.indexName)
+
+    # Return True if valid index loaded
+    def loadIndex(self):
+        try:
+            infile = open(self.indexName, 'rb')
+        except:
+            return False
+        try:
+            fields = infile.readline().decode().split()
+            if len(fields) != 8 or fields[0] != "PBIPINDEX" or fields[1] != sys.byteorder:
+                return False
+            if " ".join(fields[2:4]) != self.fileSignature():
+                return False
+            steps = int(fields[4])
+            self.maxInputVariable = int(fields[5])
+            self.maxVariable = int(fields[6])
+            self.stepOffsets = array('q')
+            self.stepOffsets.fromfile(infile, steps)
+            self.stepLines = array('q')
+            self.stepLines.fromfile(infile, steps)
+            self.stepLastUses = array('q')
+            self.stepLastUses.fromfile(infile, steps)
+            self.stepKinds = bytearray(infile.read(steps))
+            if len(self.stepKinds) != steps:
+                return False
+            clauseCount = int(fields[7])
+            uses = [array('q') for i in range(3)]
+            for a in uses:
+                a.fromfile(infile, clauseCount)
+            self.clauseFirstUses = dict(zip(uses[0], uses[1]))
+            self.clauseLastUses = dict(zip(uses[0], uses[2]))
+        except (ValueError, EOFError, UnicodeDecodeError):
+            return False
+        finally:
+            infile.close()
+        if self.verbLevel >= 2:
+            print("PBIP: Loaded index for %d steps from %s" % (steps, self.indexName))
+        return True
         
     def findMaximum(self):
+        if self.indexed or self.stepOffsets is not None:
+            return self.maxInputVariable
         maximum = 0
         while True:
-            nextMaximum = self.maximumLine()
+            nextMaximum = self.maximumRecord() if self.binary else self.maximumLine()
             if nextMaximum is None:
                 break
             if nextMaximum > maximum:
@@ -228,6 +657,25 @@ class PbipReader:
         self.start()
         return maximum
 
+    # Binary version.  Only input steps need to be decoded
+    def maximumRecord(self):
+        while True:
+            try:
+                record = readRecord(self.infile)
+            except PbipException as ex:
+                raise PbipException("", "File %s Record %d: %s" % (self.fname, self.lineCount+1, ex.msg))
+            if record is None:
+                return None
+            self.lineCount += 1
+            command, payload = record
+            if command != 'i':
+                continue
+            cbytes, hbytes = splitStep(payload)
+            clist = decodeConstraints(cbytes)
+            if len(clist[0].nz) == 0:
+                continue
+            return max(clist[0].nz.keys())
+
     def maximumLine(self):
         eof = True
         maximum = 0
@@ -260,13 +708,115 @@ class PbipReader:
         else:
             return maximum
 
+    # Extract list of steps referenced as hints by step
+    def hintSteps(self, command, hstring, lineCount):
+        if command == 'a':
+            try:
+                return [int(f) for f in hstring.split()]
+            except:
+                raise PbipException("", "File %s Line %d: Couldn't parse hint list '%s'" % (self.fname, lineCount, hstring))
+        elif command in "uk":
+            msg, plist = pairlists(hstring)
+            if plist is None:
+                raise PbipException("", "File %s Line %d: Couldn't parse hint list '%s' (%s)" % (self.fname, lineCount, hstring, msg))
+            return [abs(hint[0]) for hint in plist]
+        return []
+
+    # Find the last step that makes use of each step as a hint.
+    # Return list indexed by step number (offset by 1), with 0 for steps never used
+    def findLastUses(self):
+        if self.indexed or self.binary:
+            if self.stepOffsets is None:
+                self.buildIndex()
+            return list(self.stepLastUses)
+        lastUses = []
+        for line in self.infile:
+            self.lineCount += 1
+            line = trim(line)
+            if len(line) == 0 or line[0] == '*':
+                continue
+            command = line[0]
+            pid = len(lastUses) + 1
+            lastUses.append(0)
+            pos = line.find(';')
+            if pos < 0:
+                raise PbipException("", "File %s Line %d: No semicolon found" % (self.fname, self.lineCount))
+            for hid in self.hintSteps(command, line[pos+1:], self.lineCount):
+                if hid >= 1 and hid < pid:
+                    lastUses[hid-1] = pid
+        ## reset
+        self.finish()
+        self.start()
+        return lastUses
+
+    # Find the first and last input steps that make use of each input clause as a hint.
+    # Return pair of dictionaries mapping clause Id to step number: the first uses of all such clauses,
+    # and the last uses of those used by more than one step
+    # With an index, these are recorded while building it.  Otherwise the text file is scanned
+    def findClauseUses(self):
+        if self.indexed or self.binary:
+            if self.stepOffsets is None:
+                self.buildIndex()
+            firstUses = self.clauseFirstUses
+            lastUses = self.clauseLastUses
+            return firstUses, { hid : lastUses[hid] for hid in lastUses if lastUses[hid] > firstUses[hid] }
+        firstUses = {}
+        lastUses = {}
+        try:
+            infile = open(self.fname, 'rb')
+        except:
+            raise PbipException("", "Can't open input file %s" % self.fname)
+        pid = 0
+        lineCount = 0
+        for line in infile:
+            lineCount += 1
+            line = trim(line.decode())
+            if len(line) == 0 or line[0] == '*':
+                continue
+            pid += 1
+            pos = line.find(';')
+            if line[0] == 'i' and pos >= 0:
+                try:
+                    hlist = [int(f) for f in line[pos+1:].split()]
+                except:
+                    raise PbipException("", "File %s Line %d: Couldn't parse hint list '%s'" % (self.fname, lineCount, line[pos+1:]))
+                for hid in hlist:
+                    firstUses.setdefault(hid, pid)
+                    lastUses[hid] = pid
+        infile.close()
+        return firstUses, { hid : lastUses[hid] for hid in lastUses if lastUses[hid] > firstUses[hid] }
+
     # Return (command, list of PB constraints, list of hints, list of preceding comments)
     def readLine(self):
+        if self.indexed:
+            pid = self.nextStep
+            if pid > len(self.stepOffsets):
+                return ("", [], [], [])
+            self.nextStep += 1
+            return self.readStep(pid)
+        if self.binary:
+            return self.parseBinaryStep()
+        return self.parseStep(self.infile)
+
+    # Random access to step with specified PBIP id.  Requires indexed mode
+    def readStep(self, pid):
+        if not self.indexed:
+            raise PbipException("", "Random access to step #%d requires indexed reader" % pid)
+        if pid < 1 or pid > len(self.stepOffsets):
+            raise PbipException("", "File %s: Step #%d out of range" % (self.fname, pid))
+        self.infile.seek(self.stepOffsets[pid-1])
+        self.lineCount = self.stepLines[pid-1] - 1
+        if self.binary:
+            return self.parseBinaryStep()
+        return self.parseStep(line.decode() for line in self.infile)
+
+    # Parse comments and command from sequence of lines
+    def parseStep(self, lines):
         command = ""
         clist = []
         hlist = []
         comlist = []
-        for line in self.infile:
+        for line in lines:
             self.lineCount += 1
             line = trim(line)
             if len(line) == 0:
@@ -308,6 +858,41 @@ class PbipReader:
                 print("PBIP:   Hints: %s" % str(hlist))
         return (command, clist, hlist, comlist)
 
+    # Parse comments and command from binary file
+    def parseBinaryStep(self):
+        command = ""
+        clist = []
+        hlist = []
+        comlist = []
+        while True:
+            try:
+                record = readRecord(self.infile)
+            except PbipException as ex:
+                raise PbipException("", "File %s Record %d: %s" % (self.fname, self.lineCount+1, ex.msg))
+            if record is None:
+                break
+            self.lineCount += 1
+            command, payload = record
+            if command == '*':
+                comlist.append(payload.decode())
+                command = ""
+                continue
+            if command not in "iauks":
+                raise PbipException("", "File %s Record %d: Invalid command '%s'" % (self.fname, self.lineCount, command))
+            try:
+                clist, hlist = decodeStep(command, payload)
+            except IndexError:
+                raise PbipException("", "File %s Record %d: Invalid step encoding" % (self.fname, self.lineCount))
+            break
+        if self.verbLevel >= 3:
+            print("PBIP: Read PBIP record #%d.  Command = %s" % (self.lineCount, command))
+            print("PBIP:  Constraints:")
+            for con in clist:
+                print("PBIP:     %s" % str(con))
+            if len(hlist) > 0:
+                print("PBIP:   Hints: %s" % str(hlist))
+        return (command, clist, hlist, comlist)
+
 #### Support for Symbolic Davis-Putnam (SDP) reduction
 class BucketException(Exception):
     valid = None
@@ -319,25 +904,77 @@ class BucketException(Exception):
         return "BUCKET Exception: " + str(self.value)
 
 
+# Orders in which terms within a bucket can be conjoined
+# fifo: Conjoin in order of arrival.  Results are added at end, giving a balanced tree
+# size: Conjoin the two terms having the smallest BDDs
+# many: Conjoin all terms in a bucket with a single multi-way operation
+conjunctOrders = ["fifo", "size", "many"]
+
+# Queue of terms awaiting conjunction
+class TermQueue:
+    manager = None
+    bySize = False
+    # Deque of items, or heap of (size, sequence number, item)
+    items = None
+    # When ordering by size, items whose sizes have not yet been computed.
+    # Sizes are only needed once there are multiple items
+    pending = []
+    sequence = 0
+
+    def __init__(self, manager, conjunctOrder = "fifo"):
+        self.manager = manager
+        self.bySize = conjunctOrder == "size"
+        self.items = [] if self.bySize else collections.deque()
+        self.pending = []
+        self.sequence = 0
+
+    def __len__(self):
+        return len(self.items) + len(self.pending)
+
+    def __str__(self):
+        return str(list(self.items) + self.pending)
+
+    # Add item with BDD root
+    def push(self, root, item):
+        if self.bySize:
+            self.pending.append((root, self.sequence, item))
+            self.sequence += 1
+        else:
+            self.items.append(item)
+
+    def pop(self):
+        if not self.bySize:
+            return self.items.popleft()
+        if len(self.items) == 0 and len(self.pending) == 1:
+            return self.pending.pop()[2]
+        for (root, seq, item) in self.pending:
+            size = 1 if root.isLeaf() else self.manager.getSize(root)
+            heapq.heappush(self.items, (size, seq, item))
+        self.pending = []
+        return heapq.heappop(self.items)[2]
+
 # Class for performing bucket reduction
 class BucketReducer:
 
     parent = None
-    buckets = {0 : []}
+    buckets = {}
 
     def __init__(self, parent):
         self.parent = parent
-        self.buckets = {0 : []}
+        self.buckets = {}
+
+    def newBucket(self):
+        return TermQueue(self.parent.manager, self.parent.conjunctOrder)
 
     def placeInBucket(self, root, validation):
         supportLevels = self.parent.manager.getSupportLevels(root)
         supportLevels.reverse()
         for level in supportLevels:
             if level in self.buckets:
-                self.buckets[level].append((root, validation))
+                self.buckets[level].push(root, (root, validation))
                 return
         # Support set only has data variables
-        self.buckets[0].append((root, validation))
+        self.buckets[0].push(root, (root, validation))
     
     # Bucket reduction based on variable levels
     def reduce(self):
@@ -352,17 +989,32 @@ class BucketReducer:
             if self.parent.verbLevel >= 4:
                 var = self.parent.varMap[id] if id > 0 else "TOP"
                 print("BREDUCE: Processing bucket #%d (variable %s).  Size = %d" % (level, str(var), len(self.buckets[level])))
-            while len(self.buckets[level]) > 1:
-                (r1,v1) = self.buckets[level][0]
-                (r2,v2) = self.buckets[level][1]
-                self.buckets[level] = self.buckets[level][2:]
+            bucket = self.buckets[level]
+            if self.parent.conjunctOrder == "many" and len(bucket) > 2:
+                tlist = [bucket.pop() for i in range(len(bucket))]
+                nroot, validation = self.parent.conjunctManyTerms(tlist)
+                self.parent.intermediateClauses.append(validation)
+                self.placeInBucket(nroot, validation)
+            while len(bucket) > 1:
+                (r1,v1) = bucket.pop()
+                (r2,v2) = bucket.pop()
+                if len(bucket) == 0 and level > 0:
+                    # Final conjunction.  Quantify bucket variable while conjoining
+                    nroot, validation = self.parent.conjunctQuantifyTerms(r1, v1, r2, v2, id)
+                    self.parent.intermediateClauses.append(validation)
+                    if self.parent.verbLevel >= 4:
+                        print("BREDUCE: Processed bucket #%d.  Root = %s" % (level, nroot.label()))
+                    self.placeInBucket(nroot, validation)
+                    break
                 nroot,validation = self.parent.conjunctTerms(r1, v1, r2, v2)
+                self.parent.intermediateClauses.append(validation)
                 self.placeInBucket(nroot, validation)
-            if len(self.buckets[level]) == 1:
-                root, validation = self.buckets[level][0]
+            if len(bucket) == 1:
+                root, validation = bucket.pop()
                 if level == 0:
                     return (root, validation)
                 nroot, nvalidation = self.parent.quantifyRoot(root, validation, id)
+                self.parent.intermediateClauses.append(nvalidation)
                 if self.parent.verbLevel >= 4:
                     print("BREDUCE: Processed bucket #%d.  Root = %s" % (level, root.label()))
                 self.placeInBucket(nroot, nvalidation)
@@ -373,7 +1025,7 @@ class BucketReducer:
         # Each tbdd is pair (root, validation)
         # Indexed by variable level
         # Special bucket 0 for terms that depend only on external variables
-        self.buckets = { 0 : []}
+        self.buckets = { 0 : self.newBucket() }
         internalIdSet = set([])
         for hid in hlist:
             iclause = self.parent.creader.clauses[hid-1]
@@ -385,7 +1037,7 @@ class BucketReducer:
                     internalIdSet.add(id)
                     bddVar = self.parent.varMap[id]
                     level = bddVar.level
-                    self.buckets[level] = []
+                    self.buckets[level] = self.newBucket()
             self.placeInBucket(root, validation)
         (root, validation) = self.reduce()
         return (root, validation)
@@ -466,6 +1118,7 @@ class SdpTerm:
             comment = "Tail merge.  Head = %s. Literal = %d" % (str(self.head), self.literal)
             antecedents = [self.validation, other.validation, jclause]
             validation = self.parent.manager.prover.createClause(vclause, antecedents, comment)
+            self.parent.intermediateClauses.append(validation)
         return SdpTerm(self.parent, self.head, self.literal, nroot, validation)
         
     # Combine two SDP terms have matching heads and opposite literals of data variable
@@ -496,6 +1149,11 @@ class SdpTerm:
         hints["OPL"] = (evalidation,  resolver.cleanClause(list(nhead) + [ ivar, echild.id]))
         comment = "Join of terms %s and %s with root variable %d" % (str(self), str(other), ivar)
         validation = self.parent.manager.vresolver.run(vclause, ivar, hints, comment)
+        if validation < 0:
+            # Proof required intermediate clause
+            validation = -validation
+            self.parent.intermediateClauses.append(validation-1)
+        self.parent.intermediateClauses.append(validation)
         return SdpTerm(self.parent, nhead, nliteral, ntail, validation)
 
     # Transfer literal from head to tail
@@ -512,6 +1170,7 @@ class SdpTerm:
         vclause = list(self.head) + [ntail.id]
         comment = "Transfer literal %d from head to tail for term %s" % (self.literal, str(self))
         validation = self.parent.manager.prover.createClause(vclause, antecedents, comment)
+        self.parent.intermediateClauses.append(validation)
         return SdpTerm(self.parent, nhead, nliteral, ntail, validation)
 
     # Combine head of one term with tail of other
@@ -536,42 +1195,89 @@ class SdpTerm:
             if ntail == self.parent.manager.leaf1:
                 return None
             vclause = list(rhead) + [ntail.id]
-            sid = self.parent.manager.justifyImply(self.tail, ntail)
-            oid = self.parent.manager.justifyImply(other.tail, ntail)
-            antecedents = [sid, oid, self.validation, other.validation]
+            (sok, sid) = self.parent.manager.justifyImply(self.tail, ntail)
+            (ook, oid) = self.parent.manager.justifyImply(other.tail, ntail)
+            antecedents = resolver.cleanHint([sid, oid, self.validation, other.validation])
         comment = "Resolve terms terms %s and %s" % (str(self), str(other))
         validation = self.parent.manager.prover.createClause(vclause, antecedents, comment)
+        self.parent.intermediateClauses.append(validation)
         return SdpTerm(self.parent, nhead, nliteral, ntail, validation)
 
+# Result of SDP reduction for a block of input clauses used as hints by several input steps.
+# Buckets above the stopping level have been processed, quantifying the extension variables in them.
+# The terms can be reused by a later input step having all of the clauses as hints,
+# provided the input variables are the same and no quantified variable occurs in the other hints
+class SdpBlock:
+    clauseSet = frozenset([])
+    variableSet = frozenset([])
+    dataSet = frozenset([])
+    quantifiedSet = frozenset([])
+    # Remaining terms, as tuples (head, literal, tail, validation)
+    terms = []
+    # Last input step that can use the block
+    lastUse = 0
+    # Numbers of clauses and apply operations required to construct the block, including any block it extends
+    clauseCost = 0
+    applyCost = 0
+
+    def __init__(self, clauseSet, variableSet, dataSet, quantifiedSet, terms, lastUse, clauseCost, applyCost):
+        self.clauseSet = clauseSet
+        self.variableSet = variableSet
+        self.dataSet = dataSet
+        self.quantifiedSet = quantifiedSet
+        self.terms = terms
+        self.lastUse = lastUse
+        self.clauseCost = clauseCost
+        self.applyCost = applyCost
+
 class SdpReducer:
 
     parent = None
+    # Step being checked
+    pid = 0
     buckets = { 0 : [] }
+    # Heap of negated levels of nonempty buckets
+    levelHeap = []
 
-    def __init__(self, parent):
+    def __init__(self, parent, pid = 0):
         self.parent = parent
+        self.pid = pid
         self.buckets = { 0 :[] }
+        self.levelHeap = [0]
 
+    def newQueue(self):
+        return TermQueue(self.parent.manager, self.parent.conjunctOrder)
         
     def placeInBucket(self, lterm):
         var = abs(lterm.literal)
         level = self.parent.idToLevel(var)
         if level not in self.buckets:
             self.buckets[level] = [lterm]
+            heapq.heappush(self.levelHeap, -level)
         else:
             self.buckets[level].append(lterm)
         if self.parent.verbLevel >= 4:
             print("   Placed term %s in bucket %d (var %d)" % (str(lterm), level, var))
 
-    def sdpBucketReduce(self, inputIdSet):
-        # Process from largest level to smallest
-        bucketItems = []
-        while len(self.buckets) > 0:
-            level = max(self.buckets.keys())
+    def placeClauses(self, hlist):
+        for hid in hlist:
+            iclause = self.parent.creader.clauses[hid-1]
+            lterm = SdpTerm(self.parent).fromInputClause(iclause, hid)
+            self.placeInBucket(lterm)
+
+    def placeBlock(self, block):
+        for (head, literal, tail, validation) in block.terms:
+            self.placeInBucket(SdpTerm(self.parent, head, literal, tail, validation))
+
+    # Process buckets from largest level down to stopLevel, leaving those at or below it.
+    # Return number of buckets processed
+    def processBuckets(self, inputIdSet, stopLevel):
+        count = 0
+        while -self.levelHeap[0] > stopLevel:
+            count += 1
+            level = -heapq.heappop(self.levelHeap)
             bucketItems = self.buckets[level]
             del self.buckets[level]
-            if level == 0:
-                break
             ivar = self.parent.levelToId(level)
             if self.parent.verbLevel >= 3:
                 tstring = "I" if ivar in inputIdSet else "Z"
@@ -584,21 +1290,22 @@ class SdpReducer:
             headDict = {}
             for lt in bucketItems:
                 if lt.head not in headDict:
-                    headDict[lt.head] = [[],[]]
+                    headDict[lt.head] = [self.newQueue(), self.newQueue()]
                 phase = 1 if lt.literal > 0 else 0 
-                headDict[lt.head][phase].append(lt)
+                headDict[lt.head][phase].push(lt.tail, lt)
             for head in headDict:
                 # Tail reduction to have at most one term with each phase
                 for phase in range(2):
-                    while len(headDict[head][phase]) > 1:
+                    queue = headDict[head][phase]
+                    while len(queue) > 1:
                         # Merge
-                        lt1 = headDict[head][phase][0]
-                        lt2 = headDict[head][phase][1]
-                        headDict[head][phase] = headDict[head][phase][2:]
+                        lt1 = queue.pop()
+                        lt2 = queue.pop()
                         nlt = lt1.tailMerge(lt2)
-                        headDict[head][phase].append(nlt)
+                        queue.push(nlt.tail, nlt)
                         if self.parent.verbLevel >= 5:
                             print("   Tail merged %s and %s to get %s" % (str(lt1), str(lt2), str(nlt)))
+                    headDict[head][phase] = [queue.pop()] if len(queue) == 1 else []
 
             # Process by head.  At most two terms
             for head in headDict:
@@ -624,35 +1331,269 @@ class SdpReducer:
                         if self.parent.verbLevel >= 4:
                             print("  Generated resolution term %s" % str(nterm))
                         self.placeInBucket(nterm)                    
+        return count
 
+    def sdpBucketReduce(self, inputIdSet):
+        # Process from largest level to smallest
+        self.processBuckets(inputIdSet, 0)
+        bucketItems = self.buckets[0]
+        del self.buckets[0]
         # Process top-level bucket
-        while len(bucketItems) > 1:
-            lt1 = bucketItems[0]
-            lt2 = bucketItems[1]
-            bucketItems = bucketItems[2:]
+        queue = self.newQueue()
+        for lt in bucketItems:
+            queue.push(lt.tail, lt)
+        while len(queue) > 1:
+            lt1 = queue.pop()
+            lt2 = queue.pop()
             nterm = lt1.tailMerge(lt2)
-            bucketItems.append(nterm)
-        if len(bucketItems) < 1:
+            queue.push(nterm.tail, nterm)
+        if len(queue) < 1:
             raise SdpException("SPD reduction failed.  Bucket 0 empty")
-        rt = bucketItems[0]
+        rt = queue.pop()
         return rt.tail, rt.validation
 
+    # Find largest cached block that can be used with these hints
+    def findBlock(self, hset, inputIdSet):
+        best = None
+        for block in self.parent.sdpBlocks:
+            if best is not None and len(block.clauseSet) <= len(best.clauseSet):
+                continue
+            if not block.clauseSet <= hset:
+                continue
+            if block.variableSet & inputIdSet != block.dataSet:
+                continue
+            ok = True
+            for hid in hset - block.clauseSet:
+                for lit in self.parent.creader.clauses[hid-1]:
+                    if abs(lit) in block.quantifiedSet:
+                        ok = False
+                if not ok:
+                    break
+            if ok:
+                best = block
+        return best
+
+    # Process the terms placed so far, down to the highest level of an extension variable
+    # that also occurs in other hints, or in clauses first used by later steps.
+    # Record the remaining terms as a new block.
+    # Its cost is the work done since startCounts, plus that of the extended block, if any
+    def reduceBlock(self, clauseSet, hset, inputIdSet, startCounts, extended):
+        clauses = self.parent.creader.clauses
+        variableSet = set([abs(lit) for hid in clauseSet for lit in clauses[hid-1]])
+        otherSet = set([abs(lit) for hid in hset - clauseSet for lit in clauses[hid-1]])
+        boundarySet = [id for id in variableSet if id not in inputIdSet and (id in otherSet or self.parent.variableFirstUses.get(id, 0) > self.pid)]
+        stopLevel = max([0] + [self.parent.idToLevel(id) for id in boundarySet])
+        if self.processBuckets(inputIdSet, stopLevel) == 0:
+            return
+        terms = [(lt.head, lt.literal, lt.tail, lt.validation) for level in sorted(self.buckets.keys()) for lt in self.buckets[level]]
+        quantifiedSet = frozenset([id for id in variableSet if id not in inputIdSet and self.parent.idToLevel(id) > stopLevel])
+        lastUse = min([self.parent.clauseLastUses[hid] for hid in clauseSet])
+        (clauseCount, applyCount) = self.parent.workCounts()
+        clauseCost = clauseCount - startCounts[0]
+        applyCost = applyCount - startCounts[1]
+        if extended is not None:
+            clauseCost += extended.clauseCost
+            applyCost += extended.applyCost
+        block = SdpBlock(clauseSet, frozenset(variableSet), frozenset(variableSet & inputIdSet), quantifiedSet, terms, lastUse,
+                         clauseCost, applyCost)
+        self.parent.addSdpBlock(block)
+        if self.parent.verbLevel >= 3:
+            print("PBIP: Step #%d.  Cached SDP block of %d clauses.  Stopped at level %d with %d terms" % (self.pid, len(clauseSet), stopLevel, len(terms)))
+
     def performReduction(self, hlist, inputIdSet):
         # Set up buckets containing SDP terms
         # Special bucket 0 for terms that depend only on external variables
         self.buckets = { 0 : []}
-        for hid in hlist:
-            iclause = self.parent.creader.clauses[hid-1]
-            lterm = SdpTerm(self.parent).fromInputClause(iclause, hid)
-            self.placeInBucket(lterm)
+        self.levelHeap = [0]
+        lastUses = self.parent.clauseLastUses
+        if lastUses is None:
+            self.placeClauses(hlist)
+            return self.sdpBucketReduce(inputIdSet)
+        # Reuse cached block, and cache the reduction of the hints used by later steps
+        hset = set(hlist)
+        block = self.findBlock(hset, inputIdSet)
+        if block is not None:
+            self.parent.recordReuse(block.clauseCost, block.applyCost)
+            self.parent.sdpBlockHits += 1
+            hlist = [hid for hid in hlist if hid not in block.clauseSet]
+        shared = [hid for hid in hlist if lastUses.get(hid, 0) > self.pid]
+        others = [hid for hid in hlist if lastUses.get(hid, 0) <= self.pid]
+        # Extend the cached block when it remains usable after this step
+        extend = block is not None and block.lastUse > self.pid
+        if extend:
+            self.placeBlock(block)
+        if len(shared) > 0:
+            startCounts = self.parent.workCounts()
+            self.placeClauses(shared)
+            clauseSet = frozenset(shared) | block.clauseSet if extend else frozenset(shared)
+            self.reduceBlock(clauseSet, hset, inputIdSet, startCounts, block if extend else None)
+        if block is not None and not extend:
+            self.placeBlock(block)
+        self.placeClauses(others)
         (root, validation) = self.sdpBucketReduce(inputIdSet)
+        if validation in self.parent.sdpBlockHolds:
+            # Step needs its own copy of clause held by cached block
+            comment = "Copy of SDP block clause #%d" % validation
+            validation = self.parent.manager.prover.createClause([root.id], [validation], comment)
         return (root, validation)
 
 
+# Record statistics for each PBIP step.
+# Written as CSV or, when file name has suffix .jsonl, as one JSON object per line
+class StepProfiler:
+    fields = ["step", "command", "seconds", "buildSeconds", "reduceSeconds", "implySeconds",
+              "applyCalls", "newNodes", "clauses", "cacheHits", "gcCount", "gcSeconds", "nodesRemoved", "bddSize", "liveNodes"]
+    # Phases timed separately within each step
+    phases = ["build", "reduce", "imply"]
+    # Number of slowest steps to report
+    topCount = 10
+    pbip = None
+    outfile = None
+    jsonLines = False
+    # Record for current step
+    record = None
+    stepStart = None
+    # Counter values at start of step
+    startCounts = None
+    # Min-heap of (seconds, step, record) for slowest steps
+    slowest = []
+    fname = ""
+    # Length of file when saved to a checkpoint
+    fileOffset = 0
+
+    def __init__(self, pbip, fname):
+        self.pbip = pbip
+        self.fname = fname
+        try:
+            self.outfile = open(fname, 'w')
+        except Exception:
+            raise PbipException("", "Couldn't open profile file '%s'" % fname)
+        self.jsonLines = fname.split('.')[-1] == "jsonl"
+        if not self.jsonLines:
+            self.outfile.write(",".join(self.fields) + '\n')
+        self.record = None
+        self.slowest = []
+
+    def now(self):
+        return datetime.datetime.now()
+
+    def elapsed(self, start):
+        delta = datetime.datetime.now() - start
+        return delta.seconds + 1e-6 * delta.microseconds
+
+    def counts(self):
+        manager = self.pbip.manager
+        hits = sum([table.hits for table in manager.operationCache.values()])
+        return { "applyCalls" : manager.applyCount, "newNodes" : manager.nodeCount, "clauses" : self.pbip.prover.clauseCount,
+                 "cacheHits" : hits, "gcCount" : manager.gcCount, "gcSeconds" : manager.gcSeconds, "nodesRemoved" : manager.nodesRemoved }
+
+    def startStep(self, command):
+        self.record = { "command" : command }
+        for phase in self.phases:
+            self.record[phase + "Seconds"] = 0.0
+        self.startCounts = self.counts()
+        self.stepStart = self.now()
+
+    def addTime(self, phase, start):
+        self.record[phase + "Seconds"] += self.elapsed(start)
+
+    def finishStep(self, pid, root):
+        record = self.record
+        record["step"] = pid
+        record["seconds"] = self.elapsed(self.stepStart)
+        for key, value in self.counts().items():
+            record[key] = value - self.startCounts[key]
+        record["bddSize"] = 0 if root is None else self.pbip.manager.getSize(root)
+        record["liveNodes"] = len(self.pbip.manager.uniqueTable)
+        for key in ["seconds", "gcSeconds"] + [phase + "Seconds" for phase in self.phases]:
+            record[key] = round(record[key], 6)
+        if self.jsonLines:
+            self.outfile.write(json.dumps({ key : record[key] for key in self.fields }) + '\n')
+        else:
+            self.outfile.write(",".join([str(record[key]) for key in self.fields]) + '\n')
+        entry = (record["seconds"], pid, record)
+        if len(self.slowest) < self.topCount:
+            heapq.heappush(self.slowest, entry)
+        elif entry > self.slowest[0]:
+            heapq.heapreplace(self.slowest, entry)
+        self.record = None
+
+    def summarize(self):
+        print("PBIP Slowest steps:")
+        for (seconds, pid, record) in sorted(self.slowest, reverse = True):
+            print("  Step #%d (%s): %.3f seconds (build %.3f, reduce %.3f, imply %.3f, gc %.3f).  %d applies, %d new nodes, %d clauses, BDD size %d" %
+                  (pid, record["command"], seconds, record["buildSeconds"], record["reduceSeconds"], record["implySeconds"], record["gcSeconds"],
+                   record["applyCalls"], record["newNodes"], record["clauses"], record["bddSize"]))
+
+    def __getstate__(self):
+        self.outfile.flush()
+        self.fileOffset = self.outfile.tell()
+        state = self.__dict__.copy()
+        state["outfile"] = None
+        return state
+
+    # Reopen file after loading from checkpoint, discarding records for later steps
+    def resume(self):
+        try:
+            self.outfile = open(self.fname, 'r+')
+        except Exception:
+            raise PbipException("", "Couldn't reopen profile file '%s'" % self.fname)
+        self.outfile.seek(self.fileOffset)
+        self.outfile.truncate()
+
+    def close(self):
+        self.outfile.close()
+
+# Group of input steps checked by a worker process, with its own BDD manager and proof fragment.
+# Input steps depend only on their hint clauses, and so the steps can be checked in any order
+class Shard:
+    sid = 0
+    pids = []
+    future = None
+    # Once spliced into proof: mapping from step to pair (validation clause, root node id),
+    # mapping from node id to tuple (level, high, low, clause base), with leaf children given as 0 or 1,
+    # and set of clauses still live in fragment.  Ids are those in the combined proof
+    results = None
+    nodes = None
+    liveClauses = set([])
+    # Mapping from node id to handle for the nodes entered into the main manager
+    adopted = {}
+    # Number of results not yet used
+    remaining = 0
+
+    def __init__(self, sid, pids):
+        self.sid = sid
+        self.pids = pids
+        self.future = None
+        self.results = None
+        self.nodes = None
+        self.liveClauses = set([])
+        self.adopted = {}
+        self.remaining = 0
+
+# Each worker process holds a Pbip for checking shards
+shardPbip = None
+
+def initShardWorker(settings):
+    global shardPbip
+    # Main process may have its own handler.  Workers must stop when terminated
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    shardPbip = Pbip(settings["cnfName"], settings["pbipName"], "", 0, settings["bddOnly"], False, settings["sdpReduce"], settings["cacheLimits"],
+                     indexed = True, conjunctOrder = settings["conjunctOrder"], gcMode = settings["gcMode"], binaryLrat = True,
+                     clauseCache = settings["clauseCache"])
+    shardPbip.varOrder = settings["varOrder"]
+    shardPbip.isShardWorker = True
+
+def checkShard(pids, fragmentName):
+    return shardPbip.checkShard(pids, fragmentName)
+
 class Pbip:
     verbLevel = 1
+    cnfName = ""
     bddOnly = False
     sdpReduce = False
+    # Order for conjoining terms during bucket reduction.  See conjunctOrders
+    conjunctOrder = "fifo"
     valid = True
     creader = None
     preader = None
@@ -673,6 +1614,69 @@ class Pbip:
     maxBddSize = 0
     maxConstant = 0
     lastClauseCount = 0
+    # Clauses generated while processing current step.
+    # Can be deleted once the step has been justified
+    intermediateClauses = []
+    # Should validation clauses for each step be deleted after the step's last use?
+    deleteSteps = False
+    # Should BDD for each step be released after the step's last use?
+    liveness = False
+    # BDD roots released since last GC
+    droppedRoots = []
+    # List indexed by step number giving last step to use it as hint (0 = unused)
+    lastUses = []
+    # Mapping from step number to list of steps having it as their last use
+    expiringSteps = {}
+    inputClauseCount = 0
+    deletedClauseCount = 0
+    # Mapping from normalized constraint list to step whose root represents it
+    internTable = {}
+    internHitCount = 0
+    # Validation clauses held by multiple steps.  Maps clause Id to number of additional holders
+    sharedValidations = {}
+    reusedValidationCount = 0
+    # Optional recorder of per-step statistics
+    profiler = None
+    # Cache of BDD representations of input clauses used as hints by multiple input steps.
+    # Maps clause Id to pair (root, validation)
+    clauseBddCache = {}
+    # Mapping from clause Id to pair (clauses, apply operations) avoided by reusing its cached BDD
+    clauseBddCosts = {}
+    # Mapping from clause Id to last input step using it as a hint.  None when not caching
+    clauseLastUses = None
+    # Mapping from step number to list of clauses having it as their last use
+    expiringClauses = {}
+    clauseCacheHits = 0
+    # Cached SDP reductions of blocks of input clauses used as hints by multiple input steps
+    sdpBlocks = []
+    # Mapping from clause Id to number of cached blocks having it as the validation of a term
+    sdpBlockHolds = {}
+    sdpBlockHits = 0
+    # Clauses and apply operations avoided by reusing cached input clause BDDs and SDP blocks
+    reuseClausesSaved = 0
+    reuseAppliesSaved = 0
+    # Mapping from variable to last input step that is the first to use a clause containing it as a hint.
+    # SDP blocks leave such variables unquantified, so that later steps can use the blocks
+    variableFirstUses = {}
+    # Parallel checking of input steps by pool of worker processes
+    pool = None
+    shards = []
+    # Mapping from step to index of its shard
+    shardSteps = {}
+    shardDirectory = None
+    # Maximum number of input steps per shard.  Smaller shards are used to give each worker several of them
+    shardSize = 50
+    shardsPerJob = 4
+    # Is this Pbip checking shards for another one?
+    isShardWorker = False
+    shardImportCount = 0
+    # Time spent waiting for workers to finish shards
+    shardWaitSeconds = 0.0
+    # Checkpointing.  State is saved to file at the end of a step once interval (in seconds) has elapsed
+    checkpointName = None
+    checkpointInterval = 600.0
+    lastCheckpoint = None
+    checkpointCount = 0
 
     # Enable use as constraint system
     prover = None
@@ -681,31 +1685,101 @@ class Pbip:
     varMap = {}
     levelMap = {}
     idMap = {}
+    # Variables, ordered by level
+    varOrder = []
+    cacheLimits = None
+    gcMode = "marksweep"
 
-    def __init__(self, cnfName, pbipName, lratName, verbLevel, bddOnly, reorder, sdpReduce):
+    def __init__(self, cnfName, pbipName, lratName, verbLevel, bddOnly, reorder, sdpReduce, cacheLimits = None, deleteSteps = False, liveness = False, indexed = False, conjunctOrder = "fifo", gcMode = "marksweep", binaryLrat = False, profileName = None, clauseCache = False):
         self.verbLevel = verbLevel
         self.bddOnly = bddOnly
         self.sdpReduce = sdpReduce
+        self.conjunctOrder = conjunctOrder
+        self.deleteSteps = deleteSteps
+        self.liveness = liveness
+        self.droppedRoots = []
         self.valid = True
         self.creader = solver.CnfReader(cnfName, verbLevel)
-        self.preader = PbipReader(pbipName, verbLevel)
+        self.preader = PbipReader(pbipName, verbLevel, indexed)
         self.constraintList = []
         self.tbddList = []
+        self.tclauseList = []
         lratName = None if lratName == "" else lratName
-        self.prover = solver.Prover(fname=lratName, writer = solver.StdOutWriter(), verbLevel = verbLevel, doLrat = True)
-        # Print input clauses
+        self.prover = solver.Prover(fname=lratName, writer = solver.StdOutWriter(), verbLevel = verbLevel, doLrat = True, doBinary = binaryLrat)
+        self.profiler = None if profileName is None else StepProfiler(self, profileName)
+        self.cnfName = cnfName
+        self.pool = None
+        self.shards = []
+        self.shardSteps = {}
+        self.shardImportCount = 0
+        self.shardWaitSeconds = 0.0
+        self.clauseBddCache = {}
+        self.clauseBddCosts = {}
+        self.clauseLastUses = None
+        self.variableFirstUses = {}
+        if clauseCache:
+            (firstUses, self.clauseLastUses) = self.preader.findClauseUses()
+            if sdpReduce:
+                for hid, pid in firstUses.items():
+                    for lit in self.creader.clauses[hid-1]:
+                        if pid > self.variableFirstUses.get(abs(lit), 0):
+                            self.variableFirstUses[abs(lit)] = pid
+        self.expiringClauses = {}
+        self.clauseCacheHits = 0
+        self.sdpBlocks = []
+        self.sdpBlockHolds = {}
+        self.sdpBlockHits = 0
+        self.reuseClausesSaved = 0
+        self.reuseAppliesSaved = 0
+        self.addInputClauses()
+        self.intermediateClauses = []
+        self.deletedClauseCount = 0
+        self.internTable = {}
+        self.internHitCount = 0
+        self.sharedValidations = {}
+        self.reusedValidationCount = 0
+        self.lastUses = []
+        self.expiringSteps = {}
+        if self.deleteSteps or self.liveness:
+            self.lastUses = self.preader.findLastUses()
+            # Final step must be retained
+            for sid in range(1, len(self.lastUses)):
+                # Unused steps expire immediately
+                lastUse = self.lastUses[sid-1]
+                if lastUse == 0:
+                    lastUse = sid
+                if lastUse in self.expiringSteps:
+                    self.expiringSteps[lastUse].append(sid)
+                else:
+                    self.expiringSteps[lastUse] = [sid]
+        inputCount = self.preader.findMaximum()
+        self.varOrder = list(range(1, self.creader.nvar+1))
+        if reorder:
+            self.varOrder = self.creader.orderVariables(inputCount)
+        self.cacheLimits = cacheLimits
+        self.gcMode = gcMode
+        self.newManager()
+        self.maxBddSize = 0
+        self.maxConstant = 0
+        self.deltaClauses()
+
+    # Print input clauses
+    def addInputClauses(self):
         clauseCount = 0
         for clause in self.creader.clauses:
             clauseCount += 1
             self.prover.createClause(clause, [], "Input clause %d" % clauseCount, isInput = True)
         self.prover.inputDone()
-        inputCount = self.preader.findMaximum()
-        varOrder = list(range(1, self.creader.nvar+1))
-        if reorder:
-            varOrder = self.creader.orderVariables(inputCount)
-        self.manager = bdd.Manager(prover = self.prover, rootGenerator = self.rootGenerator, nextNodeId = self.creader.nvar+1, verbLevel = verbLevel)
+        self.inputClauseCount = clauseCount
+
+    # Create BDD manager with variables in order given by varOrder
+    def newManager(self):
+        self.manager = bdd.Manager(prover = self.prover, rootGenerator = self.rootGenerator, nextNodeId = self.creader.nvar+1, verbLevel = self.verbLevel,
+                                   cacheLimits = self.cacheLimits, gcMode = self.gcMode)
+        if self.liveness:
+            self.manager.deadRootGenerator = self.deadRootGenerator
         self.litMap = {}
-        for id in varOrder:
+        for id in self.varOrder:
             var = self.manager.newVariable(name = "V%d" % id, id = id)
             self.litMap[ id] = None
             self.litMap[-id] = None
@@ -713,9 +1787,6 @@ class Pbip:
         self.levelMap = { var.id : var.level for var in self.manager.variables }
         self.idMap = { var.level : var.id for var in self.manager.variables }
         self.idMap[0] = 0
-        self.maxBddSize = 0
-        self.maxConstant = 0
-        self.deltaClauses()
 
     def idToLevel(self, id):
         if id == 0:
@@ -739,10 +1810,70 @@ class Pbip:
         self.lastClauseCount = self.prover.clauseCount
         return self.lastClauseCount - occ
 
+    # Delete clauses from proof.  Input clauses are retained,
+    # since they can be referenced by multiple input steps
+    def deleteClauses(self, clauseList):
+        clauseList = [cid for cid in clauseList if cid is not None and cid != resolver.tautologyId and cid > self.inputClauseCount]
+        if len(clauseList) > 0:
+            self.prover.deleteClauses(clauseList)
+            self.deletedClauseCount += len(clauseList)
+
+    # Delete intermediate clauses generated while processing current step,
+    # other than those in keepList
+    def releaseIntermediates(self, keepList = []):
+        keepSet = set(keepList)
+        clauseSet = set([])
+        clauseList = []
+        for cid in self.intermediateClauses:
+            if cid not in keepSet and cid not in clauseSet:
+                clauseSet.add(cid)
+                clauseList.append(cid)
+        self.intermediateClauses = []
+        self.deleteClauses(clauseList)
+
+    # Remove clauses still held by other steps from list of candidates for deletion
+    def unshareClauses(self, clauseList):
+        result = []
+        for cid in clauseList:
+            if self.sharedValidations.get(cid, 0) > 0:
+                self.sharedValidations[cid] -= 1
+            else:
+                result.append(cid)
+        return result
+
+    # Find root of earlier step having identical constraints.
+    # Return None if there is none, or it has been released
+    def findInterned(self, ckey):
+        if ckey not in self.internTable:
+            return None
+        sid = self.internTable[ckey]
+        return self.tbddList[sid-1][0]
+
+    # Release validation clauses and/or BDD for step that will not be used again
+    # Return number of BDD nodes that may have become dead
+    def releaseStep(self, sid):
+        (root, validation) = self.tbddList[sid-1]
+        (clause, cid) = self.tclauseList[sid-1]
+        deadCount = 0
+        if self.deleteSteps:
+            clauseList = [validation] if cid == validation else [validation, cid]
+            self.deleteClauses(self.unshareClauses(clauseList))
+            validation = None
+            cid = None
+        if self.liveness and root is not None:
+            deadCount = self.manager.getSize(root)
+            self.droppedRoots.append(root)
+            root = None
+        self.tbddList[sid-1] = (root, validation)
+        self.tclauseList[sid-1] = (clause, cid)
+        return deadCount
+
     def doStep(self):
         command, clist, hlist, comlist = self.preader.readLine()
         if command == '':
             return True
+        if self.profiler is not None:
+            self.profiler.startStep(command)
         # Special handling of input constraints represented by single clauses
         tclause = None
         tcid = None
@@ -761,22 +1892,34 @@ class Pbip:
                 tclause = None
         self.tclauseList.append((tclause, tcid))
         for con in clist:
-            self.maxConstant = max(self.maxConstant, abs(con.coefficientNormalizedCval()))
+            self.maxConstant = max(self.maxConstant, abs(con.coefficientNormalizedConstant()))
+        ckey = None
+        nroot = None
+        ncid = None
         if not clauseOnly:
-            for con in clist:
-                con.buildBdd(self)
+            ckey = tuple([con.internKey() for con in clist])
+            nroot = self.findInterned(ckey)
+            if nroot is not None:
+                self.internHitCount += 1
+            elif command == 'i' and len(self.constraintList)+1 in self.shardSteps:
+                nroot, ncid = self.importShardStep(len(self.constraintList)+1)
+            if nroot is None:
+                start = self.profileStart()
+                for con in clist:
+                    con.buildBdd(self)
+                if len(clist) == 2:
+                    nroot = self.manager.applyAnd(clist[0].root, clist[1].root)
+                else:
+                    nroot = clist[0].root
+                self.profileTime("build", start)
         self.constraintList.append(clist)
-        if len(clist) == 2:
-            nroot = self.manager.applyAnd(nclist[0].root, nclist[1].root)
-        elif clauseOnly:
-            nroot = None
-        else:
-            nroot = clist[0].root
-        self.tbddList.append((nroot,None))
+        self.tbddList.append((nroot,ncid))
         if nroot is not None:
             self.maxBddSize = max(self.maxBddSize, self.manager.getSize(nroot))
         startCount = len(self.manager.uniqueTable)
         pid = len(self.constraintList)
+        if ckey is not None:
+            self.internTable[ckey] = pid
         done = False
         for com in comlist:
             self.prover.comment(com)
@@ -792,9 +1935,28 @@ class Pbip:
         else:
             raise PbipException("", "Unexpected command '%s'" % command)
         deltaCount = len(self.manager.uniqueTable) - startCount
+        if pid in self.expiringSteps:
+            for sid in self.expiringSteps[pid]:
+                if sid != pid or not done:
+                    deltaCount += self.releaseStep(sid)
+        if pid in self.expiringClauses:
+            for id in self.expiringClauses.pop(pid):
+                deltaCount += self.evictClauseBdd(id)
+        for block in [block for block in self.sdpBlocks if block.lastUse <= pid]:
+            deltaCount += self.evictSdpBlock(block)
         if deltaCount > 0:
-            self.manager.checkGC(deltaCount)
+            self.deleteClauses(self.manager.checkGC(deltaCount))
+        if self.profiler is not None:
+            self.profiler.finishStep(pid, nroot)
         return done
+
+    # Timing of step phases when profiling
+    def profileStart(self):
+        return None if self.profiler is None else self.profiler.now()
+
+    def profileTime(self, phase, start):
+        if start is not None:
+            self.profiler.addTime(phase, start)
         
     def needTbdd(self, pid):
         (root, validation) = self.tbddList[pid-1]
@@ -818,6 +1980,8 @@ class Pbip:
             oroot, ovalidation = self.manager.constructOr(clause, self.getLiteralBdd)
             comment = "Generate validated clause from TBDD %s" % root.label()
             cvalidation = self.manager.prover.createClause(clause, [validation, ovalidation], comment)
+            if ovalidation not in oroot.clauseIds():
+                self.deleteClauses([ovalidation])
             self.tclauseList[pid-1] = (clause, cvalidation) 
         else:
             raise PbipException("Can't generate validated clausal representation of constraint #%d" % pid)
@@ -841,6 +2005,31 @@ class Pbip:
             validation = self.manager.prover.createClause([nroot.id], antecedents, comment)
         return nroot, validation
 
+    # Conjoin list of terms (root, validation) with single operation
+    def conjunctManyTerms(self, tlist):
+        rootList = [r for (r,v) in tlist]
+        nroot, implication = self.manager.applyAndManyJustify(rootList)
+        antecedents = [v for (r,v) in tlist]
+        if implication != resolver.tautologyId:
+            antecedents += [implication]
+        if nroot == self.manager.leaf0:
+            comment = "Validation of empty clause from %s" % (" & ".join([r.label() for r in rootList]))
+        else:
+            comment = "Validation of %s --> %s" % (" & ".join([r.label() for r in rootList]), nroot.label())
+        validation = self.manager.prover.createClause([nroot.id], antecedents, comment)
+        return nroot, validation
+
+    # Conjoin terms and existentially quantify variable in single operation
+    def conjunctQuantifyTerms(self, r1, v1, r2, v2, id):
+        vfun = self.getLiteralBdd(id)
+        nroot, implication = self.manager.andExistsJustify(r1, r2, vfun)
+        antecedents = [v1, v2]
+        if implication != resolver.tautologyId:
+            antecedents += [implication]
+        comment = "Quantification of %s & %s by variable %s --> node %s" % (r1.label(), r2.label(), str(vfun.variable), nroot.label())
+        validation = self.manager.prover.createClause([nroot.id], antecedents, comment)
+        return nroot, validation
+
     def quantifyRoot(self, root, validation, id):
         antecedents = [validation]
         vfun = self.getLiteralBdd(id)
@@ -854,14 +2043,70 @@ class Pbip:
         validation = self.manager.prover.createClause([nroot.id], antecedents, comment)
         return nroot, validation
 
+    # Validation clauses for BDDs held in the cache are deleted upon eviction.
+    # Others are intermediate clauses for the current step
     def getInputClauseBdd(self, id):
+        if id in self.clauseBddCache:
+            self.clauseCacheHits += 1
+            self.recordReuse(*self.clauseBddCosts[id])
+            return self.clauseBddCache[id]
         iclause = self.creader.clauses[id-1]
         clause = [self.getLiteralBdd(lit) for lit in iclause]
+        applyCount = self.manager.applyCount
         root, validation = self.manager.constructClauseBdd(id, clause)
+        if self.clauseLastUses is not None and id in self.clauseLastUses:
+            self.clauseBddCache[id] = (root, validation)
+            # The cache keeps the nodes live, and so rebuilding would only generate the validation clause
+            self.clauseBddCosts[id] = (1, self.manager.applyCount - applyCount)
+            lastUse = self.clauseLastUses[id]
+            if lastUse in self.expiringClauses:
+                self.expiringClauses[lastUse].append(id)
+            else:
+                self.expiringClauses[lastUse] = [id]
+        else:
+            self.intermediateClauses.append(validation)
         if self.verbLevel >= 4:
             print("PBIP: Created BDD with root %s, validation %s for input clause #%d" % (root.label(), str(validation), id))
         return (root, validation)
 
+    # Remove BDD for input clause from cache.  Return estimate of number of nodes that become dead
+    def evictClauseBdd(self, id):
+        (root, validation) = self.clauseBddCache.pop(id)
+        del self.clauseBddCosts[id]
+        self.deleteClauses([validation])
+        return self.manager.getSize(root)
+
+    # Numbers of clauses and apply operations generated so far
+    def workCounts(self):
+        return (self.prover.clauseCount, self.manager.applyCount)
+
+    def recordReuse(self, clauseCost, applyCost):
+        self.reuseClausesSaved += clauseCost
+        self.reuseAppliesSaved += applyCost
+
+    # Hold validations of block terms beyond the current step
+    def addSdpBlock(self, block):
+        self.sdpBlocks.append(block)
+        validations = set([])
+        for (head, literal, tail, validation) in block.terms:
+            if validation not in validations:
+                validations.add(validation)
+                self.sdpBlockHolds[validation] = self.sdpBlockHolds.get(validation, 0) + 1
+        self.intermediateClauses = [cid for cid in self.intermediateClauses if cid not in validations]
+
+    # Remove SDP block from cache.  Return estimate of number of nodes that become dead
+    def evictSdpBlock(self, block):
+        self.sdpBlocks.remove(block)
+        validations = set([validation for (head, literal, tail, validation) in block.terms])
+        clauseList = []
+        for validation in sorted(validations):
+            self.sdpBlockHolds[validation] -= 1
+            if self.sdpBlockHolds[validation] == 0:
+                del self.sdpBlockHolds[validation]
+                clauseList.append(validation)
+        self.deleteClauses(clauseList)
+        return sum([self.manager.getSize(tail) for (head, literal, tail, validation) in block.terms])
+
     def doInput(self, pid, hlist):
         clist= self.constraintList[pid-1]
         if not self.bddOnly and len(hlist) == 1 and self.tclauseList[pid-1][0] is not None:
@@ -869,6 +2114,17 @@ class Pbip:
             if self.verbLevel >= 2:
                 print("PBIP: Processed PBIP input #%d.  Represented by input clause #%d" % (pid, hlist[0]))
             return
+        if self.tbddList[pid-1][1] is not None:
+            # Imported from shard along with BDD
+            return
+        if pid in self.shardSteps:
+            root, cid = self.importShardStep(pid, self.tbddList[pid-1][0])
+            if root is not None:
+                self.tbddList[pid-1] = (root, cid)
+                return
+        if self.isShardWorker and self.tbddList[pid-1][0].isLeaf():
+            # Leave for main process
+            return
 
         inputIdSet = set([])
         for con in clist:
@@ -879,10 +2135,12 @@ class Pbip:
         if self.verbLevel >= 2:
             self.prover.comment("Processing PBIP Input #%d.  Input clauses %s" % (pid, str(hlist)))
         if self.sdpReduce:
-            reducer = SdpReducer(self)
+            reducer = SdpReducer(self, pid)
         else:
             reducer = BucketReducer(self)
+        start = self.profileStart()
         (broot, bvalidation) = reducer.performReduction(hlist, inputIdSet)
+        self.profileTime("reduce", start)
 
         root = self.tbddList[pid-1][0]
         if root == broot:
@@ -890,7 +2148,9 @@ class Pbip:
         else:
             if self.verbLevel >= 3:
                 print("PBIP: Testing %s ==> %s" % (str(broot), str(root)))
+            start = self.profileStart()
             (ok, implication) = self.manager.justifyImply(broot, root)
+            self.profileTime("imply", start)
             if not ok:
                 print("PBIP ERROR: Couldn't justify step #%d.  Input not implied" % (pid))
                 self.valid = False
@@ -899,11 +2159,12 @@ class Pbip:
                 antecedents = [cid for cid in [implication, bvalidation] if cid != resolver.tautologyId]
             comment = "Justification of input constraint #%d" % pid
             cid = self.prover.createClause([root.id], antecedents, comment=comment)
+        self.releaseIntermediates([cid])
         self.tbddList[pid-1] = (root, cid)
         
         if self.verbLevel >= 2:
             if root.id == -resolver.tautologyId:
-                print("PBIP: Processed PBIP input #%d.  Empty clause #%d.  Added %d clauses" % (pid, cid.  self.deltaClauses()))
+                print("PBIP: Processed PBIP input #%d.  Empty clause #%d.  Added %d clauses" % (pid, cid, self.deltaClauses()))
                 self.prover.comment("Processed PBIP input #%d.  Constraint root = %s, Generated root = %s Empty clause #%d" % (pid, broot.label(), root.label(), cid))
             else:
                 print("PBIP: Processed PBIP input #%d. Added %d clauses" % (pid, self.deltaClauses()))
@@ -924,32 +2185,38 @@ class Pbip:
                 if hid < 1 or hid > len(self.tbddList):
                     print("PBIP ERROR: Step #%d.  Hint %d out of range" % (pid, hid))
                     hok = False
+        # Hint with identical constraint can supply its validation directly
+        sharedHid = None
+        if hok:
+            for hid in hlist:
+                self.needTbdd(hid)
+                if sharedHid is None and self.tbddList[hid-1][0] == root:
+                    sharedHid = hid
+        cid = None
+        antecedents = []
         if not hok:
             self.valid = False
-        elif len(hlist) == 1:
-            hid = hlist[0]
-            self.needTbdd(hid)
-            (r1,v1) = self.tbddList[hid-1]
-            (ok, implication) = self.manager.justifyImply(r1, root)
-            if not ok:
-                print("PBIP ERROR: Couldn't justify Step #%d.  Not implied by Step #%d" % (pid, hid))
-                self.valid = False
-            else:
-                antecedents = [cid for cid in [v1, implication] if cid != resolver.tautologyId]
+        elif sharedHid is not None:
+            cid = self.tbddList[sharedHid-1][1]
+            self.sharedValidations[cid] = self.sharedValidations.get(cid, 0) + 1
+            self.reusedValidationCount += 1
+            if self.verbLevel >= 3:
+                print("PBIP: Assertion #%d identical to step #%d.  Reusing clause #%d" % (pid, sharedHid, cid))
         else:
-            hid1, hid2 = hlist
-            self.needTbdd(hid1)
-            (r1,v1) = self.tbddList[hid1-1]
-            self.needTbdd(hid2)
-            (r2,v2) = self.tbddList[hid2-1]
-            (ok, implication) = self.manager.applyAndJustifyImply(r1, r2, root)
+            rootList = [self.tbddList[hid-1][0] for hid in hlist]
+            vlist = [self.tbddList[hid-1][1] for hid in hlist]
+            start = self.profileStart()
+            (ok, implication) = self.manager.applyAndManyJustify(rootList, root)
+            self.profileTime("imply", start)
             if not ok:
-                print("PBIP ERROR: Couldn't justify Step #%d.  Not implied by Steps #%d and #%d" % (pid, hid1, hid2))
+                slist = ["#%d" % hid for hid in hlist]
+                print("PBIP ERROR: Couldn't justify Step #%d.  Not implied by Step%s %s" % (pid, "" if len(hlist) == 1 else "s", ", ".join(slist)))
                 self.valid = False
             else:
-                antecedents = [cid for cid in [v1, v2, implication] if cid != resolver.tautologyId]
-        comment = "Justification of assertion #%d" % pid
-        cid = self.prover.createClause([root.id], antecedents, comment)
+                antecedents = [cid for cid in vlist + [implication] if cid != resolver.tautologyId]
+        if cid is None:
+            comment = "Justification of assertion #%d" % pid
+            cid = self.prover.createClause([root.id], antecedents, comment)
         self.tbddList[pid-1] = (root, cid)
         if self.verbLevel >= 2:
             if root.id == -resolver.tautologyId:
@@ -993,8 +2260,12 @@ class Pbip:
                 else:
                     (ar,av) = self.tbddList[aid-1]
                     (vroot,vid) = self.manager.constructOr(propArgs, self.getLiteralBdd)
+                    if vid not in vroot.clauseIds():
+                        self.intermediateClauses.append(vid)
                     stepAntecedents = [av, vid]
+                    start = self.profileStart()
                     (uroot,uid) = self.manager.justifyImply(ar,vroot)
+                    self.profileTime("imply", start)
                     if uid != resolver.tautologyId:
                         stepAntecedents.append(uid)
             elif bddTarget:
@@ -1002,8 +2273,12 @@ class Pbip:
                 if alit is not None:
                     propArgs += [-alit]
                 (vroot,vid) = self.manager.constructAnd(propArgs, self.getLiteralBdd)
+                if vid not in vroot.clauseIds():
+                    self.intermediateClauses.append(vid)
                 stepAntecedents = [vid]
+                start = self.profileStart()
                 (uroot,uid) = self.manager.justifyImply(vroot,root)
+                self.profileTime("imply", start)
                 if uid != resolver.tautologyId:
                     stepAntecedents.append(uid)
                 stepClause = [-lit for lit in propArgs] + targetClause
@@ -1017,6 +2292,7 @@ class Pbip:
             scid = self.prover.createClause(stepClause, stepAntecedents, comment)
             if scid != resolver.tautologyId:
                 finalAntecedents.append(scid)
+                self.intermediateClauses.append(scid)
             if alit is not None:
                 litList.append(alit)
             if self.verbLevel >= 3:
@@ -1024,6 +2300,7 @@ class Pbip:
 
         comment = "Justification of RUP addition #%d" % pid
         cid = self.prover.createClause(targetClause, finalAntecedents, comment)
+        self.releaseIntermediates([cid])
         if bddTarget:
             self.tbddList[pid-1] = (root, cid)
         else:
@@ -1036,27 +2313,311 @@ class Pbip:
                 print("PBIP: Processed PBIP RUP addition #%d.  Added %d clauses" % (pid, self.deltaClauses()))
                 self.prover.comment("Processed PBIP RUP addition #%d.  Target clause %s #%d" % (pid, targetClause, cid))
             
+    # Roots released since last GC.  Used to estimate effect of liveness analysis
+    def deadRootGenerator(self):
+        rootList = self.droppedRoots
+        self.droppedRoots = []
+        return rootList
+
     def rootGenerator(self):
-        return [root for root,validation in self.tbddList if root is not None]
+        rootList = [root for root,validation in self.tbddList if root is not None]
+        # Cached literals must survive GC, since their node handles would otherwise be recycled
+        rootList += [node for node in self.litMap.values() if node is not None]
+        rootList += [root for root,validation in self.clauseBddCache.values()]
+        rootList += [tail for block in self.sdpBlocks for (head, literal, tail, validation) in block.terms]
+        # Nodes adopted from shard are still needed to import its remaining steps
+        rootList += [self.manager.getNode(handle) for shard in self.shards for handle in shard.adopted.values()]
+        return rootList
             
 
+    def enableCheckpoints(self, checkpointName, checkpointInterval):
+        self.checkpointName = checkpointName
+        self.checkpointInterval = checkpointInterval
+        self.lastCheckpoint = datetime.datetime.now()
+
+    # Save complete state, including BDDs, proof counters, and file positions.
+    # Written to temporary file and then renamed, so that an interruption leaves the previous checkpoint intact
+    def saveCheckpoint(self):
+        start = datetime.datetime.now()
+        tmpName = self.checkpointName + ".tmp"
+        try:
+            outfile = open(tmpName, 'wb')
+        except Exception:
+            raise PbipException("", "Couldn't open checkpoint file '%s'" % tmpName)
+        self.checkpointCount += 1
+        pickle.dump(self, outfile, protocol = pickle.HIGHEST_PROTOCOL)
+        outfile.flush()
+        os.fsync(outfile.fileno())
+        outfile.close()
+        os.replace(tmpName, self.checkpointName)
+        self.lastCheckpoint = datetime.datetime.now()
+        if self.verbLevel >= 1:
+            delta = self.lastCheckpoint - start
+            seconds = delta.seconds + 1e-6 * delta.microseconds
+            print("PBIP: Saved checkpoint #%d after line %d to %s (%.2f seconds)" % (self.checkpointCount, self.preader.lineCount, self.checkpointName, seconds))
+
+    def checkpointDue(self):
+        if self.checkpointName is None:
+            return False
+        delta = datetime.datetime.now() - self.lastCheckpoint
+        return delta.seconds + 1e-6 * delta.microseconds >= self.checkpointInterval
+
+    # Start checking input steps with pool of worker processes.
+    # Requires indexed reader, so that workers can read steps directly
+    def enableParallel(self, jobs):
+        if not self.preader.indexed:
+            raise PbipException("", "Parallel checking requires indexed proof file")
+        settings = { "cnfName" : self.cnfName, "pbipName" : self.preader.fname, "bddOnly" : self.bddOnly, "sdpReduce" : self.sdpReduce,
+                     "cacheLimits" : self.cacheLimits, "conjunctOrder" : self.conjunctOrder, "gcMode" : self.gcMode, "varOrder" : self.varOrder,
+                     "clauseCache" : self.clauseLastUses is not None }
+        pids = [pid for pid in range(1, self.preader.stepCount()+1) if self.preader.stepKinds[pid-1] == ord('i')]
+        self.shardDirectory = tempfile.mkdtemp(prefix = "pbip-shards-")
+        self.pool = concurrent.futures.ProcessPoolExecutor(max_workers = jobs, initializer = initShardWorker, initargs = (settings,))
+        size = max(1, min(self.shardSize, (len(pids) + jobs * self.shardsPerJob - 1) // (jobs * self.shardsPerJob)))
+        for start in range(0, len(pids), size):
+            shard = Shard(len(self.shards), pids[start:start+size])
+            fragmentName = os.path.join(self.shardDirectory, "shard-%d.frag" % shard.sid)
+            shard.future = self.pool.submit(checkShard, shard.pids, fragmentName)
+            for pid in shard.pids:
+                self.shardSteps[pid] = shard.sid
+            self.shards.append(shard)
+        if self.verbLevel >= 1:
+            print("PBIP: Checking %d input steps in %d shards with %d processes" % (len(pids), len(self.shards), jobs))
+
+    # Stop the workers and remove their proof fragments.
+    # Shards still being checked are no longer needed.  The executor has no public way
+    # to stop running tasks, and so its worker processes are terminated directly
+    def finishParallel(self):
+        if self.pool is None:
+            return
+        processes = list(self.pool._processes.values())
+        self.pool.shutdown(wait = False, cancel_futures = True)
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.join()
+        shutil.rmtree(self.shardDirectory, ignore_errors = True)
+        self.pool = None
+
+    # Check input steps in worker process, using fresh BDD manager and writing proof to named file.
+    # Clauses for the BDDs of the steps remain live at the end.
+    # Return tuple (file name, next node id, results, nodes, live clauses), as described for Shard
+    def checkShard(self, pids, fragmentName):
+        self.prover = solver.Prover(fname = fragmentName, writer = solver.StdOutWriter(), verbLevel = 0, doLrat = True, doBinary = True,
+                                    encoder = stream.appendInts)
+        self.addInputClauses()
+        self.newManager()
+        self.constraintList = []
+        self.tbddList = []
+        self.tclauseList = []
+        self.internTable = {}
+        self.intermediateClauses = []
+        self.clauseBddCache = {}
+        self.clauseBddCosts = {}
+        self.expiringClauses = {}
+        self.sdpBlocks = []
+        self.sdpBlockHolds = {}
+        results = {}
+        for pid in pids:
+            while len(self.constraintList) < pid-1:
+                self.constraintList.append([])
+                self.tbddList.append((None, None))
+                self.tclauseList.append((None, None))
+            self.preader.nextStep = pid
+            self.doStep()
+            root, cid = self.tbddList[pid-1]
+            if not self.valid:
+                # Main process will repeat step and report error
+                self.valid = True
+            elif cid is not None and root is not None and not root.isLeaf():
+                results[pid] = (cid, root.id)
+        # Keep only the nodes for the step BDDs
+        self.litMap = { lit : None for lit in self.litMap.keys() }
+        for id in list(self.clauseBddCache.keys()):
+            self.evictClauseBdd(id)
+        for block in list(self.sdpBlocks):
+            self.evictSdpBlock(block)
+        manager = self.manager
+        clauseList = manager.collectGarbage() + manager.cleanCache(set([])) + manager.evictedClauses
+        manager.evictedClauses = []
+        if manager.refCounting:
+            clauseList += manager.staleClauses()
+        self.deleteClauses(clauseList)
+        nodes = {}
+        liveClauses = [cid for (cid, id) in results.values()]
+        for handle in manager.uniqueTable.values():
+            high = manager.nodeHigh[handle]
+            low = manager.nodeLow[handle]
+            nodes[manager.nodeId[handle]] = (manager.nodeLevel[handle], high if high < 2 else manager.nodeId[high],
+                                             low if low < 2 else manager.nodeId[low], manager.nodeClauseBase[handle])
+            liveClauses += [cid for cid in [manager.idHU(handle), manager.idLU(handle), manager.idHD(handle), manager.idLD(handle)]
+                            if cid != resolver.tautologyId]
+        self.prover.close()
+        return (fragmentName, manager.nextNodeId, results, nodes, liveClauses)
+
+    # Wait for shard to be checked and append its proof fragment
+    def spliceShard(self, shard):
+        start = datetime.datetime.now()
+        (fragmentName, nextNodeId, results, nodes, liveClauses) = shard.future.result()
+        delta = datetime.datetime.now() - start
+        self.shardWaitSeconds += delta.seconds + 1e-6 * delta.microseconds
+        (clauseShift, variableShift) = self.prover.spliceFragment(fragmentName, self.inputClauseCount, self.creader.nvar, self.manager.nextNodeId)
+        os.remove(fragmentName)
+        self.manager.nextNodeId = nextNodeId + variableShift
+        shiftNode = lambda id : id if id < 2 else id + variableShift
+        shard.results = { pid : (cid + clauseShift, id + variableShift) for pid, (cid, id) in results.items() }
+        shard.nodes = { id + variableShift : (level, shiftNode(high), shiftNode(low), base + clauseShift) for id, (level, high, low, base) in nodes.items() }
+        shard.liveClauses = set([cid + clauseShift for cid in liveClauses])
+        shard.remaining = len(results)
+        if self.verbLevel >= 2:
+            print("PBIP: Spliced proof fragment for shard #%d.  Added %d clauses" % (shard.sid, self.deltaClauses()))
+
+    # Justify input step from shard result, importing the worker's BDD.
+    # When root is given, it is the BDD already built for the step.
+    # Return pair (root, validation clause), or (None, None) if step must be checked locally
+    def importShardStep(self, pid, root = None):
+        shard = self.shards[self.shardSteps[pid]]
+        if shard.results is None:
+            self.spliceShard(shard)
+        if pid not in shard.results:
+            return (None, None)
+        (validation, wid) = shard.results[pid]
+        handle, implication = self.importShardNodes(shard, wid)
+        if root is None:
+            root = self.manager.getNode(handle)
+        elif root.handle != handle:
+            raise PbipException("", "Shard BDD node N%d does not match node %s" % (wid, str(root)))
+        if implication is None:
+            # Worker root is now the root here
+            cid = validation
+            shard.liveClauses.discard(validation)
+        else:
+            comment = "Justification of input constraint #%d from shard #%d" % (pid, shard.sid)
+            cid = self.prover.createClause([root.id], [implication, validation], comment=comment)
+            self.releaseIntermediates([cid])
+        self.shardImportCount += 1
+        shard.remaining -= 1
+        if shard.remaining == 0:
+            self.deleteClauses(sorted(shard.liveClauses))
+            shard.liveClauses = set([])
+            shard.nodes = None
+            shard.adopted = {}
+        if self.verbLevel >= 2:
+            print("PBIP: Processed PBIP input #%d from shard #%d. Added %d clauses" % (pid, shard.sid, self.deltaClauses()))
+        return (root, cid)
+
+    # Enter BDD with worker root node wid into manager.
+    # A worker node is adopted, keeping its id and defining clauses, when its children are leaves or adopted nodes
+    # and the manager has no node with the same level and children.
+    # Otherwise it is mapped to a node here u, and clause [-w, u] is justified by case splitting on its variable.
+    # Return pair (handle, Id of clause [-w, u]), with None as the clause Id when the root was adopted
+    def importShardNodes(self, shard, wid):
+        manager = self.manager
+        adopted = shard.adopted
+        bridged = {}
+        def mapChild(w):
+            if w < 2:
+                return (w, None)
+            elif w in adopted:
+                return (adopted[w], None)
+            else:
+                return bridged[w]
+        stack = [wid]
+        while len(stack) > 0:
+            w = stack[-1]
+            if w in adopted or w in bridged:
+                stack.pop()
+                continue
+            (level, whigh, wlow, wbase) = shard.nodes[w]
+            pending = [wchild for wchild in (whigh, wlow) if wchild >= 2 and wchild not in adopted and wchild not in bridged]
+            if len(pending) > 0:
+                stack += pending
+                continue
+            stack.pop()
+            (high, hbridge) = mapChild(whigh)
+            (low, lbridge) = mapChild(wlow)
+            if high == low:
+                raise PbipException("", "Shard BDD node N%d has equivalent children" % w)
+            h = manager.findHandle(level, high, low)
+            if h is None and hbridge is None and lbridge is None:
+                h = manager.adoptHandle(level, high, low, w, wbase)
+                adopted[w] = h
+                shard.liveClauses.difference_update([manager.idHU(h), manager.idLU(h), manager.idHD(h), manager.idLD(h)])
+                continue
+            if h is None:
+                h = manager.findOrMakeHandle(level, high, low)
+            vid = manager.variables[level-1].id
+            id = manager.nodeId[h]
+            hints = [] if high == 1 else [wbase + bdd.VariableNode.HD]
+            hints += [] if hbridge is None else [hbridge]
+            hints += [] if high == 0 else [manager.idHU(h)]
+            hcid = self.prover.createClause([-vid, -w, id], hints)
+            hints = [hcid] + ([] if low == 1 else [wbase + bdd.VariableNode.LD])
+            hints += [] if lbridge is None else [lbridge]
+            hints += [] if low == 0 else [manager.idLU(h)]
+            bridged[w] = (h, self.prover.createClause([-w, id], hints))
+            self.intermediateClauses += [hcid, bridged[w][1]]
+        return mapChild(wid)
+
+    # Worker processes and their files are cleaned up however the run ends,
+    # including by an exception raised from a signal handler
     def run(self):
-        while not self.doStep():
-            pass
-        decided = False
-        if not self.valid:
-            print("PBIP INVALID")
-            decided = True
-        elif len(self.constraintList) > 0:
-            lastBdd = self.tbddList[-1][0] if len(self.tbddList) > 0 else self.manager.leaf1
-            if lastBdd == self.manager.leaf0:
+        try:
+            while not self.doStep():
+                if self.checkpointDue():
+                    self.saveCheckpoint()
+            decided = False
+            if not self.valid:
+                print("PBIP INVALID")
                 decided = True
-                print("PBIP UNSAT")
-        if not decided:
-            print("PBIP Final status unknown")
-        print("PBIP Results:")
-        print("  Maximum Constraint RHS = %d" % self.maxConstant)
-        print("  Maximum BDD size = %d" % self.maxBddSize)
-        print("BDD Results:")
-        self.manager.summarize()
-
+            elif len(self.constraintList) > 0:
+                lastBdd = self.tbddList[-1][0] if len(self.tbddList) > 0 else self.manager.leaf1
+                if lastBdd == self.manager.leaf0:
+                    decided = True
+                    print("PBIP UNSAT")
+            if not decided:
+                print("PBIP Final status unknown")
+            print("PBIP Results:")
+            print("  Maximum Constraint RHS = %d" % self.maxConstant)
+            print("  Maximum BDD size = %d" % self.maxBddSize)
+            print("  Clauses deleted = %d" % self.deletedClauseCount)
+            print("  Constraint BDDs reused = %d" % self.internHitCount)
+            print("  Assertion clauses reused = %d" % self.reusedValidationCount)
+            if self.clauseLastUses is not None:
+                if self.sdpReduce:
+                    print("  SDP blocks reused = %d" % self.sdpBlockHits)
+                else:
+                    print("  Input clause BDDs reused = %d" % self.clauseCacheHits)
+                print("  Clauses saved by reuse = %d" % self.reuseClausesSaved)
+                print("  Apply operations saved by reuse = %d" % self.reuseAppliesSaved)
+            if self.pool is not None:
+                print("  Input steps checked in shards = %d" % self.shardImportCount)
+                print("  Seconds waiting for shards = %.2f" % self.shardWaitSeconds)
+            self.finishParallel()
+            print("BDD Results:")
+            self.manager.summarize()
+            self.prover.close()
+            if self.profiler is not None:
+                self.profiler.summarize()
+                self.profiler.close()
+        finally:
+            self.finishParallel()
+
+
+# Restore Pbip from checkpoint.  Output continues from the point at which the checkpoint was saved
+def loadCheckpoint(checkpointName):
+    try:
+        infile = open(checkpointName, 'rb')
+    except Exception:
+        raise PbipException("", "Couldn't open checkpoint file '%s'" % checkpointName)
+    try:
+        pb = pickle.load(infile)
+    except Exception as ex:
+        raise PbipException("", "Couldn't load checkpoint file '%s' (%s)" % (checkpointName, str(ex)))
+    finally:
+        infile.close()
+    pb.preader.resume()
+    pb.prover.resume()
+    if pb.profiler is not None:
+        pb.profiler.resume()
+    return pb
@@ -0,0 +1,102 @@
+#!/usr/bin/python3
+
+import sys
+import os
+import datetime
+import getopt
+
+import pbip
+
+def usage(name):
+    print("Usage %s: [-h] [-v VERB] [-t] -i FILE.pbip [-o FILE.pbipb]" % name)
+    print("  -h            Print this message")
+    print("  -v VERB       Set verbosity level")
+    print("  -t            Time parsing of text and binary files")
+    print("  -i FILE.pbip  Input proof file")
+    print("  -o FILE.pbipb Output binary proof file (default is input name with suffix .pbipb)")
+
+def convert(pbipName, pbipbName, verbLevel):
+    preader = pbip.PbipReader(pbipName, verbLevel)
+    try:
+        outfile = open(pbipbName, 'wb')
+    except:
+        print("Couldn't open output file '%s'" % pbipbName)
+        preader.finish()
+        return False
+    outfile.write(pbip.binaryHeader)
+    stepCount = 0
+    while True:
+        command, clist, hlist, comlist = preader.readLine()
+        for comment in comlist:
+            outfile.write(pbip.encodeComment(comment))
+        if command == "":
+            break
+        outfile.write(pbip.encodeStep(command, clist, hlist))
+        stepCount += 1
+    outfile.close()
+    preader.finish()
+    if verbLevel >= 1:
+        print("PBIP: Converted %d steps.  %d bytes --> %d bytes" %
+              (stepCount, os.path.getsize(pbipName), os.path.getsize(pbipbName)))
+    return True
+
+# Read all steps from file.  Return elapsed seconds
+def timeRead(fname):
+    start = datetime.datetime.now()
+    preader = pbip.PbipReader(fname, 0)
+    preader.findMaximum()
+    while True:
+        command, clist, hlist, comlist = preader.readLine()
+        if command == "":
+            break
+    preader.finish()
+    delta = datetime.datetime.now() - start
+    return delta.seconds + 1e-6 * delta.microseconds
+
+def run(name, argList):
+    verbLevel = 1
+    pbipName = ""
+    pbipbName = ""
+    timeParse = False
+
+    optlist, args = getopt.getopt(argList, "htv:i:o:")
+    for (opt, val) in optlist:
+        if opt == '-h':
+            usage(name)
+            return
+        elif opt == '-t':
+            timeParse = True
+        elif opt == '-v':
+            verbLevel = int(val)
+        elif opt == '-i':
+            pbipName = val
+        elif opt == '-o':
+            pbipbName = val
+        else:
+            print("Unknown option '%s'" % opt)
+            usage(name)
+            return
+    if pbipName == "":
+        print("ERROR: Must give name of PBIP file")
+        usage(name)
+        return
+    if pbipbName == "":
+        root, ext = os.path.splitext(pbipName)
+        pbipbName = root + pbip.binarySuffix
+    if not pbip.isBinaryName(pbipbName):
+        print("ERROR: Binary PBIP file must have suffix %s" % pbip.binarySuffix)
+        usage(name)
+        return
+    try:
+        if not convert(pbipName, pbipbName, verbLevel):
+            return
+        if timeParse:
+            tseconds = timeRead(pbipName)
+            bseconds = timeRead(pbipbName)
+            print("PBIP: Parse seconds.  Text: %.3f  Binary: %.3f  Speedup: %.2fx" %
+                  (tseconds, bseconds, tseconds/bseconds if bseconds > 0 else 0.0))
+    except pbip.PbipException as ex:
+        print("ERROR: %s" % str(ex))
+
+if __name__ == "__main__":
+    run(sys.argv[0], sys.argv[1:])
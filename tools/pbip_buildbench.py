@@ -0,0 +1,93 @@
+#!/usr/bin/python3
+
+# Compare methods for converting PB constraints into BDDs:
+# Constraint.buildBdd, which creates nodes for all reachable offsets, and
+# Constraint.buildIntervalBdd, which creates nodes for intervals of offsets
+
+import sys
+import getopt
+import random
+import datetime
+
+import bdd
+import solver
+import pbip
+
+def usage(name):
+    print("Usage %s: [-h] [-w WEIGHT] [-r SEED] FILE.pbip ..." % name)
+    print("  -h           Print this message")
+    print("  -w WEIGHT    Multiply each coefficient by random value between 1 and WEIGHT")
+    print("  -r SEED      Set random seed")
+
+# Provides fields required by buildBdd
+class BuildSystem:
+    prover = None
+    manager = None
+    varMap = {}
+    levelMap = {}
+
+    def __init__(self, variableCount):
+        self.prover = solver.Prover(fname="", writer = solver.StdOutWriter(), verbLevel = 0, doLrat = False)
+        self.manager = bdd.Manager(prover = self.prover, nextNodeId = variableCount+1, verbLevel = 0)
+        for id in range(1, variableCount+1):
+            self.manager.newVariable(name = "V%d" % id)
+        self.varMap = { var.id : var for var in self.manager.variables }
+        self.levelMap = { var.id : var.level for var in self.manager.variables }
+
+def readConstraints(fname, weight):
+    preader = pbip.PbipReader(fname, 0)
+    clist = []
+    while True:
+        command, cons, hlist, comlist = preader.readLine()
+        if command == "":
+            break
+        clist += cons
+    preader.finish()
+    if weight > 1:
+        for con in clist:
+            for var in con.nz.keys():
+                con.nz[var] *= random.randint(1, weight)
+            con.cval *= (weight+1) // 2
+    return clist
+
+# Build BDDs for all constraints with specified method.  Return (seconds, node count, list of root ids)
+def timeBuild(clist, variableCount, interval):
+    bsys = BuildSystem(variableCount)
+    start = datetime.datetime.now()
+    for con in clist:
+        if interval:
+            con.buildIntervalBdd(bsys)
+        else:
+            con.buildBdd(bsys, allowInterval = False)
+    delta = datetime.datetime.now() - start
+    seconds = delta.seconds + 1e-6 * delta.microseconds
+    return (seconds, len(bsys.manager.uniqueTable), [con.root.id for con in clist])
+
+def run(name, argList):
+    weight = 1
+    optlist, args = getopt.getopt(argList, "hw:r:")
+    for (opt, val) in optlist:
+        if opt == '-h':
+            usage(name)
+            return
+        elif opt == '-w':
+            weight = int(val)
+        elif opt == '-r':
+            random.seed(int(val))
+        else:
+            print("Unknown option '%s'" % opt)
+            usage(name)
+            return
+    print("File\tConstraints\tNodes\tOffset(s)\tInterval(s)\tSpeedup")
+    for fname in args:
+        clist = readConstraints(fname, weight)
+        variableCount = max([max(con.nz.keys()) for con in clist if len(con.nz) > 0] + [0])
+        oseconds, onodes, oroots = timeBuild(clist, variableCount, False)
+        iseconds, inodes, iroots = timeBuild(clist, variableCount, True)
+        if onodes != inodes or oroots != iroots:
+            print("ERROR: %s.  Builders generated different BDDs" % fname)
+        speedup = oseconds / iseconds if iseconds > 0 else 0.0
+        print("%s\t%d\t%d\t%.3f\t%.3f\t%.2f" % (fname, len(clist), inodes, oseconds, iseconds, speedup))
+
+if __name__ == "__main__":
+    run(sys.argv[0], sys.argv[1:])
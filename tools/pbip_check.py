@@ -3,21 +3,46 @@
 import sys
 import datetime
 import getopt
+import signal
 
 import pbip
+import bdd
+import stream
 
 def usage(name):
-    print("Usage %s: [-h] [-v VERB] [-b] [-S] [-R] -i FILE.cnf -p FILE.pbip [-o FILE.lrat]")
+    print("Usage %s: [-h] [-v VERB] [-b] [-S] [-R] [-d] [-l] [-u] [-x] [-c LIMITS] [-g MODE] [-m ORDER] [-P FILE] [-C FILE] [-T SECS] [-r FILE] [-j N] -i FILE.cnf -p FILE.pbip [-o FILE.lrat[b]]" % name)
     print("  -h           Print this message")
     print("  -v VERB      Set verbosity level")
     print("  -b           Pure BDD mode.  Don't make use of clausal representations")
     print("  -S           Disable SDP processing of CNF")
     print("  -R           Don't reorder variables")
+    print("  -d           Delete validation clauses for each step after its last use")
+    print("  -l           Release BDD for each step after its last use")
+    print("  -u           Reuse work on input clauses serving as hints for multiple input steps, until their last use")
+    print("               Caches clause BDDs for bucket reduction, and partial reductions of shared clauses for SDP")
+    print("  -x           Index proof file in single pass, caching index in FILE.pbip.idx")
+    print("  -c LIMITS    Limit entries in operation caches.  Either NUM for all operations, or list OP=NUM,...,OP=NUM")
+    print("               Small limits cause work to be redone and can greatly increase proof size and runtime")
+    print("  -g MODE      Garbage collection method: %s (default marksweep)" % ", ".join(bdd.gcModes))
+    print("  -P FILE      Write statistics for each step to FILE (.csv or .jsonl) and report slowest steps")
+    print("  -m ORDER     Order for conjoining terms in bucket reduction: %s (default fifo)" % ", ".join(pbip.conjunctOrders))
+    print("                 fifo: Order of arrival.  size: Smallest BDDs first.  many: All terms in one operation")
+    print("  -j N         Check input steps with N worker processes (implies -x).  Proof fragments from workers are merged")
+    print("  -C FILE      Periodically save checkpoint to FILE.  Requires uncompressed proof file")
+    print("  -T SECS      Interval between checkpoints (default 600)")
+    print("  -r FILE      Resume from checkpoint FILE, appending to the proof file.  Other options are taken from the checkpoint")
+    print("               Checkpoints continue to be saved to FILE, unless -C is given")
     print("  -i FILE.cnf  Input CNF file")
-    print("  -p FILE.pbip Input proof file")
-    print("  -o FILE.lrat Output proof file")
+    print("  -p FILE.pbip Input proof file.  Binary format if name has suffix .pbipb")
+    print("  -o FILE.lrat Output proof file.  Binary format if name has suffix .lratb")
+    print("               Compressed when name has additional suffix (%s)" % ", ".join(["." + s for s in stream.proofCodecs.keys()]))
 
 
+# Turn termination (as by a driver's timeout) into an exception, so that the checker can clean up
+def thandler(signum, frame):
+    print("PBIP: Terminated by signal %d" % signum)
+    sys.exit(1)
+
 def run(name, argList):
     verbLevel = 1
     cnfName = ""
@@ -26,8 +51,20 @@ def run(name, argList):
     bddOnly = False
     reorder = True
     sdpReduce = True
+    cacheLimits = None
+    deleteSteps = False
+    liveness = False
+    clauseCache = False
+    indexed = False
+    conjunctOrder = "fifo"
+    gcMode = "marksweep"
+    profileName = None
+    checkpointName = None
+    checkpointInterval = 600.0
+    resumeName = None
+    jobs = 1
 
-    optlist, args = getopt.getopt(argList, "hbRSv:i:p:o:")
+    optlist, args = getopt.getopt(argList, "hbRSdluxv:c:g:m:P:C:T:r:j:i:p:o:")
     for (opt, val) in optlist:
         if opt == '-h':
             usage(name)
@@ -38,8 +75,46 @@ def run(name, argList):
             reorder = False
         elif opt == '-S':
             sdpReduce = False
+        elif opt == '-d':
+            deleteSteps = True
+        elif opt == '-l':
+            liveness = True
+        elif opt == '-u':
+            clauseCache = True
+        elif opt == '-x':
+            indexed = True
         elif opt == '-v':
             verbLevel = int(val)
+        elif opt == '-c':
+            try:
+                cacheLimits = bdd.parseCacheLimits(val)
+            except bdd.BddException as ex:
+                print("ERROR: %s" % str(ex))
+                usage(name)
+                return
+        elif opt == '-g':
+            if val not in bdd.gcModes:
+                print("ERROR: Unknown GC mode '%s'" % val)
+                usage(name)
+                return
+            gcMode = val
+        elif opt == '-m':
+            if val not in pbip.conjunctOrders:
+                print("ERROR: Unknown conjunction order '%s'" % val)
+                usage(name)
+                return
+            conjunctOrder = val
+        elif opt == '-P':
+            profileName = val
+        elif opt == '-C':
+            checkpointName = val
+        elif opt == '-T':
+            checkpointInterval = float(val)
+        elif opt == '-r':
+            resumeName = val
+        elif opt == '-j':
+            jobs = int(val)
+            indexed = indexed or jobs > 1
         elif opt == '-i':
             cnfName = val
         elif opt == '-p':
@@ -50,6 +125,9 @@ def run(name, argList):
             print("Unknown option '%s'" % opt)
             usage(name)
             return
+    if resumeName is not None:
+        resume(resumeName, checkpointName, checkpointInterval)
+        return
     if cnfName == "":
         print("ERROR: Must give name of CNF file")
         usage(name)
@@ -58,14 +136,44 @@ def run(name, argList):
         print("ERROR: Must give name of PBIP file")
         usage(name)
         return
+    if checkpointName is not None and (lratName == "" or stream.splitCodec(lratName)[1] is not None):
+        print("ERROR: Checkpoints require an uncompressed proof file")
+        usage(name)
+        return
+    if checkpointName is not None and jobs > 1:
+        print("ERROR: Can't save checkpoints when checking in parallel")
+        usage(name)
+        return
+    binaryLrat = lratName != "" and stream.proofExtension(lratName) == "lratb"
     start = datetime.datetime.now()
-    pb = pbip.Pbip(cnfName, pbipName, lratName, verbLevel, bddOnly, reorder, sdpReduce)
+    pb = pbip.Pbip(cnfName, pbipName, lratName, verbLevel, bddOnly, reorder, sdpReduce, cacheLimits, deleteSteps, liveness, indexed, conjunctOrder, gcMode, binaryLrat, profileName, clauseCache)
+    if checkpointName is not None:
+        pb.enableCheckpoints(checkpointName, checkpointInterval)
+    if jobs > 1:
+        pb.enableParallel(jobs)
     pb.run()
     delta = datetime.datetime.now() - start
     seconds = delta.seconds + 1e-6 * delta.microseconds
     if verbLevel > 0:
         print("PBIP: LRAT generation elapsed seconds: %.2f" % (seconds))
 
+def resume(resumeName, checkpointName, checkpointInterval):
+    start = datetime.datetime.now()
+    try:
+        pb = pbip.loadCheckpoint(resumeName)
+    except Exception as ex:
+        print("ERROR: %s" % str(ex))
+        return
+    if pb.verbLevel > 0:
+        print("PBIP: Resuming from checkpoint %s after line %d" % (resumeName, pb.preader.lineCount))
+    pb.enableCheckpoints(resumeName if checkpointName is None else checkpointName, checkpointInterval)
+    pb.run()
+    delta = datetime.datetime.now() - start
+    seconds = delta.seconds + 1e-6 * delta.microseconds
+    if pb.verbLevel > 0:
+        print("PBIP: LRAT generation elapsed seconds (since resuming): %.2f" % (seconds))
+
 
 if __name__ == "__main__":
+    signal.signal(signal.SIGTERM, thandler)
     run(sys.argv[0], sys.argv[1:])
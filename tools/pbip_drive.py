@@ -27,15 +27,26 @@ import subprocess
 import datetime
 import time
 import glob
+import re
+import csv
+import json
+import tempfile
+import threading
+import signal
+import resource
+import concurrent.futures
 
 def usage(name):
-    print("Usage: %s [-h] [-f] [-x] [-v VERB] [-m b|s] [-t TIME] [-l NFILE] [FILE.EXT ...]" % name)
+    print("Usage: %s [-h] [-f] [-x] [-v VERB] [-m b|s] [-t TIME] [-M MB] [-j N] [-r RFILE] [-l NFILE] [FILE.EXT ...]" % name)
     print("  -h       Print this message")
     print("  -f       Force regeneration of all files")
     print("  -x       Exit after first error (including timeout)")
     print("  -v       Set verbosity level")
     print("  -m MODE  Set mode: b=bucket elimination, s=symbolic Davis-Putnam")
     print("  -t TIME  Limit time for each of the programs")
+    print("  -M MB    Limit memory (address space) for each of the programs")
+    print("  -j N     Run pipelines for up to N roots concurrently")
+    print("  -r RFILE Write results for all roots to RFILE (.csv or .json)")
     print("  -l NFILE Specify file containing root names")
     print("  EXT can be any extension for wild-card matching (e.g., cnf, nnf)")
 
@@ -57,6 +68,22 @@ genProgram = repo + "/tools/pbip-check"
 checkProgram = "lrat-check"
 
 timeLimit = 1000
+# Seconds between asking a timed-out program to terminate and killing it
+killGrace = 5
+# Memory limit in megabytes (0 = unlimited)
+memoryLimit = 0
+workerCount = 1
+resultName = None
+
+# Stages in pipeline for each root
+stageNames = ["CNF", "PBIP", "LRAT"]
+
+# Statistics extracted from program output.  The last match in the output is used
+statPatterns = {
+    "clauses"      : [re.compile(r"Total [Cc]lauses: (\d+)"), re.compile(r"(\d+) added clauses")],
+    "nodes"        : [re.compile(r"Total nodes: (\d+)")],
+    "maxLiveNodes" : [re.compile(r"Maximum live nodes: (\d+)")],
+}
 
 commentChar = 'c'
 
@@ -71,65 +98,140 @@ def setTimeLimit(t):
     global timeLimit
     timeLimit = t
 
-def killJobs(matchString):
-    psCmd = ["ps", "-a"]
-    pp = subprocess.run(psCmd, capture_output = True, text=True)
-    if pp.returncode != 0:
-        return "WARNING: Couldn't find job number"
-    lines = pp.stdout.split("\n")
-    result = "Jobs: "
-    jcount = 0
-    for line in lines:
-        line = trim(line)
-        if line.find(matchString) >= 0:
-            fields = line.split()
-            jobName = fields[0]
-            killCmd = ["kill", jobName]
-            kp = subprocess.run(killCmd)
-            if kp.returncode == 0:
-                result += jobName + ":killed "
-            else:
-                result += jobName + ":not killed "
-            jcount += 1
-    if jcount == 0:
-        result += "None"
-    return result
-                
+# Settings must be passed explicitly to worker processes, since they are not forked on all platforms
+def settings():
+    return (verbLevel, modeFlag, timeLimit, memoryLimit, exitWhenError)
+
+def setSettings(values):
+    global verbLevel, modeFlag, timeLimit, memoryLimit, exitWhenError
+    verbLevel, modeFlag, timeLimit, memoryLimit, exitWhenError = values
+
+# Limit address space of running child process.  Requires prlimit (Linux)
+def limitMemory(pid):
+    nbytes = memoryLimit * 1024 * 1024
+    try:
+        resource.prlimit(pid, resource.RLIMIT_AS, (nbytes, nbytes))
+    except ProcessLookupError:
+        # Already finished
+        pass
+
+# Command that sets the memory limit and then executes the program, for systems without prlimit
+def limitedCommand(commandList):
+    nbytes = memoryLimit * 1024 * 1024
+    code = "import os, sys, resource; n = int(sys.argv[1]); resource.setrlimit(resource.RLIMIT_AS, (n, n)); os.execvp(sys.argv[2], sys.argv[2:])"
+    return [sys.executable, "-c", code, str(nbytes)] + commandList
+
+# Peak resident set size in megabytes, given resource usage of child process
+def peakMegabytes(rusage):
+    # Linux reports kilobytes.  macOS reports bytes
+    scale = 1024 * 1024 if sys.platform == "darwin" else 1024
+    return float(rusage.ru_maxrss) / scale
+
+def extractStats(text, stage):
+    for key, patterns in statPatterns.items():
+        for pattern in patterns:
+            matches = pattern.findall(text)
+            if len(matches) > 0:
+                stage[key] = int(matches[-1])
+                break
+
+# Run program, with output going to log file.
+# Return dictionary describing outcome, elapsed time, peak memory, and statistics
 def runProgram(prefix, root, commandList, logFile):
     tlimit = timeLimit
     result = ""
+    stage = { "outcome" : "failed", "seconds" : 0.0, "peakMb" : 0.0 }
     cstring = " ".join(commandList)
     print("%s. %s: Running '%s' with time limit of %d seconds" % (root, prefix, cstring, tlimit))
     logFile.write("%s LOG: Running %s\n" % (prefix, cstring))
     logFile.write("%s LOG: Time limit %d seconds\n" % (prefix, tlimit))
+    if memoryLimit > 0:
+        logFile.write("%s LOG: Memory limit %d MB\n" % (prefix, memoryLimit))
     start = datetime.datetime.now()
+    # Output goes to temporary files, so that waiting for the process cannot block on a full pipe
+    outFile = tempfile.TemporaryFile(mode = "w+")
+    errFile = tempfile.TemporaryFile(mode = "w+")
+    # Program runs in its own session, so that it and any processes it starts form a process group
+    # that can be signalled as a whole
+    wrapped = memoryLimit > 0 and not hasattr(resource, "prlimit")
     try:
-        cp = subprocess.run(commandList, capture_output = True, timeout=tlimit, text=True)
-    except subprocess.TimeoutExpired as ex:
+        proc = subprocess.Popen(limitedCommand(commandList) if wrapped else commandList, stdout = outFile, stderr = errFile, text = True,
+                                start_new_session = True)
+    except OSError as ex:
+        result += "%s ERROR: Couldn't run program (%s)\n" % (prefix, str(ex))
+        result += "%s OUTCOME: failed\n" % (prefix)
+        print("%s. %s: OUTCOME: failed" % (root, prefix))
+        logFile.write(result)
+        return stage
+    if memoryLimit > 0 and not wrapped:
+        limitMemory(proc.pid)
+    # On timeout, the process group is asked to terminate, so that programs can clean up, and killed killGrace seconds later.
+    # Timers must not signal the group once the process has been collected, since its pid may then be reused.
+    # Where possible, wait for it to exit without collecting it, and then collect it while holding the lock.
+    # A process that finishes normally just as the timer fires has not timed out
+    timedOut = threading.Event()
+    lock = threading.Lock()
+    def expire(signum):
+        with lock:
+            if proc.returncode is None:
+                timedOut.set()
+                os.killpg(proc.pid, signum)
+    timers = [threading.Timer(tlimit, expire, [signal.SIGTERM]), threading.Timer(tlimit + killGrace, expire, [signal.SIGKILL])]
+    for timer in timers:
+        timer.start()
+    if hasattr(os, "waitid"):
+        os.waitid(os.P_PID, proc.pid, os.WEXITED | os.WNOWAIT)
+        lock.acquire()
+        pid, status, rusage = os.wait4(proc.pid, 0)
+    else:
+        pid, status, rusage = os.wait4(proc.pid, 0)
+        lock.acquire()
+    proc.returncode = os.waitstatus_to_exitcode(status)
+    lock.release()
+    for timer in timers:
+        timer.cancel()
+        timer.join()
+    if proc.returncode == 0:
+        timedOut.clear()
+    else:
+        # Remove processes the program left behind, such as its workers
+        try:
+            os.killpg(proc.pid, signal.SIGKILL)
+        except OSError:
+            # No processes left in group
+            pass
+    delta = datetime.datetime.now() - start
+    seconds = delta.seconds + 1e-6 * delta.microseconds
+    stage["seconds"] = round(seconds, 3)
+    stage["peakMb"] = round(peakMegabytes(rusage), 1)
+    outFile.seek(0)
+    output = outFile.read()
+    outFile.close()
+    errFile.close()
+    if timedOut.is_set():
         print("%s. %s Program timed out after %d seconds" % (root, prefix, tlimit))
         result += "%s ERROR: Timeout after %d seconds\n" % (prefix, tlimit)
-        delta = datetime.datetime.now() - start
-        seconds = delta.seconds + 1e-6 * delta.microseconds
         result += "%s LOG: Elapsed time = %.3f seconds\n" % (prefix, seconds)
         result += "%s OUTCOME: Timeout\n" % (prefix)
         logFile.write(result)
         logFile.close()
-        return False
+        stage["outcome"] = "timeout"
+        return stage
     ok = True
-    if cp.returncode != 0:
-        result += "%s ERROR: Return code = %d\n" % (prefix, cp.returncode)
-        result += "%s LOG: %s" % (prefix, killJobs(root))
+    if proc.returncode != 0:
+        result += "%s ERROR: Return code = %d\n" % (prefix, proc.returncode)
         ok = False
     outcome = "normal" if ok else "failed"
-    delta = datetime.datetime.now() - start
-    seconds = delta.seconds + 1e-6 * delta.microseconds
     result += "%s LOG: Elapsed time = %.3f seconds\n" % (prefix, seconds)
+    result += "%s LOG: Peak memory = %.1f MB\n" % (prefix, stage["peakMb"])
     result += "%s OUTCOME: %s\n" % (prefix, outcome)
     print("%s. %s: OUTCOME: %s" % (root, prefix, outcome))
     print("%s. %s: Elapsed time: %.3f seconds" % (root, prefix, seconds))
-    logFile.write(cp.stdout)
+    logFile.write(output)
     logFile.write(result)
-    return ok
+    stage["outcome"] = outcome
+    extractStats(output, stage)
+    return stage
 
 def genLogName(root, home):
     extension = "pbip_"
@@ -152,10 +254,11 @@ def runCnf(root, home):
         logFile = open(logName, "w")
     except:
         print("%s ERROR:Couldn't open file '%s'" % (root, logName))
-        return
-    ok = runProgram("CNF", root, cmd, logFile)
+        return None
+    stage = runProgram("CNF", root, cmd, logFile)
     print("File %s written" % logName)
     logFile.close()
+    return stage
 
 def runPbip(root, home):
     cnfName = home + "/" + root + ".cnf"
@@ -173,11 +276,11 @@ def runPbip(root, home):
         logFile = open(logName, "a")
     except:
         print("%s ERROR:Couldn't open file '%s'" % (root, logName))
-        return
-    ok = runProgram("PBIP", root, cmd, logFile)
+        return None
+    stage = runProgram("PBIP", root, cmd, logFile)
     print("File %s written" % logName)
     logFile.close()
-    return ok
+    return stage
 
 def runLrat(root, home):
     cnfName = home + "/" + root + ".cnf"
@@ -187,16 +290,16 @@ def runLrat(root, home):
         logFile = open(logName, "a")
     except:
         print("%s ERROR:Couldn't open file '%s'" % (root, logName))
-        return
+        return None
     cmd = [checkProgram]
     cmd += [cnfName]
     cmd += [lratName]
-    ok = runProgram("LRAT", root, cmd, logFile)
-    if ok:
+    stage = runProgram("LRAT", root, cmd, logFile)
+    if stage["outcome"] == "normal":
         os.remove(lratName)
     print("File %s written" % logName)
     logFile.close()
-    return ok
+    return stage
     
 
 def stripSuffix(fname):
@@ -205,29 +308,97 @@ def stripSuffix(fname):
         fields = fields[:-1]
     return ".".join(fields)
 
+# Run pipeline for single root.  Return dictionary of results.
+# Outcome is that of the first stage to fail
+def runRoot(root, home):
+    row = { "root" : root, "outcome" : "normal" }
+    for (prefix, fun) in zip(stageNames, [runCnf, runPbip, runLrat]):
+        stage = fun(root, home)
+        if stage is None:
+            stage = { "outcome" : "failed", "seconds" : 0.0, "peakMb" : 0.0 }
+        row[prefix.lower() + "Seconds"] = stage["seconds"]
+        row[prefix.lower() + "PeakMb"] = stage["peakMb"]
+        if prefix == "PBIP":
+            for key in statPatterns.keys():
+                row[key] = stage.get(key)
+        if stage["outcome"] != "normal" and row["outcome"] == "normal":
+            row["outcome"] = "%s %s" % (prefix, stage["outcome"])
+            if exitWhenError:
+                break
+    return row
+
+# Entry point for worker processes
+def runRootWorker(root, home, values):
+    setSettings(values)
+    return runRoot(root, home)
+
+def resultFields():
+    fields = ["root", "outcome"]
+    for prefix in stageNames:
+        fields += [prefix.lower() + "Seconds", prefix.lower() + "PeakMb"]
+    return fields + list(statPatterns.keys())
+
+def writeResults(rows, fname):
+    try:
+        outfile = open(fname, 'w', newline = '')
+    except:
+        print("Couldn't open results file '%s'" % fname)
+        return
+    if fname.split('.')[-1] == "json":
+        fields = resultFields()
+        json.dump([{ key : row.get(key) for key in fields } for row in rows], outfile, indent = 2)
+        outfile.write('\n')
+    else:
+        writer = csv.DictWriter(outfile, fieldnames = resultFields())
+        writer.writeheader()
+        for row in rows:
+            writer.writerow(row)
+    outfile.close()
+    print("File %s written" % fname)
+
 def runBatch(home, fileList, force):
     roots = [stripSuffix(f) for f in fileList]
     roots = [r for r in roots if r is not None]
     print("Running on roots %s" % roots)
+    todo = []
     for r in roots:
         logName = genLogName(r, home)
         if not force and os.path.exists(logName):
             print("Already have file '%s'.  Skipping" % logName)
             continue
-        if not runCnf(r, home) and exitWhenError:
-            print("CNF Error encountered.  Exiting")
-            break
-        if not runPbip(r, home) and exitWhenError:
-            print("PBIP Error encountered.  Exiting")
-            break
-        if not runLrat(r, home) and exitWhenError:
-            print("LRAT Error encountered.  Exiting")
-            break
+        todo.append(r)
+    rows = []
+    if workerCount <= 1:
+        for r in todo:
+            row = runRoot(r, home)
+            rows.append(row)
+            if row["outcome"] != "normal" and exitWhenError:
+                print("%s encountered.  Exiting" % row["outcome"])
+                break
+    else:
+        executor = concurrent.futures.ProcessPoolExecutor(max_workers = workerCount)
+        futures = [executor.submit(runRootWorker, r, home, settings()) for r in todo]
+        stopping = False
+        for future in concurrent.futures.as_completed(futures):
+            if future.cancelled():
+                continue
+            row = future.result()
+            rows.append(row)
+            if row["outcome"] != "normal" and exitWhenError and not stopping:
+                print("%s encountered for %s.  Exiting once running pipelines complete" % (row["outcome"], row["root"]))
+                stopping = True
+                for f in futures:
+                    f.cancel()
+        executor.shutdown(wait = True)
+        # Report in order of roots
+        rows.sort(key = lambda row : todo.index(row["root"]))
+    if resultName is not None:
+        writeResults(rows, resultName)
 
 def run(name, args):
-    global verbLevel, force, nameFile, modeFlag, exitWhenError
+    global verbLevel, force, nameFile, modeFlag, exitWhenError, memoryLimit, workerCount, resultName
     home = "."
-    optList, args = getopt.getopt(args, "hfxv:m:t:l:")
+    optList, args = getopt.getopt(args, "hfxv:m:t:M:j:r:l:")
     for (opt, val) in optList:
         if opt == '-h':
             usage(name)
@@ -246,6 +417,12 @@ def run(name, args):
             modeFlag = val
         elif opt == '-t':
             setTimeLimit(int(val))
+        elif opt == '-M':
+            memoryLimit = int(val)
+        elif opt == '-j':
+            workerCount = int(val)
+        elif opt == '-r':
+            resultName = val
         elif opt == '-l':
             nameFile = val
         else:
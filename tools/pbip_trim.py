@@ -0,0 +1,274 @@
+#!/usr/bin/python3
+
+# Trim LRAT proof, keeping only the clauses on which the empty clause depends.
+# Renumbers the kept clauses densely and deletes each clause after its last use.
+#
+# Works in three passes, with memory proportional to the number of live clauses:
+# 1. Read the proof, writing its additions to a temporary file as records
+#    that can be read in reverse order.
+# 2. Read the records in reverse, starting from the empty clause.
+#    Maintain the set of clauses required by the kept clauses that follow.
+#    A clause is kept if it is in this set, and a hint that is not yet in the set
+#    is being used for the last time.  Write kept clauses to a second temporary file.
+# 3. Read the kept clauses in reverse order, and hence in their original order,
+#    assigning new Ids and generating the output proof.
+
+import sys
+import getopt
+import datetime
+import tempfile
+
+import stream
+
+def usage(name):
+    print("Usage %s: [-h] [-v VERB] [-i FILE.cnf] -l FILE.lrat -o FILE.lrat" % name)
+    print("  -h           Print this message")
+    print("  -v VERB      Set verbosity level")
+    print("  -i FILE.cnf  Input CNF file.  Used to get number of input clauses")
+    print("  -l FILE.lrat Input proof file.  Binary format if name has suffix .lratb")
+    print("  -o FILE.lrat Output proof file.  Binary format if name has suffix .lratb")
+    print("  Proof files are compressed when name has additional suffix (%s)" % ", ".join(["." + s for s in stream.proofCodecs.keys()]))
+
+class TrimException(Exception):
+
+    def __init__(self, value):
+        self.value = value
+
+    def __str__(self):
+        return "Trim Exception: " + str(self.value)
+
+# Get number of input clauses from header of CNF file
+def cnfClauseCount(cnfName):
+    try:
+        infile = open(cnfName, 'r')
+    except Exception:
+        raise TrimException("Couldn't open CNF file '%s'" % cnfName)
+    for line in infile:
+        fields = line.split()
+        if len(fields) == 4 and fields[0] == 'p' and fields[1] == 'cnf':
+            infile.close()
+            return int(fields[3])
+    infile.close()
+    raise TrimException("No header found in CNF file '%s'" % cnfName)
+
+# Generate clause additions in proof as triples (id, literals, hints)
+# Deletions are ignored, since the trimmed proof has its own
+def textAdditions(infile):
+    for line in infile:
+        fields = line.split()
+        if len(fields) == 0 or fields[0] == b'c' or fields[1] == b'd':
+            continue
+        ilist = [int(f) for f in fields]
+        split = ilist.index(0, 1)
+        yield (ilist[0], ilist[1:split], ilist[split+1:-1])
+
+def binaryAdditions(infile):
+    ints = stream.decompressStream(infile)
+    for cid in ints:
+        command = next(ints)
+        first = []
+        for x in ints:
+            if x == 0:
+                break
+            first.append(x)
+        if command == ord('a'):
+            hints = []
+            for x in ints:
+                if x == 0:
+                    break
+                hints.append(x)
+            yield (cid, first, hints)
+        elif command != ord('d'):
+            raise TrimException("Invalid command code %d in binary proof" % command)
+
+# Records in temporary files consist of lists of integers, each list preceded by its length.
+# Records are followed by their length in bytes, so that they can be read in reverse order
+def writeRecord(file, lists):
+    buffer = bytearray()
+    for ilist in lists:
+        stream.compressInto(buffer, [len(ilist)])
+        stream.compressInto(buffer, ilist)
+    buffer += len(buffer).to_bytes(4, 'little')
+    file.write(buffer)
+
+def decodeRecord(data):
+    ca = stream.CompressArray()
+    ca.bytes = data
+    ints = ca.toList()
+    lists = []
+    pos = 0
+    while pos < len(ints):
+        length = ints[pos]
+        lists.append(ints[pos+1:pos+1+length])
+        pos += 1 + length
+    return lists
+
+def reverseRecords(file, blockSize = 1 << 20):
+    file.seek(0, 2)
+    start = file.tell()
+    data = bytearray()
+    while True:
+        if len(data) == 0 and start == 0:
+            return
+        if len(data) < 4:
+            start = refill(file, data, start, blockSize)
+        length = int.from_bytes(data[-4:], 'little')
+        while len(data) < length + 4:
+            start = refill(file, data, start, blockSize)
+        yield decodeRecord(data[-4-length:-4])
+        del data[-4-length:]
+
+# Prepend block preceding start position to data.  Return new start position
+def refill(file, data, start, blockSize):
+    if start == 0:
+        raise TrimException("Corrupted temporary file")
+    count = min(start, blockSize)
+    start -= count
+    file.seek(start)
+    data[0:0] = file.read(count)
+    return start
+
+class Trimmer:
+    verbLevel = 1
+    inputCount = 0
+    # Statistics
+    additionCount = 0
+    keptCount = 0
+    deletionCount = 0
+    maxLiveCount = 0
+
+    def __init__(self, verbLevel, inputCount = None):
+        self.verbLevel = verbLevel
+        self.inputCount = inputCount
+        self.additionCount = 0
+        self.keptCount = 0
+        self.deletionCount = 0
+        self.maxLiveCount = 0
+
+    # Pass 1.  Copy additions up through empty clause.  Return its Id
+    def readProof(self, lratName, tfile):
+        try:
+            infile = stream.openProofFile(lratName, 'rb')
+        except Exception:
+            raise TrimException("Couldn't open proof file '%s'" % lratName)
+        binary = stream.proofExtension(lratName) == "lratb"
+        additions = binaryAdditions(infile) if binary else textAdditions(infile)
+        emptyId = None
+        for (cid, lits, hints) in additions:
+            if self.additionCount == 0 and self.inputCount is None:
+                self.inputCount = cid-1
+            self.additionCount += 1
+            writeRecord(tfile, [[cid], lits, hints])
+            if len(lits) == 0:
+                emptyId = cid
+                break
+        infile.close()
+        if emptyId is None:
+            raise TrimException("Proof does not contain empty clause")
+        return emptyId
+
+    # Pass 2.  Find required clauses and their last uses
+    def markProof(self, emptyId, tfile, kfile):
+        required = set([emptyId])
+        for (cidList, lits, hints) in reverseRecords(tfile):
+            cid = cidList[0]
+            if cid not in required:
+                continue
+            required.remove(cid)
+            lastUses = []
+            # Negative hints occur in RAT steps, and refer to the clauses having the negated pivot
+            for hint in map(abs, hints):
+                if hint not in required:
+                    required.add(hint)
+                    lastUses.append(hint)
+            if cid == emptyId:
+                lastUses = []
+            self.maxLiveCount = max(self.maxLiveCount, len(required))
+            writeRecord(kfile, [cidList, lits, hints, lastUses])
+
+    # Pass 3.  Renumber clauses and write the trimmed proof
+    def writeProof(self, kfile, outName):
+        binary = stream.proofExtension(outName) == "lratb"
+        try:
+            outfile = stream.ProofWriter(stream.openProofFile(outName))
+        except Exception:
+            raise TrimException("Couldn't open proof file '%s'" % outName)
+        # Mapping from old Id to new Id for live clauses.  Input clauses keep their Ids
+        idMap = {}
+        nextId = self.inputCount + 1
+        for (cidList, lits, hints, lastUses) in reverseRecords(kfile):
+            hints = [idMap.get(hint, hint) if hint > 0 else -idMap.get(-hint, -hint) for hint in hints]
+            idMap[cidList[0]] = nextId
+            if binary:
+                outfile.writeCompressed([nextId, ord('a')] + lits + [0] + hints + [0])
+            else:
+                outfile.writeLine([nextId] + lits + [0] + hints + [0])
+            self.keptCount += 1
+            if len(lastUses) > 0:
+                deletions = [idMap.pop(cid, cid) for cid in lastUses]
+                if binary:
+                    outfile.writeCompressed([nextId, ord('d')] + deletions + [0])
+                else:
+                    outfile.writeLine([nextId, 'd'] + deletions + [0])
+                self.deletionCount += len(deletions)
+            nextId += 1
+        outfile.close()
+
+    def run(self, lratName, outName):
+        tfile = tempfile.TemporaryFile()
+        kfile = tempfile.TemporaryFile()
+        emptyId = self.readProof(lratName, tfile)
+        self.markProof(emptyId, tfile, kfile)
+        tfile.close()
+        self.writeProof(kfile, outName)
+        kfile.close()
+
+    def summarize(self):
+        if self.verbLevel >= 1:
+            print("TRIM: Clauses added in original proof: %d" % self.additionCount)
+            print("TRIM: Clauses kept: %d" % self.keptCount)
+            print("TRIM: Clauses deleted: %d" % self.deletionCount)
+            print("TRIM: Maximum live clauses: %d" % self.maxLiveCount)
+
+def run(name, argList):
+    verbLevel = 1
+    cnfName = ""
+    lratName = ""
+    outName = ""
+    optlist, args = getopt.getopt(argList, "hv:i:l:o:")
+    for (opt, val) in optlist:
+        if opt == '-h':
+            usage(name)
+            return
+        elif opt == '-v':
+            verbLevel = int(val)
+        elif opt == '-i':
+            cnfName = val
+        elif opt == '-l':
+            lratName = val
+        elif opt == '-o':
+            outName = val
+        else:
+            print("Unknown option '%s'" % opt)
+            usage(name)
+            return
+    if lratName == "" or outName == "":
+        print("ERROR: Must give names of input and output proof files")
+        usage(name)
+        return
+    start = datetime.datetime.now()
+    try:
+        inputCount = None if cnfName == "" else cnfClauseCount(cnfName)
+        trimmer = Trimmer(verbLevel, inputCount)
+        trimmer.run(lratName, outName)
+    except TrimException as ex:
+        print("ERROR: %s" % str(ex))
+        return
+    trimmer.summarize()
+    delta = datetime.datetime.now() - start
+    seconds = delta.seconds + 1e-6 * delta.microseconds
+    if verbLevel > 0:
+        print("TRIM: Elapsed seconds: %.2f" % (seconds))
+
+if __name__ == "__main__":
+    run(sys.argv[0], sys.argv[1:])
@@ -28,6 +28,7 @@
 import sys
 import random
 import queue
+import bisect
 
 import bdd
 import resolver
@@ -42,6 +43,10 @@ modulusAuto = 0
 randomizePivots = True
 # Delay BDD evaluation
 delayJustification = True
+# Switch from offset-based to interval-based BDD construction for a constraint
+# once some level needs more than this many offsets per constraint variable.
+# None: Always use offsets
+intervalOffsetFactor = 1024
 
 # In case don't have logger
 class SimpleWriter:
@@ -633,52 +638,20 @@ class EquationSystem:
     # operandList is list of equations from which this one was derived
     def justifyEquation(self, e, operandList):
         e.buildBdd(self)
-        rvList = [(eq.root,eq.validation) for eq in operandList]
-        done = False
-        while not done and len(rvList) > 2:
-            r1,v1 = rvList[0]
-            r2,v2 = rvList[1]
-            validation = None
-            antecedents = [v1,v2]
-            nr,imp = self.manager.applyAndJustify(r1, r2)
-            if nr == self.manager.leaf0:
-                comment = "Validation of Empty clause"
-                done = True
-            else:
-                comment = "Validation of %s" % nr.label()
-            if imp == resolver.tautologyId:
-                if nr == r1:
-                    validation = v1
-                elif nr == r2:
-                    validation = v2
-            else:
-                antecedents += [imp]
-            if validation is None:
-                validation = self.manager.prover.createClause([nr.id], antecedents, comment)
-            rvList = [(nr,validation)] + rvList[2:]
-        if not done: 
-            if len(rvList) == 2:
-                # Do final conjunction and implication in combination
-                r1,v1 = rvList[0]
-                r2,v2 = rvList[1]
-                antecedents = [v1,v2]
-                check, implication = self.manager.applyAndJustifyImply(r1, r2, e.root)
-                if not check:
-                    raise ProofGenerationException("Implication failed when spawning equation %s: %s % %s -/-> %s\n" % (str(e), r1.label(), r2.label(), e.root.label()))
-            else:
-                r1, v1 = rvList[0]
-                antecedents = [v1]
-                check, implication = self.manager.justifyImply(r1, e.root)
-                if not check:
-                    raise ProofGenerationException("Implication failed when spawning equation %s: %s -/-> %s\n" % (str(e), r1.label(), e.root.label()))
-            if implication != resolver.tautologyId:
-                antecedents += [implication]
-            done = e.root == self.manager.leaf0
-            if done:
-                comment = "Validation of empty clause from infeasible equation"
-            else:
-                comment = "Validation of equation with BDD root %s" % e.root.label()
-            e.validation = self.manager.prover.createClause([e.root.id], antecedents, comment)
+        # Conjunction of operands and implication in combination
+        rootList = [eq.root for eq in operandList]
+        antecedents = [eq.validation for eq in operandList]
+        check, implication = self.manager.applyAndManyJustify(rootList, e.root)
+        if not check:
+            raise ProofGenerationException("Implication failed when spawning equation %s: %s -/-> %s\n" % (str(e), " & ".join([r.label() for r in rootList]), e.root.label()))
+        if implication != resolver.tautologyId:
+            antecedents += [implication]
+        done = e.root == self.manager.leaf0
+        if done:
+            comment = "Validation of empty clause from infeasible equation"
+        else:
+            comment = "Validation of equation with BDD root %s" % e.root.label()
+        e.validation = self.manager.prover.createClause([e.root.id], antecedents, comment)
         if done:
             self.writer.write("UNSAT\n")
             self.manager.summarize()
@@ -997,52 +970,20 @@ class Constraint:
         con = Constraint(self.N, cval)
         con.nz = nnz
         con.buildBdd(csys)
-        rvList = [(c.root, c.validation) for c in operandList]
-        done = False
-        while not done and len(rvList) > 2:
-            r1,v1 = rvList[0]
-            r2,v2 = rvList[1]
-            validation = None
-            antecedents = [v1,v2]
-            nr, imp = csys.manager.applyAndJustify(r1, r2)
-            if nr == csys.manager.leaf0:
-                comment = "Validation of Empty clause"
-                done = True
-            else:
-                comment = "Validation of %s" % nr.label()
-            if imp == resolver.tautologyId:
-                if nr == r1:
-                    validation = v1
-                elif nr == r2:
-                    validation = v2
-            else:
-                antecedents += [imp]
-            if validation is None:
-                validation = csys.manager.prover.createClause([nr.id], antecedents, comment)
-            rvList = [(nr,validation)] + rvList[2:]
-        if not done:
-            if len(rvList) == 2:
-                # Do final conjunction and implication in combination
-                r1,v1 = rvList[0]
-                r2,v2 = rvList[1]
-                antecedents = [v1,v2]
-                check, implication = csys.manager.applyAndJustifyImply(r1, r2, con.root)
-                if not check:
-                    raise ProofGenerationException("Implication failed when spawning constraint %s: %s & %s -/-> %s\n" % (str(con), r1.label(), r2.label(), con.root.label()))
-            else:
-                r1,v1 = rvList[0]
-                antecedents = [v1]
-                check, implication = csys.manager.justifyImply(r1, con.root)
-                if not check:
-                    raise ProofGenerationException("Implication failed when spawning constraint %s: %s -/-> %s\n" % (str(con), r1.label(), con.root.label()))
-            if implication != resolver.tautologyId:
-                antecedents += [implication]
-            done = con.root == csys.manager.leaf0
-            if done:
-                comment = "Validation of empty clause from infeasible constraint"
-            else:
-                comment = "Validation of constraint with BDD root %s" % con.root.label()
-            con.validation = csys.manager.prover.createClause([con.root.id], antecedents, comment)
+        # Conjunction of operands and implication in combination
+        rootList = [c.root for c in operandList]
+        antecedents = [c.validation for c in operandList]
+        check, implication = csys.manager.applyAndManyJustify(rootList, con.root)
+        if not check:
+            raise ProofGenerationException("Implication failed when spawning constraint %s: %s -/-> %s\n" % (str(con), " & ".join([r.label() for r in rootList]), con.root.label()))
+        if implication != resolver.tautologyId:
+            antecedents += [implication]
+        done = con.root == csys.manager.leaf0
+        if done:
+            comment = "Validation of empty clause from infeasible constraint"
+        else:
+            comment = "Validation of constraint with BDD root %s" % con.root.label()
+        con.validation = csys.manager.prover.createClause([con.root.id], antecedents, comment)
         if done:
             csys.writer.write("UNSAT\n")
             csys.manager.summarize()
@@ -1116,6 +1057,10 @@ class Constraint:
             break
         return True
 
+    # Normalized form of constraint.  Structurally identical constraints have equal keys
+    def internKey(self):
+        return (tuple(sorted(self.nz.items())), self.cval)
+
     def isCardinality(self):
         for coeff in self.nz.values():
             if abs(coeff) != 1:
@@ -1136,8 +1081,10 @@ class Constraint:
             lits.append(coeff * var)
         return lits if self.cval == 1-ncount else None
 
-    # Generate BDD representation
-    def buildBdd(self, csys):
+    # Generate BDD representation.
+    # Unless allowInterval is False, hands off to buildIntervalBdd when the number of offsets
+    # at some level exceeds intervalOffsetFactor times the number of variables
+    def buildBdd(self, csys, allowInterval = True):
         ilist = self.indices()
         if len(ilist) == 0:
             self.root = csys.manager.leaf1 if self.cval <= 0 else csys.manager.leaf0
@@ -1145,6 +1092,9 @@ class Constraint:
             return
 
         ilist.sort(key = lambda id : csys.levelMap[id])
+        offsetLimit = None
+        if allowInterval and intervalOffsetFactor is not None:
+            offsetLimit = intervalOffsetFactor * len(ilist)
         # Determine at what offsets will need node, starting from root and working down
         needNodes = { i : {} for i in ilist }
         previ = ilist[0]
@@ -1156,6 +1106,9 @@ class Constraint:
                 # Will need this offset when variable evaluates to 1
                 noffset = offset + self[previ]
                 needNodes[nexti][noffset] = True
+            if offsetLimit is not None and len(needNodes[nexti]) > offsetLimit:
+                self.buildIntervalBdd(csys)
+                return
             previ = nexti
 
         # Now build BDD from bottom up
@@ -1194,6 +1147,128 @@ class Constraint:
             
         self.root = nodes[ilist[0]][0]
         self.size = csys.manager.getSize(self.root)
+
+    # Generate BDD representation, with cost proportional to BDD size rather than range of offsets.
+    # At each level, a node represents the interval of thresholds [beta, gamma] for which the
+    # remaining variables give the same function.
+    # Nodes are created in the same order as with buildBdd, and so the results are identical
+    # Pays off only when the reachable offsets greatly outnumber the BDD nodes, as with coefficients
+    # that are powers of two.  Otherwise node creation dominates, and buildBdd has less overhead.
+    # Entries at each level are kept sorted in blocks of bounded size, so that insertion
+    # does not require shifting all entries at the level
+    def buildIntervalBdd(self, csys):
+        ilist = self.indices()
+        if len(ilist) == 0:
+            self.root = csys.manager.leaf1 if self.cval <= 0 else csys.manager.leaf0
+            self.size = 1
+            return
+
+        ilist.sort(key = lambda id : csys.levelMap[id])
+        coeffs = [self[i] for i in ilist]
+        n = len(ilist)
+        # Range of sums achievable by variables at levels j and below.
+        # Threshold <= minSum[j] gives true, and threshold > maxSum[j] gives false
+        minSum = [0] * (n+1)
+        maxSum = [0] * (n+1)
+        for j in range(n-1, -1, -1):
+            a = coeffs[j]
+            minSum[j] = minSum[j+1] + min(a, 0)
+            maxSum[j] = maxSum[j+1] + max(a, 0)
+        # Entries 0 and 1 are the leaves
+        entryBeta = [None, None]
+        entryGamma = [None, None]
+        entryLow = [None, None]
+        entryHigh = [None, None]
+        # For each level, the entries sorted by lower bound, split into blocks.
+        # levelFirsts holds the lowest bound in each block
+        blockSize = 64
+        levelFirsts = [[] for j in range(n)]
+        levelBetas = [[] for j in range(n)]
+        levelEntries = [[] for j in range(n)]
+
+        def lookup(j, r):
+            if r <= minSum[j]:
+                return 1
+            if r > maxSum[j]:
+                return 0
+            b = bisect.bisect_right(levelFirsts[j], r) - 1
+            if b >= 0:
+                betas = levelBetas[j][b]
+                e = levelEntries[j][b][bisect.bisect_right(betas, r) - 1]
+                if r <= entryGamma[e]:
+                    return e
+            return None
+
+        def insert(j, beta, e):
+            firsts = levelFirsts[j]
+            if len(firsts) == 0:
+                firsts.append(beta)
+                levelBetas[j].append([beta])
+                levelEntries[j].append([e])
+                return
+            b = max(bisect.bisect_right(firsts, beta) - 1, 0)
+            betas = levelBetas[j][b]
+            entries = levelEntries[j][b]
+            pos = bisect.bisect_right(betas, beta)
+            betas.insert(pos, beta)
+            entries.insert(pos, e)
+            if pos == 0:
+                firsts[b] = beta
+            if len(betas) > 2 * blockSize:
+                # Split block in half
+                firsts.insert(b+1, betas[blockSize])
+                levelBetas[j].insert(b+1, betas[blockSize:])
+                levelEntries[j].insert(b+1, entries[blockSize:])
+                del betas[blockSize:]
+                del entries[blockSize:]
+
+        # Interval of thresholds for entry at level j
+        def interval(j, e):
+            if e == 1:
+                return (float('-inf'), minSum[j])
+            if e == 0:
+                return (maxSum[j]+1, float('inf'))
+            return (entryBeta[e], entryGamma[e])
+
+        # Determine intervals, working down from root with explicit stack
+        stack = [(0, self.cval)]
+        while len(stack) > 0:
+            j, r = stack[-1]
+            if lookup(j, r) is not None:
+                stack.pop()
+                continue
+            a = coeffs[j]
+            e0 = lookup(j+1, r)
+            if e0 is None:
+                stack.append((j+1, r))
+                continue
+            e1 = lookup(j+1, r-a)
+            if e1 is None:
+                stack.append((j+1, r-a))
+                continue
+            stack.pop()
+            beta0, gamma0 = interval(j+1, e0)
+            beta1, gamma1 = interval(j+1, e1)
+            beta = max(beta0, beta1 + a)
+            gamma = min(gamma0, gamma1 + a)
+            e = len(entryBeta)
+            entryBeta.append(beta)
+            entryGamma.append(gamma)
+            entryLow.append(e0)
+            entryHigh.append(e1)
+            insert(j, beta, e)
+
+        # Now build BDD from bottom up.  Within level, create in order of decreasing threshold
+        nodes = {0 : csys.manager.leaf0, 1 : csys.manager.leaf1}
+        for j in range(n-1, -1, -1):
+            var = csys.varMap[ilist[j]]
+            for entries in reversed(levelEntries[j]):
+                for e in reversed(entries):
+                    low = nodes[entryLow[e]]
+                    high = nodes[entryHigh[e]]
+                    nodes[e] = low if low == high else csys.manager.findOrMake(var, high, low)
+        self.root = nodes[lookup(0, self.cval)]
+        self.size = csys.manager.getSize(self.root)
     
     # What is the largest coefficient absolute value
     def maxCoefficient(self):
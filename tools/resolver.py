@@ -21,6 +21,8 @@
 # Resolution engine tailored to generating proofs 
 # having a "V" structure, consisting of two linear chains merging together
 
+import itertools
+
 # Special value to represent true/tautology
 # Its negation represents false/invalid
 tautologyId = 1000 * 1000 * 1000
@@ -33,7 +35,8 @@ tautologyId = 1000 * 1000 * 1000
 def cleanClause(literalList):
     if literalList == tautologyId:
         return literalList
-    slist = sorted(literalList, key = lambda v: -abs(v))
+    # Sort is stable, and so literals with the same variable keep their order
+    slist = sorted(literalList, key = abs, reverse = True)
     while len(slist) > 0:
         # Tautology and Null will be in front
         first = slist[0]
@@ -46,13 +49,15 @@ def cleanClause(literalList):
     if len(slist) <= 1:
         return slist
     else:
-        nlist = [slist[0]]
-        for i in range(1, len(slist)):
-            if slist[i-1] == slist[i]:
+        prev = slist[0]
+        nlist = [prev]
+        for lit in slist[1:]:
+            if lit == prev:
                 continue
-            if slist[i-1] == -slist[i]:
+            if lit == -prev:
                 return tautologyId
-            nlist.append(slist[i])
+            nlist.append(lit)
+            prev = lit
         return nlist
 
 def testClauseEquality(clause1, clause2):
@@ -97,17 +102,27 @@ class VResolver:
     prover = None
     clauseHighNames = ["WHU", "UHD", "VHD", "WHD", "UHU", "VHU", "OPH"]
     clauseLowNames = ["WLU", "ULD", "VLD", "WLD", "ULU", "VLU", "OPL"]
+    clauseNames = clauseHighNames + clauseLowNames
     clauseHighKey = "OPH"
     clauseLowKey = "OPL"
     antecedentCount = 0
     clauseCount = 0
     runCount = 0
+    # Proof templates.  Map from problem signature to list of proof steps.
+    # Each step is tuple (split, keys), where split indicates that target includes
+    # split variable, and keys lists the hints used as antecedents, in order,
+    # with None denoting the preceding step
+    templates = {}
+    templateLimit = 100000
+    templateCount = 0
 
     def __init__(self, prover):
         self.prover = prover
         self.antecedentCount = 0
         self.clauseCount = 0
         self.runCount = 0
+        self.templates = {}
+        self.templateCount = 0
 
     def cleanHints(self, hints):
         for k in list(hints.keys()):
@@ -115,82 +130,130 @@ class VResolver:
             if id == tautologyId:
                 del hints[k]
 
+    # Problems with the same signature are identical up to renaming of variables,
+    # and so have the same proof.
+    # Signature consists of the hints present, the clause lengths, the variables numbered
+    # in order of first occurrence, and the literal polarities
+    def signature(self, targetClause, splitVariable, hints):
+        clauses = [targetClause, [splitVariable]]
+        mask = 0
+        bit = 1
+        for key in self.clauseNames:
+            if key in hints:
+                clause = hints[key][1]
+                if clause == tautologyId:
+                    return None
+                clauses.append(clause)
+                mask |= bit
+            bit <<= 1
+        literals = list(itertools.chain.from_iterable(clauses))
+        varMap = {}
+        codes = [varMap.setdefault(var, len(varMap)) for var in map(abs, literals)]
+        return (mask, tuple(map(len, clauses)), tuple(codes), tuple(map((0).__lt__, literals)))
+
     def run(self, targetClause, splitVariable, hints, comment):
         self.cleanHints(hints)
         self.runCount += 1
+        signature = self.signature(targetClause, splitVariable, hints)
+        if signature is not None:
+            template = self.templates.get(signature)
+            if template is not None:
+                self.templateCount += 1
+                return self.applyTemplate(template, targetClause, splitVariable, hints, comment)
+        template, id = self.search(targetClause, splitVariable, hints, comment)
+        if signature is not None and len(self.templates) < self.templateLimit:
+            self.templates[signature] = template
+        return id
+
+    def applyTemplate(self, template, targetClause, splitVariable, hints, comment):
+        id1 = None
+        for (split, keys) in template:
+            targ = [-splitVariable] + targetClause if split else targetClause
+            antecedents = [id1 if key is None else hints[key][0] for key in keys]
+            id = self.generateProofStep(targ, antecedents, comment if id1 is None else None)
+            if split:
+                id1 = id
+        if id1 is None:
+            return id
+        # Negative value indicates that preceding clause was generated as intermediate step
+        return -id if id1 == id-1 else id
+
+    # Search for proof, using RUP checks.  Return (template, id)
+    def search(self, targetClause, splitVariable, hints, comment):
         if self.clauseHighKey not in hints:
             # Try for single line proof
             targ =  targetClause
-            idList = []
-            clauseList = []
-            for id in self.clauseHighNames:
-                if id in hints:
-                    (cid, clause) = hints[id]
-                    idList.append(cid)
-                    clauseList.append(clause)
-            for id in self.clauseLowNames:
-                if id in hints:
-                    (cid, clause) = hints[id]
-                    idList.append(cid)
-                    clauseList.append(clause)
-            alist = self.RupCheck(targ, idList, clauseList)
+            keyList = [key for key in self.clauseHighNames + self.clauseLowNames if key in hints]
+            clauseList = [hints[key][1] for key in keyList]
+            alist = self.RupCheck(targ, keyList, clauseList)
             if alist is not None:
-                id = self.generateProofStep(targ, alist, comment)
-                return id
+                id = self.generateProofStep(targ, [hints[key][0] for key in alist], comment)
+                return ([(False, alist)], id)
 
         if self.clauseLowKey not in hints:
             # Try for single line proof
             targ =  targetClause
-            idList = []
-            clauseList = []
-            for id in self.clauseLowNames:
-                if id in hints:
-                    (cid, clause) = hints[id]
-                    idList.append(cid)
-                    clauseList.append(clause)
-            for id in self.clauseHighNames:
-                if id in hints:
-                    (cid, clause) = hints[id]
-                    idList.append(cid)
-                    clauseList.append(clause)
-            alist = self.RupCheck(targ, idList, clauseList)
+            keyList = [key for key in self.clauseLowNames + self.clauseHighNames if key in hints]
+            clauseList = [hints[key][1] for key in keyList]
+            alist = self.RupCheck(targ, keyList, clauseList)
             if alist is not None:
-                id = self.generateProofStep(targ, alist, comment)
-                return id
+                id = self.generateProofStep(targ, [hints[key][0] for key in alist], comment)
+                return ([(False, alist)], id)
             
         if True:
             # Must split into two-line proof
             targ =  [-splitVariable] + targetClause
-            idList = []
-            clauseList = []
-            for id in self.clauseHighNames:
-                if id in hints:
-                    (cid, clause) = hints[id]
-                    idList.append(cid)
-                    clauseList.append(clause)
-            alist = self.RupCheck(targ, idList, clauseList)
-            if alist is None:
-                clist = [str(key) for key in idList]
+            keyList = [key for key in self.clauseHighNames if key in hints]
+            clauseList = [hints[key][1] for key in keyList]
+            alist1 = self.RupCheck(targ, keyList, clauseList)
+            if alist1 is None:
+                clist = [key + ":" + str(hints[key][0]) for key in keyList]
                 raise ResolveException("Couldn't prove positive target: %s using candidates %s" % (str(targ), str(clist)))
             else:
-                id1 = self.generateProofStep(targ, alist, comment)
-            idList = [id1]
+                id1 = self.generateProofStep(targ, [hints[key][0] for key in alist1], comment)
+            keyList = [None]
             clauseList = [targ]
             targ = targetClause
-
-            for id in self.clauseLowNames:
-                if id in hints:
-                    (cid, clause) = hints[id]
-                    idList.append(cid)
-                    clauseList.append(clause)
-            alist = self.RupCheck(targ, idList, clauseList)
-            if alist is None:
-                clist = [key + ":" + str(hints[key][0]) for key in idList]
+            for key in self.clauseLowNames:
+                if key in hints:
+                    keyList.append(key)
+                    clauseList.append(hints[key][1])
+            alist2 = self.RupCheck(targ, keyList, clauseList)
+            if alist2 is None:
+                clist = [str(id1)] + [key + ":" + str(hints[key][0]) for key in keyList[1:]]
                 raise ResolveException("Couldn't prove final target: %s using candidates %s" % (str(targ), str(clist)))
             else:
-                id = self.generateProofStep(targ, alist, None)
-                return id
+                id = self.generateProofStep(targ, [id1 if key is None else hints[key][0] for key in alist2], None)
+                # Negative value indicates that preceding clause was generated as intermediate step
+                return ([(True, alist1), (False, alist2)], -id if id1 == id-1 else id)
     
+    # Proof for operations with arbitrary numbers of arguments.
+    # Hints for the two branches are given as lists of pairs (clause id, clause),
+    # each listed in the order in which it should propagate
+    def runSplit(self, targetClause, splitVariable, highHints, lowHints, comment):
+        highHints = [(id, clause) for (id, clause) in highHints if id != tautologyId and clause != tautologyId]
+        lowHints = [(id, clause) for (id, clause) in lowHints if id != tautologyId and clause != tautologyId]
+        self.runCount += 1
+        # Try for single line proof
+        hints = highHints + lowHints
+        alist = self.RupCheck(targetClause, [id for (id, clause) in hints], [list(clause) for (id, clause) in hints])
+        if alist is not None:
+            return self.generateProofStep(targetClause, alist, comment)
+        # Must split into two-line proof
+        targ = [-splitVariable] + targetClause
+        alist1 = self.RupCheck(targ, [id for (id, clause) in highHints], [list(clause) for (id, clause) in highHints])
+        if alist1 is None:
+            raise ResolveException("Couldn't prove positive target: %s using candidates %s" % (str(targ), str(highHints)))
+        id1 = self.generateProofStep(targ, alist1, comment)
+        keyList = [id1] + [id for (id, clause) in lowHints]
+        clauseList = [targ] + [list(clause) for (id, clause) in lowHints]
+        alist2 = self.RupCheck(targetClause, keyList, clauseList)
+        if alist2 is None:
+            raise ResolveException("Couldn't prove final target: %s using candidates %s" % (str(targetClause), str([id1] + lowHints)))
+        id = self.generateProofStep(targetClause, alist2, None)
+        # Negative value indicates that preceding clause was generated as intermediate step
+        return -id if id1 == id-1 else id
+
     def generateProofStep(self, target, antecedents, comment):
         self.prover.proofCount += 1
         self.antecedentCount += len(antecedents)
@@ -202,36 +265,45 @@ class VResolver:
             antecedentAvg = float(self.antecedentCount) / float(self.runCount)
             clauseAvg = float(self.clauseCount) / float(self.runCount)
             self.prover.writer.write("  Avg antecedents / proof = %.2f.  Avg clauses / proof = %.2f.\n" % (antecedentAvg, clauseAvg))
+            templateFraction = float(self.templateCount) / float(self.runCount)
+            self.prover.writer.write("  Proofs from templates = %d (%.1f%%).  Templates = %d.\n" % (self.templateCount, 100.0 * templateFraction, len(self.templates)))
 
     # Given list of possible antecedent IDs, see if can justify target clause
     # If so, return modified version of clause Ids containing those involved in propagation
+    # Single pass over clauses in order, with assigned literals kept as set
     def RupCheck(self, targetClause, clauseIdList, clauseList):
-        units = [-lit for lit in targetClause]
+        units = set([-lit for lit in targetClause])
         relevantIdList = []
         for (id, clause) in zip(clauseIdList, clauseList):
-            # Note that will modify clauses
-            # This is OK here, since clauses are constructed just for this one execution
+            length = len(clause)
+            copied = False
             idx = 0
-            while idx < len(clause):
+            while idx < length:
                 lit = clause[idx]
                 if -lit in units:
-                    if len(clause) == 1:
+                    if length == 1:
                         # Conflict detected
                         relevantIdList.append(id)
                         return relevantIdList
-                    # Remove lit from clause by swapping in last one
+                    # Remove lit from clause by swapping in last one.
+                    # The first removal modifies the caller's clause, as in earlier versions.
+                    # Later checks within the same run see this change, and so it is
+                    # kept to leave the proofs unchanged.  Later removals work on a private copy
                     clause[idx] = clause[-1]
-                    clause = clause[:-1]
+                    if copied:
+                        clause.pop()
+                    else:
+                        clause = clause[:-1]
+                        copied = True
+                    length -= 1
                 elif lit in units:
                     # Clause becomes a tautology.  Not useful anymore
                     break
                 else:
                     idx += 1
-            if (len(clause) == 1):
+            if length == 1:
                 # Unit propagation
-                units.append(clause[0])
+                units.add(clause[0])
                 relevantIdList.append(id)
         # Reverse unit propagation failed
         return None
-            
-        
@@ -25,6 +25,8 @@ import getopt
 import datetime
 import random
 import signal
+import re
+from array import array
 
 import random
 
@@ -37,7 +39,7 @@ import pseudoboolean
 sys.setrecursionlimit(10 * sys.getrecursionlimit())
 
 def usage(name):
-    sys.stderr.write("Usage: %s [-h] [-b] [-B BPERM] [-v LEVEL] [-r SEED] [-i CNF] [-o file.{proof,lrat,lratb}] [-M t|b|p] [-p PERMUTE] [-s SCHEDULE] [-m MODULUS] [-L logfile] [-t TLIM] [-Z NZLIM]\n" % name)
+    sys.stderr.write("Usage: %s [-h] [-b] [-B BPERM] [-v LEVEL] [-r SEED] [-i CNF] [-o file.{proof,lrat,lratb}] [-M t|b|p] [-p PERMUTE] [-s SCHEDULE] [-m MODULUS] [-L logfile] [-t TLIM] [-Z NZLIM] [-c LIMITS]\n" % name)
     sys.stderr.write("  -h          Print this message\n")
     sys.stderr.write("  -b          Process terms via bucket elimination ordered by variable levels\n")
     sys.stderr.write("  -B BPERM    Process terms via bucket elimination ordered by permutation file BPERM\n")
@@ -45,6 +47,7 @@ def usage(name):
     sys.stderr.write("  -r SEED     Set random seed (for breaking ties during pivot selection)\n")
     sys.stderr.write("  -i CNF      Name of CNF input file\n")
     sys.stderr.write("  -o pfile    Name of proof output file (.drat = DRAT text, .lrat = LRAT text, .lratb = LRAT binary)\n")
+    sys.stderr.write("              Compressed when name has additional suffix (%s)\n" % ", ".join(["." + s for s in stream.proofCodecs.keys()]))
     sys.stderr.write("  -M (t|b|p)  Pipe proof to stdout (p = tracecheck, t = LRAT text, b = LRAT binary)\n")
     sys.stderr.write("  -p PERMUTE  Name of file specifying mapping from CNF variable to BDD level\n")
     sys.stderr.write("  -s SCHEDULE Name of action schedule file\n")
@@ -52,6 +55,8 @@ def usage(name):
     sys.stderr.write("  -L logfile  Append standard error output to logfile\n")
     sys.stderr.write("  -t TLIM     Set time limit for execution\n")
     sys.stderr.write("  -Z NZLIM    Set limit on number on nonzeros in when solving equations/constraints\n")
+    sys.stderr.write("  -c LIMITS   Limit entries in operation caches.  Either NUM for all operations, or list OP=NUM,...,OP=NUM\n")
+    sys.stderr.write("              Small limits cause work to be redone and can greatly increase proof size and runtime\n")
 
 # Verbosity levels
 # 0: Totally silent
@@ -261,15 +266,54 @@ class CnfException(Exception):
     def __str__(self):
         return "CNF Exception: " + str(self.value)
 
+# Read-only view of clauses stored in flat literal array.
+# Each clause occupies positions offsets[i] .. offsets[i+1]-2, followed by 0
+class ClauseList:
+    literals = None
+    offsets = None
+
+    def __init__(self, literals, offsets):
+        self.literals = literals
+        self.offsets = offsets
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    # Return clause as array of literals
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self.offsets) - 1
+        if i < 0 or i >= len(self.offsets) - 1:
+            raise IndexError("Clause index %d out of range" % i)
+        return self.literals[self.offsets[i]:self.offsets[i+1]-1]
+
+    def __iter__(self):
+        for i in range(len(self.offsets) - 1):
+            yield self.literals[self.offsets[i]:self.offsets[i+1]-1]
+
+    def literalCount(self):
+        return len(self.literals) - len(self.offsets) + 1
+
 # Read CNF file.
-# Save list of clauses, each is a list of literals (zero at end removed)
+# Save clauses in flat literal array, with view as list of clauses (zero at end removed)
 # Also saves comment lines
 class CnfReader():
     file = None
     commentLines = []
     clauses = []
+    # Flat storage.  Literals for all clauses, each terminated by 0, and starting position of each clause
+    literals = None
+    offsets = None
     nvar = 0
+    nclause = 0
     verbLevel = 1
+    # Number of characters read at a time
+    blockSize = 1 << 22
+    # Lines containing comments and header
+    specialPattern = re.compile(r'(?m)^[ \t]*[cp].*\n?')
+    # Nonblank lines, and lines ending with 0.  Used when lines have irregular spacing
+    nonblankPattern = re.compile(r'(?m)^[ \t\r]*[^\s]')
+    terminatedPattern = re.compile(r'(?m)(?:^|[ \t])0[ \t\r]*$')
     
     def __init__(self, fname = None, verbLevel = 1):
         self.verbLevel = verbLevel
@@ -282,7 +326,9 @@ class CnfReader():
                 self.file = open(fname, 'r')
             except Exception:
                 raise CnfException("Could not open file '%s'" % fname)
-        self.clauses = []
+        self.literals = array('i')
+        self.offsets = array('q', [0])
+        self.clauses = ClauseList(self.literals, self.offsets)
         self.commentLines = []
         try:
             self.readCnf()
@@ -290,56 +336,120 @@ class CnfReader():
             if opened:
                 self.file.close()
             raise ex
+
+    # File is only needed while reading, and so it is omitted when saving to a checkpoint
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["file"] = None
+        return state
         
+    # Read file in large blocks.  Clause lines within a block are parsed
+    # and validated in bulk.  Only on error are they processed line by line
     def readCnf(self):
         lineNumber = 0
-        nclause = 0
         self.nvar = 0
-        clauseCount = 0
-        for line in self.file:
+        self.nclause = 0
+        while True:
+            block = self.file.read(self.blockSize)
+            if len(block) == 0:
+                break
+            if block[-1] != '\n':
+                block += self.file.readline()
+            pos = 0
+            for match in self.specialPattern.finditer(block):
+                self.readClauses(block[pos:match.start()], lineNumber + block.count('\n', 0, pos))
+                self.readSpecial(match.group(), lineNumber + block.count('\n', 0, match.start()) + 1)
+                pos = match.end()
+            self.readClauses(block[pos:], lineNumber + block.count('\n', 0, pos))
+            lineNumber += block.count('\n')
+        clauseCount = len(self.clauses)
+        if clauseCount != self.nclause:
+            raise CnfException("Line %d: Got %d clauses.  Expected %d" % (lineNumber, clauseCount, self.nclause))
+        if self.verbLevel >= 2:
+            print("Read %d clauses with %d literals" % (clauseCount, self.clauses.literalCount()))
+
+    # Handle comment or header line
+    def readSpecial(self, line, lineNumber):
+        line = trim(line)
+        if line[0] == 'c':
+            if self.verbLevel > 1:
+                self.commentLines.append(line)
+        else:
+            fields = line[1:].split()
+            if len(fields) != 3 or fields[0] != 'cnf':
+                raise CnfException("Line %d.  Bad header line '%s'.  Not cnf" % (lineNumber, line))
+            try:
+                self.nvar = int(fields[1])
+                self.nclause = int(fields[2])
+            except Exception:
+                raise CnfException("Line %d.  Bad header line '%s'.  Invalid number of variables or clauses" % (lineNumber, line))
+
+    # Parse sequence of clause lines, following line lineNumber
+    def readClauses(self, text, lineNumber):
+        if len(text) == 0:
+            return
+        try:
+            lits = array('i', list(map(int, text.split())))
+        except (ValueError, OverflowError):
+            self.diagnoseClauses(text, lineNumber)
+        # Each line must contain a single 0, at its end
+        lineCount = text.count('\n') + (0 if text[-1] == '\n' else 1)
+        zeroCount = lits.count(0)
+        terminatedCount = text.count(' 0\n') + (1 if text.endswith(' 0') else 0)
+        if zeroCount != lineCount or terminatedCount != lineCount:
+            # Allow blank lines and other whitespace
+            lineCount = len(self.nonblankPattern.findall(text))
+            if lineCount == 0:
+                return
+            terminatedCount = len(self.terminatedPattern.findall(text))
+        if (self.nclause == 0 or zeroCount != lineCount or terminatedCount != lineCount
+            or max(lits) > self.nvar or min(lits) < -self.nvar):
+            self.diagnoseClauses(text, lineNumber)
+        # Only per-clause work is locating the terminating 0 and checking for duplicate variables
+        base = len(self.literals)
+        find = lits.index
+        ends = []
+        start = 0
+        for i in range(lineCount):
+            end = find(0, start)
+            if end == start or len(set(map(abs, lits[start:end]))) != end - start:
+                self.diagnoseClauses(text, lineNumber)
+            start = end + 1
+            ends.append(base + start)
+        self.offsets.extend(ends)
+        self.literals.extend(lits)
+
+    # Find first invalid clause line and report error
+    def diagnoseClauses(self, text, lineNumber):
+        for line in text.split('\n'):
             lineNumber += 1
             line = trim(line)
-            if len(line) == 0:
+            if len(line) == 0 or len(line.split()) == 0:
                 continue
-            fields = line.split()
-            if len(fields) == 0:
-                continue
-            elif line[0] == 'c':
-                if self.verbLevel > 1:
-                    self.commentLines.append(line)
-            elif line[0] == 'p':
-                fields = line[1:].split()
-                if len(fields) != 3 or fields[0] != 'cnf':
-                    raise CnfException("Line %d.  Bad header line '%s'.  Not cnf" % (lineNumber, line))
-                try:
-                    self.nvar = int(fields[1])
-                    nclause = int(fields[2])
-                except Exception:
-                    raise CnfException("Line %d.  Bad header line '%s'.  Invalid number of variables or clauses" % (lineNumber, line))
-            else:
-                if nclause == 0:
-                    raise CnfException("Line %d.  No header line.  Not cnf" % (lineNumber))
-                # Check formatting
-                try:
-                    lits = [int(s) for s in line.split()]
-                except:
-                    raise CnfException("Line %d.  Non-integer field" % lineNumber)
-                # Last one should be 0
-                if lits[-1] != 0:
-                    raise CnfException("Line %d.  Clause line should end with 0" % lineNumber)
-                lits = lits[:-1]
-                vars = sorted([abs(l) for l in lits])
-                if len(vars) == 0:
-                    raise CnfException("Line %d.  Empty clause" % lineNumber)                    
-                if vars[-1] > self.nvar or vars[0] == 0:
-                    raise CnfException("Line %d.  Out-of-range literal" % lineNumber)
-                for i in range(len(vars) - 1):
-                    if vars[i] == vars[i+1]:
-                        raise CnfException("Line %d.  Opposite or repeated literal" % lineNumber)
-                self.clauses.append(lits)
-                clauseCount += 1
-        if clauseCount != nclause:
-            raise CnfException("Line %d: Got %d clauses.  Expected %d" % (lineNumber, clauseCount, nclause))
+            self.checkClause(line, lineNumber)
+        raise CnfException("Line %d.  Invalid clause" % lineNumber)
+
+    def checkClause(self, line, lineNumber):
+        if self.nclause == 0:
+            raise CnfException("Line %d.  No header line.  Not cnf" % (lineNumber))
+        # Check formatting
+        try:
+            lits = [int(s) for s in line.split()]
+        except:
+            raise CnfException("Line %d.  Non-integer field" % lineNumber)
+        # Last one should be 0
+        if lits[-1] != 0:
+            raise CnfException("Line %d.  Clause line should end with 0" % lineNumber)
+        lits = lits[:-1]
+        vars = sorted([abs(l) for l in lits])
+        if len(vars) == 0:
+            raise CnfException("Line %d.  Empty clause" % lineNumber)                    
+        if vars[-1] > self.nvar or vars[0] == 0:
+            raise CnfException("Line %d.  Out-of-range literal" % lineNumber)
+        for i in range(len(vars) - 1):
+            if vars[i] == vars[i+1]:
+                raise CnfException("Line %d.  Opposite or repeated literal" % lineNumber)
+        return lits
 
     # Order variables so that each non-input variable is placed right after
     # least-numbered input variable in which both occur in some clause
@@ -432,6 +542,19 @@ class Term:
             validation = self.manager.prover.createClause([newRoot.id], antecedents, comment)
         return Term(self.manager, newRoot, validation)
 
+    # Generate conjunction of two terms, with variables in clause existentially quantified
+    def combineQuantify(self, other, literals):
+        antecedents = [self.validation, other.validation]
+        newRoot, implication = self.manager.andExistsJustify(self.root, other.root, literals)
+        if newRoot == self.manager.leaf0:
+            comment = "Validation of Empty clause"
+        else:
+            comment = "Validation of %s" % newRoot.label()
+        if implication != resolver.tautologyId:
+            antecedents += [implication]
+        validation = self.manager.prover.createClause([newRoot.id], antecedents, comment)
+        return Term(self.manager, newRoot, validation)
+
     def quantify(self, literals, prover):
         antecedents = [self.validation]
         newRoot = self.manager.equant(self.root, literals)
@@ -540,6 +663,12 @@ class NullWriter:
     def write(self, data):
         pass
 
+    def writeLine(self, ilist):
+        pass
+
+    def writeCompressed(self, ilist):
+        pass
+
     def close(self):
         pass
 
@@ -550,6 +679,9 @@ class Prover:
     clauseCount = 0
     lastClauseId = 0
     proofCount = 0
+    # Number of clauses added and not yet deleted, and the maximum of that number
+    liveClauseCount = 0
+    maxLiveClauseCount = 0
     file = None
     writer = None
     opened = False
@@ -557,18 +689,24 @@ class Prover:
     doLrat = False
     doBinary = False
     clauseDict = None
+    fname = None
+    # Length of proof file when last saved to a checkpoint
+    fileOffset = 0
 
-    def __init__(self, fname = None, writer = None, verbLevel = 1, doLrat = False, doBinary = False):
+    # With binary output, encoder gives the function used to write integers (see stream.ProofWriter)
+    def __init__(self, fname = None, writer = None, verbLevel = 1, doLrat = False, doBinary = False, encoder = None):
         self.verbLevel = verbLevel
+        self.fname = fname
+        # Proof output is buffered, and so the prover must be closed once the proof is complete
         if fname is None:
             self.opened = False
-            self.file = StdOutWriter()
+            self.file = stream.ProofWriter(StdOutWriter())
         elif fname == "":
             self.file = NullWriter()
         else:
             self.opened = True
             try:
-                self.file = open(fname, 'wb' if doBinary else 'w')
+                self.file = stream.ProofWriter(stream.openProofFile(fname), encoder = encoder)
             except Exception:
                 raise ProverException("Could not open file '%s'" % fname)
         self.writer = sys.stderr if writer is None else writer
@@ -577,6 +715,8 @@ class Prover:
         self.clauseCount = 0
         self.lastClauseId = 0
         self.proofCount = 0
+        self.liveClauseCount = 0
+        self.maxLiveClauseCount = 0
         if not doLrat:
             self.clauseDict = {}
 
@@ -599,6 +739,8 @@ class Prover:
             return result
         cid = self.lastClauseId
         self.clauseCount += 1
+        self.liveClauseCount += 1
+        self.maxLiveClauseCount = max(self.maxLiveClauseCount, self.liveClauseCount)
         self.comment(comment)
         if self.doLrat:
             first = [cid]
@@ -611,31 +753,25 @@ class Prover:
         ilist = first + middle + rest
         if self.doBinary:
             if not isInput:
-                bytes = stream.CompressArray(ilist).bytes
-                self.file.write(bytes)
+                self.file.writeCompressed(ilist)
+        elif isInput:
+            self.comment(" ".join([str(i) for i in ilist]))
         else:
-            slist = [str(i) for i in ilist]
-            istring = " ".join(slist)
-            if isInput:
-                self.comment(istring)
-            else:
-                self.file.write(istring + '\n')
+            self.file.writeLine(ilist)
         if not self.doLrat:
             self.clauseDict[cid] = result
         return cid
 
     def deleteClauses(self, clauseList):
+        self.liveClauseCount -= len(clauseList)
         if self.doLrat:
             middle = [ord('d')] if self.doBinary else ['d']
             rest = clauseList + [0]
             ilist = [self.clauseCount] + middle + rest
             if self.doBinary:
-                bytes = stream.CompressArray(ilist).bytes
-                self.file.write(bytes)
+                self.file.writeCompressed(ilist)
             else:
-                slist = [str(i) for i in ilist]
-                istring = " ".join(slist)
-                self.file.write(istring + '\n')
+                self.file.writeLine(ilist)
         else:
             for cid in clauseList:
                 clause = self.clauseDict[cid]
@@ -643,12 +779,9 @@ class Prover:
                 rest = clause + [0]
                 ilist = middle + rest
                 if self.doBinary:
-                    bytes = stream.CompressArray(ilist).bytes
-                    self.file.write(bytes)
+                    self.file.writeCompressed(ilist)
                 else:
-                    slist = [str(i) for i in ilist]
-                    istring = " ".join(slist)
-                    self.file.write(istring + '\n')
+                    self.file.writeLine(ilist)
                 
                 
 
@@ -659,14 +792,85 @@ class Prover:
             self.writer.write("Proof Generator Results")
             self.writer.write("  Total Clauses: %d\n" % self.clauseCount)
             self.writer.write("  Input clauses: %d\n" % self.inputClauseCount)
+            self.writer.write("  Live clauses: %d at end, %d maximum\n" % (self.liveClauseCount, self.maxLiveClauseCount))
             if self.verbLevel >= 2:
                 acount = self.clauseCount - self.inputClauseCount - self.proofCount
                 self.writer.write("  Added clauses without antecedents: %d\n" % acount)
                 self.writer.write("  Added clauses requiring proofs: %d\n" % (self.proofCount))
 
+    # Append LRAT proof fragment generated in binary form, with integers written by stream.appendInts,
+    # by another prover starting with the same input clauses.
+    # Clause Ids beyond lastInputId are shifted past the clauses generated so far,
+    # and variables beyond lastInputVariable are shifted to start at nextVariable.
+    # Return pair (clause shift, variable shift)
+    def spliceFragment(self, fname, lastInputId, lastInputVariable, nextVariable):
+        clauseShift = self.lastClauseId - lastInputId
+        variableShift = nextVariable - (lastInputVariable + 1)
+        try:
+            infile = open(fname, 'rb')
+        except Exception:
+            raise ProverException("Could not open proof fragment '%s'" % fname)
+        ints = stream.readInts(infile)
+        infile.close()
+        # Each record has form [id, command, ints, 0] for deletion, or [id, command, lits, 0, hints, 0] for addition
+        findZero = ints.index
+        pos = 0
+        while pos < len(ints):
+            cid = ints[pos]
+            command = ints[pos+1]
+            mid = findZero(0, pos+2)
+            if command == ord('d'):
+                self.deleteClauses([id + clauseShift if id > lastInputId else id for id in ints[pos+2:mid]])
+                pos = mid + 1
+                continue
+            end = findZero(0, mid+1)
+            lits = [lit + variableShift if lit > lastInputVariable else lit - variableShift if lit < -lastInputVariable else lit for lit in ints[pos+2:mid]]
+            # Negative hints occur in RAT steps
+            hints = [id + clauseShift if id > lastInputId else id - clauseShift if id < -lastInputId else id for id in ints[mid+1:end]]
+            pos = end + 1
+            self.lastClauseId = cid + clauseShift
+            self.clauseCount += 1
+            self.liveClauseCount += 1
+            self.maxLiveClauseCount = max(self.maxLiveClauseCount, self.liveClauseCount)
+            if self.doBinary:
+                self.file.writeCompressed([self.lastClauseId, ord('a')] + lits + [0] + hints + [0])
+            else:
+                self.file.writeLine([self.lastClauseId] + lits + [0] + hints + [0])
+        return (clauseShift, variableShift)
+
+    # Flush any buffered output and close the proof file
+    def close(self):
+        self.file.close()
+
+    # Saving to a checkpoint records the proof file by its name and length.
+    # Requires the proof to be written to an uncompressed file
+    def __getstate__(self):
+        if not self.opened or stream.splitCodec(self.fname)[1] is not None:
+            raise ProverException("Checkpoints require an uncompressed proof file")
+        self.file.sync()
+        self.fileOffset = self.file.byteCount
+        state = self.__dict__.copy()
+        state["file"] = None
+        return state
+
+    # Reopen proof file after loading from checkpoint.
+    # Any output following the checkpoint is discarded
+    def resume(self):
+        try:
+            file = open(self.fname, 'r+b')
+        except Exception:
+            raise ProverException("Could not reopen file '%s'" % self.fname)
+        if file.seek(0, 2) < self.fileOffset:
+            file.close()
+            raise ProverException("File '%s' is shorter than when checkpoint was saved" % self.fname)
+        file.truncate(self.fileOffset)
+        file.seek(self.fileOffset)
+        self.file = stream.ProofWriter(file)
+        self.file.byteCount = self.fileOffset
+
     def __del__(self):
-        if self.opened:
-            self.file.close()
+        if self.file is not None:
+            self.close()
 
 
 
@@ -708,7 +912,7 @@ class Solver:
     constraintSystem = None
 
 
-    def __init__(self, fname = None, prover = None, permuter = None, verbLevel = 1):
+    def __init__(self, fname = None, prover = None, permuter = None, verbLevel = 1, cacheLimits = None):
         self.verbLevel = verbLevel
         if prover is None:
             prover = Prover(verbLevel = verbLevel)
@@ -732,7 +936,7 @@ class Solver:
         self.prover.inputDone()
 
         self.manager = bdd.Manager(prover = self.prover, rootGenerator = self.rootGenerator,
-                                   nextNodeId = reader.nvar+1, verbLevel = verbLevel)
+                                   nextNodeId = reader.nvar+1, verbLevel = verbLevel, cacheLimits = cacheLimits)
         # Generate BDD representations of literals
         if permuter is None:
             # Default is identity permutation
@@ -754,7 +958,7 @@ class Solver:
         for clause in reader.clauses:
             self.termCount += 1
             litList = [self.litMap[v] for v in clause]
-            root, validation = self.manager.constructClause(self.termCount, litList)
+            root, validation = self.manager.constructClauseBdd(self.termCount, litList)
             term = Term(self.manager, root, validation)
             self.inputIds[self.termCount] = term
             self.activeIds[self.termCount] = term
@@ -822,6 +1026,31 @@ class Solver:
         self.removeTerm(id)
         return self.termCount
 
+    # Conjoin terms and quantify variables in single operation
+    def combineQuantifyTerms(self, id1, id2, varList):
+        termA = self.getTerm(id1)
+        termB = self.getTerm(id2)
+        litList = [self.litMap[v] for v in varList]
+        clause = self.manager.buildClause(litList)
+        newTerm = termA.combineQuantify(termB, clause)
+        self.termCount += 1
+        vstring = " ".join(sorted([str(v) for v in varList]))
+        comment = "T%d (Node %s) & T%d (Node %s) EQuant(%s) --> T%d (Node %s)" % (id1, termA.root.label(), id2, termB.root.label(),
+                                                                                 vstring, self.termCount, newTerm.root.label())
+        self.prover.comment(comment)
+        if self.prover.fileOutput() and self.verbLevel >= 3:
+            self.writer.write("Combine and quantify: %s\n" % (comment))
+        self.activeIds[self.termCount] = newTerm
+        self.removeTerm(id1)
+        self.removeTerm(id2)
+        if newTerm.root == self.manager.leaf0:
+            if self.prover.fileOutput() and self.verbLevel >= 1:
+                self.writer.write("UNSAT\n")
+            self.unsat = True
+            self.manager.summarize()
+            return -1
+        return self.termCount
+
     def runNoSchedule(self):
         nid = 0
         while (len(self.activeIds) > 1):
@@ -1019,7 +1248,12 @@ class Solver:
                 id1 = buckets[blevel][0]
                 id2 = buckets[blevel][1]
                 buckets[blevel] = buckets[blevel][2:]
-                newId = self.combineTerms(id1, id2)
+                if len(buckets[blevel]) == 0 and blevel > 0:
+                    # Final conjunction.  Quantify top variable while conjoining
+                    vid = self.manager.variables[blevel-1].id
+                    newId = self.combineQuantifyTerms(id1, id2, [vid])
+                else:
+                    newId = self.combineTerms(id1, id2)
                 if newId < 0:
                     # Hit unsat case
                     return "unsatisfiable"
@@ -1070,7 +1304,11 @@ class Solver:
                 id1 = buckets[bid][0]
                 id2 = buckets[bid][1]
                 buckets[bid] = buckets[bid][2:]
-                newId = self.combineTerms(id1, id2)
+                if len(buckets[bid]) == 0 and bid > 0:
+                    # Final conjunction.  Quantify variable while conjoining
+                    newId = self.combineQuantifyTerms(id1, id2, [vid])
+                else:
+                    newId = self.combineTerms(id1, id2)
                 if newId < 0:
                     # Hit unsat case
                     return "unsatisfiable"
@@ -1090,6 +1328,8 @@ class Solver:
         ilist = sorted(self.activeIds.keys())
         tlist = [self.activeIds[id] for id in ilist]
         rootList = [t.root for t in tlist]
+        # Cached literals must survive GC, since their node handles would otherwise be recycled
+        rootList += list(self.litMap.values())
         if self.equationSystem is not None:
             rootList += self.equationSystem.rset.rootList()
             rootList += self.equationSystem.eset.rootList()
@@ -1180,8 +1420,9 @@ def run(name, args):
     logName = None
     modulus = pseudoboolean.modulusAuto
     nzLimit = None
+    cacheLimits = None
 
-    optlist, args = getopt.getopt(args, "hbB:v:r:i:o:M:p:s:m:L:t:Z:")
+    optlist, args = getopt.getopt(args, "hbB:v:r:i:o:M:p:s:m:L:t:Z:c:")
     for (opt, val) in optlist:
         if opt == '-h':
             usage(name)
@@ -1202,7 +1443,7 @@ def run(name, args):
             setlimit(int(val))
         elif opt == '-o':
             proofName = val
-            extension = proofName.split('.')[-1]
+            extension = stream.proofExtension(proofName)
             if extension == 'lrat' or extension == 'lratb':
                 doLrat = True
                 doBinary = extension[-1] == 'b'
@@ -1232,6 +1473,13 @@ def run(name, args):
             logName = val
         elif opt == '-Z':
             nzLimit = int(val)
+        elif opt == '-c':
+            try:
+                cacheLimits = bdd.parseCacheLimits(val)
+            except bdd.BddException as ex:
+                sys.stderr.write("%s\n" % str(ex))
+                usage(name)
+                return
         else:
             sys.stderr.write("Unknown option '%s'\n" % opt)
             usage(name)
@@ -1253,7 +1501,7 @@ def run(name, args):
         return
 
     start = datetime.datetime.now()
-    solver = Solver(cnfName, prover = prover, permuter = permuter, verbLevel = verbLevel)
+    solver = Solver(cnfName, prover = prover, permuter = permuter, verbLevel = verbLevel, cacheLimits = cacheLimits)
     if doBucket:
         status = solver.runBucketSchedule()
     elif bpermuter is not None:
@@ -1267,6 +1515,7 @@ def run(name, args):
     seconds = delta.seconds + 1e-6 * delta.microseconds
     if verbLevel > 0:
         writer.write("Elapsed time for SAT: %.2f seconds (status = %s)\n" % (seconds, str(status).upper()))
+    prover.close()
     if writer != sys.stderr:
         writer.close()
     
@@ -23,6 +23,11 @@
 
 import binascii
 import sys
+import os
+import gzip
+import bz2
+import lzma
+from array import array
 
 class Logger:
     outFile = None
@@ -70,7 +75,7 @@ class CompressArray:
             ab = b & 0x7F;
             u += ab << weight
             if b < 128:
-                x = u//2 if u & 0x1 == 0 else -u//2
+                x = u//2 if u & 0x1 == 0 else -(u//2)
                 result.append(x)
                 weight = 0
                 u = 0
@@ -88,3 +93,132 @@ class CompressArray:
         return len(self.bytes)
 
     
+
+# Append compressed representation of integers to byte array.
+# Same encoding as CompressArray
+def compressInto(buffer, ilist):
+    for x in ilist:
+        u = 2*x if x >= 0 else 2*(-x) + 1
+        while u >= 128:
+            buffer.append((u & 0x7F) + 128)
+            u >>= 7
+        buffer.append(u)
+
+# Append integers to byte array as fixed-width native values.
+# Used for proof fragments passed between processes on the same machine,
+# since they can be read back without decoding each byte
+def appendInts(buffer, ilist):
+    buffer += array('q', ilist).tobytes()
+
+# Read entire file of integers written with appendInts
+def readInts(file):
+    ints = array('q')
+    ints.frombytes(file.read())
+    return ints
+
+# Decode sequence of integers from stream of compressed bytes
+def decompressStream(file, blockSize = 1 << 20):
+    u = 0
+    weight = 0
+    while True:
+        chunk = file.read(blockSize)
+        if len(chunk) == 0:
+            break
+        for b in chunk:
+            if b < 128:
+                u += b << weight
+                yield -(u >> 1) if u & 0x1 else u >> 1
+                u = 0
+                weight = 0
+            else:
+                u += (b & 0x7F) << weight
+                weight += 7
+
+# Compression codecs for proof files, selected by file name suffix.
+# Each maps to a function that opens the named file in the given mode ('rb' or 'wb').
+# The returned object must support read or write, plus close
+proofCodecs = {
+    "gz"  : lambda fname, mode: gzip.open(fname, mode, compresslevel = 6),
+    "bz2" : lambda fname, mode: bz2.open(fname, mode),
+    "xz"  : lambda fname, mode: lzma.open(fname, mode),
+}
+
+def registerCodec(suffix, opener):
+    proofCodecs[suffix] = opener
+
+# Split file name into base name and codec suffix (None if uncompressed)
+def splitCodec(fname):
+    fields = fname.split('.')
+    if len(fields) > 1 and fields[-1] in proofCodecs:
+        return ('.'.join(fields[:-1]), fields[-1])
+    return (fname, None)
+
+# Extension of file name, ignoring any codec suffix
+def proofExtension(fname):
+    base, codec = splitCodec(fname)
+    return base.split('.')[-1]
+
+# Open file for writing (or reading) binary data, compressing according to its suffix
+def openProofFile(fname, mode = 'wb'):
+    base, codec = splitCodec(fname)
+    if codec is None:
+        return open(fname, mode)
+    return proofCodecs[codec](fname, mode)
+
+# Accumulate proof output in byte array and pass it to underlying file in large blocks
+class ProofWriter:
+    file = None
+    buffer = None
+    # Flush once buffer holds this many bytes
+    blockSize = 1 << 20
+    byteCount = 0
+    closed = False
+    # Function to append binary form of integers to buffer
+    encoder = None
+
+    def __init__(self, file, blockSize = None, encoder = None):
+        self.file = file
+        self.buffer = bytearray()
+        if blockSize is not None:
+            self.blockSize = blockSize
+        self.byteCount = 0
+        self.closed = False
+        self.encoder = compressInto if encoder is None else encoder
+
+    # Write string or bytes
+    def write(self, data):
+        if type(data) is str:
+            data = data.encode('ascii')
+        self.buffer += data
+        if len(self.buffer) >= self.blockSize:
+            self.flush()
+
+    # Write integers as line of text
+    def writeLine(self, ilist):
+        self.buffer += (" ".join(map(str, ilist)) + '\n').encode('ascii')
+        if len(self.buffer) >= self.blockSize:
+            self.flush()
+
+    # Write integers in binary form.  Compressed unless writer has another encoder
+    def writeCompressed(self, ilist):
+        self.encoder(self.buffer, ilist)
+        if len(self.buffer) >= self.blockSize:
+            self.flush()
+
+    def flush(self):
+        if len(self.buffer) > 0:
+            self.file.write(self.buffer)
+            self.byteCount += len(self.buffer)
+            del self.buffer[:]
+
+    # Flush all output through to the disk, so that byteCount gives the length of the file
+    def sync(self):
+        self.flush()
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def close(self):
+        if not self.closed:
+            self.flush()
+            self.file.close()
+            self.closed = True